@@ -315,6 +315,29 @@ ADD_REVERSION_ADMIN = True
 REPO_DIR = str(ROOT_DIR / "deployment_assets" / "repos")
 DEPLOYMENT_DIR = str(ROOT_DIR / "deployment_assets" / "workdirs")
 NON_REPO_FILES_DIR = str(ROOT_DIR / "deployment_assets" / "non_repo_files")
+RESULTS_EXPORT_DIR = env("RESULTS_EXPORT_DIR", default="/results_export")
+# Per process LRU in front of the cached jspsych context, see experiments.utils.context_cache
+EXPERIMENT_CONTEXT_LOCAL_SIZE = 256
+EXPERIMENT_CONTEXT_LOCAL_TTL = 300
+# Threads used to pre-deploy experiment worktrees when a battery is published
+DEPLOY_WORKERS = 4
+# Per process writers for experiments.views.ResultIngest, and how many
+# intermediate syncs may wait for them before new ones are refused
+RESULT_INGEST_WORKERS = 4
+RESULT_INGEST_QUEUE_SIZE = 200
+# Maximum queries per request for participant facing views, by url name. Checked
+# by expfactory_deploy.utils.query_budget in tests and, when enabled, its middleware.
+QUERY_BUDGETS = {
+    "experiments:serve-battery": 12,
+    "experiments:consent": 8,
+    "experiments:push-results": 12,
+    "experiments:ingest-results": 12,
+    "prolific:serve-battery": 12,
+    "prolific:consent": 8,
+    "prolific:collection-progress": 12,
+}
+# A statement repeated this many times in one request is reported as an N+1.
+QUERY_BUDGET_REPEAT_LIMIT = 3
 
 # These values are determined by the nginx.conf location directives
 STATIC_DEPLOYMENT_URL = "/deployment/repo/"
@@ -336,6 +359,25 @@ PROLIFIC_PARTICIPANT_PARAM="participant"
 PROLIFIC_STUDY_PARAM="study"
 PROLIFIC_SESSION_PARAM="session"
 
+# Prolific API client, rates are per process
+PROLIFIC_API_RATE = 10  # requests per second
+PROLIFIC_API_BURST = 20
+PROLIFIC_API_CONCURRENCY = 8
+PROLIFIC_API_TIMEOUT = 30
+PROLIFIC_API_MAX_ATTEMPTS = 4
+# Seconds, base and cap of the exponential backoff between retries
+PROLIFIC_API_BACKOFF = 1
+PROLIFIC_API_BACKOFF_MAX = 30
+# Seconds a resolved participant (subject, assignment, group index, consent) stays cached
+PROLIFIC_PARTICIPANT_CACHE_TIMEOUT = 60 * 60 * 6
+# Seconds progress of a bulk participant upload stays visible on the collection subject list
+ONBOARDING_PROGRESS_TIMEOUT = 60 * 60 * 24
+# prolific.timers.sweep, run every minute by the prolific-timer-sweep schedule
+PROLIFIC_TIMER_BATCH_SIZE = 50
+PROLIFIC_TIMER_SWEEP_SECONDS = 60
+# Seconds after which claimed timers that never fired are assumed lost and run again
+PROLIFIC_TIMER_CLAIM_TIMEOUT = 60 * 10
+
 
 Q_CLUSTER = {
     'name': 'DjangORM',
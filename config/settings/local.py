@@ -44,6 +44,8 @@ SERVER_EMAIL = "admin@mg.expfactory.org"
 INSTALLED_APPS += ["debug_toolbar"]  # noqa F405
 # https://django-debug-toolbar.readthedocs.io/en/latest/installation.html#middleware
 MIDDLEWARE += ["debug_toolbar.middleware.DebugToolbarMiddleware"]  # noqa F405
+# Log requests that exceed QUERY_BUDGETS or repeat queries
+MIDDLEWARE.insert(0, "expfactory_deploy.utils.query_budget.QueryBudgetMiddleware")  # noqa F405
 # https://django-debug-toolbar.readthedocs.io/en/latest/configuration.html#debug-toolbar-config
 DEBUG_TOOLBAR_CONFIG = {
     "DISABLE_PANELS": ["debug_toolbar.panels.redirects.RedirectsPanel"],
@@ -0,0 +1,194 @@
+import json
+import math
+
+import numpy as np
+import pandas
+
+from analysis.default_qa import apply_qa_funcs, feedback_generator
+
+'''
+Vectorized version of default_qa. All results for a task are concatenated
+into one frame indexed by result id and the per result metrics of
+apply_qa_funcs are computed with groupby. Tasks with bespoke metrics (span,
+surveys, feedback) and results that would make the per result functions raise
+(missing columns, no test trials) still go through apply_qa_funcs so their
+output and errors match exactly.
+'''
+
+SPAN_TASKS = ["simple_span_rdoc", "operation_span_rdoc", "span_rdoc__behavioral"]
+
+
+def is_survey(task_name):
+    return "survey" in task_name or "questionnaire" in task_name or "dsm5" in task_name
+
+
+def vectorized_task(task_name):
+    return not (
+        is_survey(task_name)
+        or "feedback" in task_name
+        or task_name in SPAN_TASKS
+    )
+
+
+def required_columns(task_name):
+    columns = {"trial_id", "correct_trial", "rt"}
+    if task_name == "stop_signal_rdoc":
+        columns |= {"condition", "SSD"}
+    elif task_name == "go_nogo_rdoc":
+        columns.add("response")
+    elif task_name == "n_back_rdoc":
+        columns |= {"response", "condition"}
+    return columns
+
+
+def trial_frame(data):
+    """ Per result DataFrame from a decoded result payload, None if there is
+        no trial data.
+    """
+    if "trialdata" not in data:
+        return None
+    trialdata = data["trialdata"]
+    if type(trialdata) == str:
+        trialdata = json.loads(trialdata)
+    return pandas.DataFrame(trialdata)
+
+
+def clean_metrics(metrics):
+    """ Make metrics JSON friendly, NaN becomes None and numpy scalars become
+        python numbers.
+    """
+    if metrics is None:
+        return metrics
+    for key in metrics:
+        if type(metrics[key]) is str:
+            try:
+                metrics[key] = json.loads(metrics[key])
+            except json.decoder.JSONDecodeError:
+                continue
+        if metrics[key] is None:
+            continue
+        try:
+            if math.isnan(metrics[key]):
+                metrics[key] = None
+            elif isinstance(metrics[key], np.integer):
+                metrics[key] = int(metrics[key])
+            elif isinstance(metrics[key], np.floating):
+                metrics[key] = float(metrics[key])
+        except TypeError:
+            continue
+    return metrics
+
+
+def _n_back_check(frame, test, ids):
+    """ Proportion of test responses equal to the response that is correct on
+        mismatch trials. Results where that response can't be found are left
+        out so they fall back to check_n_back_responses.
+    """
+    mismatch = frame[(frame["correct_trial"] == 1) & (frame["condition"] == "mismatch")]
+    # first row rather than groupby().first(), which would skip missing responses
+    mismatch_response = mismatch.drop_duplicates("result_id").set_index("result_id")["response"]
+    counts = test.groupby("result_id", sort=False)["response"].value_counts()
+    totals = test.groupby("result_id", sort=False)["response"].count()
+    checks = {}
+    for result_id in ids:
+        if result_id not in mismatch_response.index:
+            continue
+        response = mismatch_response[result_id]
+        if pandas.isna(response) or (result_id, response) not in counts.index:
+            continue
+        checks[result_id] = counts[(result_id, response)] / totals[result_id]
+    return checks
+
+
+def vectorized_metrics(task_name, frame):
+    """ Metrics for every result in a concatenated frame with a result_id
+        column. Returns {result_id: metrics} for the results it could handle.
+    """
+    ids = list(frame["result_id"].unique())
+    frame = frame.assign(
+        correct_trial=frame["correct_trial"].astype(float),
+        rt=frame["rt"].astype(float),
+    )
+    test = frame[frame["trial_id"] == "test_trial"]
+    by_result = test.groupby("result_id", sort=False)
+    attention = (
+        frame[frame["trial_id"] == "test_attention_check"]
+        .groupby("result_id", sort=False)["correct_trial"].mean()
+    )
+
+    columns = {"attention_check_accuracy": attention}
+    if task_name == "stop_signal_rdoc":
+        go = test[test["condition"] == "go"]
+        go_by_result = go.groupby("result_id", sort=False)
+        stop = test[test["condition"] == "stop"]
+        columns.update({
+            "go_accuracy": go_by_result["correct_trial"].mean(),
+            "omissions": go["rt"].isna().groupby(go["result_id"], sort=False).mean(),
+            "stop_accuracy": stop.groupby("result_id", sort=False)["correct_trial"].mean(),
+            "rt": go[go["correct_trial"] == 1].groupby("result_id", sort=False)["rt"].mean(),
+            "max_SSD": by_result["SSD"].max(),
+            "min_SSD": by_result["SSD"].min(),
+            "mean_SSD": by_result["SSD"].mean(),
+        })
+        columns["accuracy"] = columns["go_accuracy"]
+    else:
+        columns.update({
+            "accuracy": by_result["correct_trial"].mean(),
+            "rt": test[test["correct_trial"] == 1].groupby("result_id", sort=False)["rt"].mean(),
+            "omissions": test["rt"].isna().groupby(test["result_id"], sort=False).mean(),
+        })
+
+    check_response = None
+    if task_name == "go_nogo_rdoc":
+        check_response = (test["response"] == " ").groupby(test["result_id"], sort=False).mean()
+    elif task_name == "n_back_rdoc":
+        check_response = _n_back_check(frame, test, ids)
+
+    metrics = {}
+    for result_id in ids:
+        result_metrics = {key: values.get(result_id, np.nan) for key, values in columns.items()}
+        if check_response is None:
+            result_metrics["check_response"] = None
+        elif result_id in check_response:
+            result_metrics["check_response"] = check_response[result_id]
+        else:
+            continue
+        metrics[result_id] = result_metrics
+    return metrics
+
+
+def task_qa(task_name, frames):
+    """ QA for many results of the same task. frames maps result id to that
+        result's trial DataFrame. Returns {result_id: (metrics, feedback, error)}
+        with the same values apply_qa_funcs would produce.
+    """
+    qa = {}
+    vector_ids = []
+    if task_name and vectorized_task(task_name):
+        required = required_columns(task_name)
+        for result_id, frame in frames.items():
+            if required.issubset(frame.columns) and (frame["trial_id"] == "test_trial").any():
+                vector_ids.append(result_id)
+
+    if vector_ids:
+        frame = pandas.concat(
+            [frames[x] for x in vector_ids], keys=vector_ids, names=["result_id", None]
+        ).reset_index(level="result_id")
+        try:
+            vector_metrics = vectorized_metrics(task_name, frame)
+        except Exception:
+            # Unexpected dtypes and the like, the per result path will report it.
+            vector_metrics = {}
+        for result_id, metrics in vector_metrics.items():
+            feedback = ""
+            error = None
+            try:
+                feedback = feedback_generator(task_name, **metrics)
+            except Exception as e:
+                error = e
+            qa[result_id] = (metrics, feedback, error)
+
+    for result_id, frame in frames.items():
+        if result_id not in qa:
+            qa[result_id] = apply_qa_funcs(task_name, frame)
+    return qa
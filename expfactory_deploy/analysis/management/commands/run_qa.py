@@ -1,40 +1,127 @@
-import ast
-import json
-import math
-import pandas
+import os
 
 from django.core.management.base import BaseCommand, CommandError
-from django.db.models import Exists, F, OuterRef
+from django.db.models import Exists, F, OuterRef, TextField
+from django.db.models.functions import Cast
 
 from prolific import models as pm
 from experiments import models as em
+from experiments.utils import payload
+from experiments.utils.fork_pool import run_forked
 from analysis.models import ResultQA
-from analysis.default_qa import apply_qa_funcs
+from analysis.batch_qa import clean_metrics, task_qa, trial_frame
+
+# Number of results of a single task concatenated into one frame. Payloads can
+# be several megabytes decoded and each worker holds one batch at a time.
+QA_CHUNK_SIZE = 50
 
 
 class Command(BaseCommand):
-    help = "Run QA for Results of study/battery/collection"
+    help = "Run QA for Results of the given study collections"
 
     def add_arguments(self, parser):
-        parser.add_argument("ids", nargs="+", type=int)
+        parser.add_argument("ids", nargs="+", type=int, help="Study collection ids.")
+        parser.add_argument(
+            "--rerun", action="store_true", help="Recompute QA for results that already have it."
+        )
+        parser.add_argument("--workers", type=int, default=os.cpu_count())
+        parser.add_argument("--batch-size", type=int, default=QA_CHUNK_SIZE)
 
     def handle(self, *args, **options):
         for id in options["ids"]:
-            pass
-            # pm.StudyCollection.objects
-            # ResultQA.objects.filter
+            if not pm.StudyCollection.objects.filter(id=id).exists():
+                raise CommandError(f"Study collection {id} does not exist")
+            count = study_collection_qa(
+                id,
+                options["rerun"],
+                workers=options["workers"],
+                chunk_size=options["batch_size"],
+                log=self.stdout.write,
+            )
+            self.stdout.write(self.style.SUCCESS(f"study collection {id}: ran QA on {count} results"))
 
 
-def study_collection_qa(id, rerun=False):
+def study_collection_qa(id, rerun=False, **kwargs):
     results_qs = em.Result.objects.filter(
         subject__studycollectionsubject__study_collection=id
     )
 
-    run_qa(results_qs, rerun)
+    return run_qa(results_qs, rerun, **kwargs)
+
+
+def save_qa(qa):
+    ResultQA.objects.bulk_create(
+        [
+            ResultQA(
+                exp_result_id=result_id,
+                qa_result=clean_metrics(metrics),
+                error=None if error is None else str(error),
+                feedback=str(feedback),
+            )
+            for result_id, (metrics, feedback, error) in qa.items()
+        ],
+        update_conflicts=True,
+        unique_fields=["exp_result"],
+        update_fields=["qa_result", "error", "feedback", "modified"],
+    )
+
+
+def fetch_payloads(result_ids):
+    """ Raw payload columns and delta sync chunks, json_data as text so
+        decoding can happen in a worker process.
+    """
+    chunks = em.Result.chunks_for(result_ids)
+    rows = (
+        em.Result.objects.filter(id__in=result_ids)
+        .annotate(json_text=Cast("json_data", output_field=TextField()))
+        .values_list("id", "json_text", "data")
+    )
+    return [(*row, chunks.get(row[0], [])) for row in rows]
+
 
+def qa_results(task_name, result_ids):
+    """ Load, decode and run QA on the payloads of result_ids. Runs in worker
+        processes, so it only returns picklable values.
+    """
+    frames = {}
+    qa = {}
+    for result_id, json_text, data, chunks in fetch_payloads(result_ids):
+        try:
+            decoded = payload.decode(json_text if json_text is not None else data)
+            frame = trial_frame(em.Result.merge_chunks(decoded, chunks))
+        except (ValueError, SyntaxError, MemoryError, RecursionError) as e:
+            qa[result_id] = ({}, "", e)
+            continue
+        if frame is not None:
+            frames[result_id] = frame
+    qa.update(task_qa(task_name, frames))
+    return {
+        result_id: (clean_metrics(metrics), feedback, None if error is None else str(error))
+        for result_id, (metrics, feedback, error) in qa.items()
+    }
+
+
+def qa_batches(results, chunk_size):
+    """ Stream (task_name, result ids) batches, never mixing tasks. """
+    batch = []
+    batch_task = None
+    rows = results.values_list("id", "task_name").order_by("task_name", "id")
+    for result_id, task_name in rows.iterator(chunk_size=2000):
+        if batch and (task_name != batch_task or len(batch) == chunk_size):
+            yield batch_task, batch
+            batch = []
+        batch_task = task_name
+        batch.append(result_id)
+    if batch:
+        yield batch_task, batch
 
-def run_qa(results, rerun=False):
-    import numpy as np
+
+def run_qa(results, rerun=False, workers=1, chunk_size=QA_CHUNK_SIZE, log=None):
+    """ Compute ResultQA for results. With more than one worker loading,
+        decoding and QA run in a process pool with at most workers * 2 batches
+        of result ids in flight, while results are saved from this process.
+        Returns the number of results QA was saved for.
+    """
     if rerun is False:
         results = results.filter(
             ~Exists(ResultQA.objects.filter(exp_result=OuterRef("pk")))
@@ -43,39 +130,28 @@ def run_qa(results, rerun=False):
     results = results.annotate(
         task_name=F("battery_experiment__experiment_instance__experiment_repo_id__name")
     )
+    batches = qa_batches(results, chunk_size)
+    saved = 0
 
-    for result in results:
-        data = ast.literal_eval(result.data)
-        if "trialdata" not in data:
-            continue
-        trialdata = data["trialdata"]
-        if type(trialdata) == str:
-            task_data = pandas.DataFrame(json.loads(trialdata))
-        else:
-            task_data = pandas.DataFrame(trialdata)
-        task_name = result.task_name
-        metrics, feedback, error = apply_qa_funcs(task_name, task_data)
-
-        if metrics != None:
-            for key in metrics:
-                if type(metrics[key]) is str:
-                    try:
-                        metrics[key] = json.loads(metrics[key])
-                    except json.decoder.JSONDecodeError:
-                        continue
-                if metrics[key] is None:
-                    continue
-                try:
-                    if math.isnan(metrics[key]):
-                        metrics[key] = None
-                    elif isinstance(metrics[key], np.integer):
-                        metrics[key] = int(metrics[key])
-                    elif isinstance(metrics[key], np.float_):
-                        metrics[key] = float(metrics[key])
-                except TypeError:
-                    continue
-
-        ResultQA.objects.update_or_create(
-            exp_result=result,
-            defaults={"qa_result": metrics, "error": error, "feedback": feedback},
-        )
+    if not workers or workers < 2:
+        for task_name, result_ids in batches:
+            qa = qa_results(task_name, result_ids)
+            save_qa(qa)
+            saved += len(qa)
+            if log:
+                log(f"ran QA on {saved} results")
+        return saved
+
+    def jobs():
+        for task_name, result_ids in batches:
+            yield (task_name, result_ids), None
+
+    def on_done(qa, _):
+        nonlocal saved
+        save_qa(qa)
+        saved += len(qa)
+        if log:
+            log(f"ran QA on {saved} results")
+
+    run_forked(qa_results, jobs(), on_done, workers)
+    return saved
@@ -1,42 +1,42 @@
-from datetime import datetime, timedelta
-
 from django.conf import settings
-from django.core.mail import EmailMessage, mail_managers
-from django.db.models import Exists, F, OuterRef
+from django.core.mail import EmailMessage
 from django.urls import reverse
 
-from django_q.tasks import schedule
+from django_q.tasks import async_task
 
 from analysis.management.commands.run_qa import run_qa
 from experiments.models import Result
 
-def run_qa_chunk(sc_id, offset_id, size, delay):
-    results = Result.objects.filter(
-        subject__studycollectionsubject__study_collection=sc_id,
-        id__gt=offset_id
-    )[:size]
-    results = results.annotate(
-        task_name=F("battery_experiment__experiment_instance__experiment_repo_id__name")
-    )
+# Results rerun per task, small enough to finish within the cluster timeout.
+QA_RERUN_CHUNK_SIZE = 100
+
 
-    if not results and offset_id != 0:
-        message = EmailMessage(
-            f"QA Rerun Complete for study collection {sc_id}",
-            f"{reverse('analysis:qa-by-sc', kwargs={'id': sc_id})}",
-            settings.SERVER_EMAIL,
-            [a[1] for a in settings.MANAGERS]
-        )
-        message.send()
-    if not results:
+def run_qa_chunk(sc_id, offset_id=0, size=QA_RERUN_CHUNK_SIZE):
+    """ Rerun QA for the next size results of a study collection after
+        offset_id, then queue the chunk after it. Managers are emailed once
+        the last chunk is done.
+    """
+    result_ids = list(
+        Result.objects.filter(
+            subject__studycollectionsubject__study_collection=sc_id,
+            id__gt=offset_id
+        ).order_by("id").values_list("id", flat=True)[:size]
+    )
+    if result_ids:
+        run_qa(Result.objects.filter(id__in=result_ids), rerun=True)
+    if len(result_ids) == size:
+        async_task("analysis.tasks.run_qa_chunk", sc_id, result_ids[-1], size)
         return
 
-    run_qa(results, rerun=True)
+    message = EmailMessage(
+        f"QA Rerun Complete for study collection {sc_id}",
+        f"{reverse('analysis:qa-by-sc', kwargs={'id': sc_id})}",
+        settings.SERVER_EMAIL,
+        [a[1] for a in settings.MANAGERS]
+    )
+    message.send()
+
 
-    schedule(
-        "analysis.tasks.run_qa_chunk",
-            sc_id,
-            results.last().id,
-            size,
-            delay,
-            next_run=datetime.now() + delay,
-        )
+def qa_result(result_id):
+    """ Compute QA for a single result, queued when the result is completed. """
+    run_qa(Result.objects.filter(id=result_id), rerun=True)
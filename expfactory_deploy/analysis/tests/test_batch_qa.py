@@ -0,0 +1,128 @@
+import random
+from io import StringIO
+
+import pandas
+import pytest
+from django.core.management import call_command
+
+from analysis.batch_qa import clean_metrics, task_qa
+from analysis.default_qa import apply_qa_funcs
+from analysis.models import ResultQA
+from analysis.tasks import qa_result, run_qa_chunk
+from experiments import models as em
+from experiments.tests.test_models import all_models
+from prolific import models as pm
+from prolific.tests.test_models import prolific_models
+
+
+def make_trials(rng, task_name, n=40):
+    return pandas.DataFrame(make_trial_records(rng, task_name, n))
+
+
+def make_trial_records(rng, task_name, n=40):
+    trials = []
+    for i in range(n):
+        trial_id = rng.choice(["test_trial", "test_trial", "test_attention_check", "practice_trial"])
+        correct = rng.choice([0, 1, 1])
+        trial = {
+            "trial_id": trial_id,
+            "correct_trial": correct,
+            "rt": rng.choice([None, rng.randint(200, 1200)]),
+            "response": rng.choice([" ", "f", "j", None]),
+            "condition": rng.choice(["go", "stop", "match", "mismatch"]),
+            "SSD": rng.randint(50, 500),
+        }
+        trials.append(trial)
+    if task_name == "n_back_rdoc":
+        trials.append({
+            "trial_id": "test_trial", "correct_trial": 1, "rt": 400,
+            "response": "j", "condition": "mismatch", "SSD": 0,
+        })
+    return trials
+
+
+def assert_same(batch, single):
+    metrics, feedback, error = batch
+    expected_metrics, expected_feedback, expected_error = single
+    assert feedback == expected_feedback
+    assert repr(error) == repr(expected_error)
+    metrics, expected_metrics = clean_metrics(metrics), clean_metrics(expected_metrics)
+    assert list(metrics) == list(expected_metrics)
+    for key in metrics:
+        assert metrics[key] == pytest.approx(expected_metrics[key], nan_ok=True)
+
+
+@pytest.mark.parametrize("task_name", [
+    "flanker_rdoc", "go_nogo_rdoc", "n_back_rdoc", "stop_signal_rdoc", "simple_span_rdoc", "not_a_task",
+])
+def test_task_qa_matches_apply_qa_funcs(task_name):
+    rng = random.Random(task_name)
+    frames = {i: make_trials(rng, task_name) for i in range(1, 8)}
+    # no test trials and a missing column both go through the per result path
+    frames[8] = frames[1][frames[1]["trial_id"] != "test_trial"]
+    frames[9] = frames[2].drop(columns=["rt"])
+
+    batch = task_qa(task_name, frames)
+    assert set(batch) == set(frames)
+    for result_id, frame in frames.items():
+        assert_same(batch[result_id], apply_qa_funcs(task_name, frame))
+
+
+@pytest.mark.django_db
+def test_run_qa_command(all_models, prolific_models):
+    study_collection = pm.StudyCollection.objects.get(name="test sc")
+    assignment = em.Assignment.objects.first()
+    batt_exp = em.BatteryExperiments.objects.first()
+    trials = make_trial_records(random.Random(0), "flanker_rdoc")
+    results = [
+        em.Result.objects.create(
+            assignment=assignment, battery_experiment=batt_exp, subject=assignment.subject,
+            status="completed", json_data={"trialdata": trials},
+        ),
+        em.Result.objects.create(
+            assignment=assignment, battery_experiment=batt_exp, subject=assignment.subject,
+            status="completed", data=str({"trialdata": trials}),
+        ),
+        em.Result.objects.create(
+            assignment=assignment, battery_experiment=batt_exp, subject=assignment.subject,
+            status="completed", data="{'trialdata': [",
+        ),
+    ]
+
+    def run(*args):
+        out = StringIO()
+        call_command("run_qa", study_collection.id, *args, stdout=out)
+        return out.getvalue()
+
+    assert "ran QA on 3 results" in run("--workers", "2", "--batch-size", "2")
+    qa = {x.exp_result_id: x for x in ResultQA.objects.all()}
+    assert qa[results[0].id].qa_result == qa[results[1].id].qa_result
+    assert qa[results[0].id].qa_result["accuracy"] is not None
+    assert qa[results[2].id].qa_result == {}
+    assert qa[results[2].id].error
+
+    assert "ran QA on 0 results" in run("--workers", "1")
+    ResultQA.objects.all().update(qa_result={})
+    assert "ran QA on 3 results" in run("--workers", "1", "--rerun")
+    assert ResultQA.objects.get(exp_result=results[1]).qa_result == qa[results[1].id].qa_result
+
+    ResultQA.objects.filter(exp_result=results[0]).delete()
+    qa_result(results[0].id)
+    assert ResultQA.objects.get(exp_result=results[0]).qa_result == qa[results[0].id].qa_result
+
+    # a collection rerun is split into chunks queued one after the other
+    from django.core import mail
+    from django_q.models import OrmQ
+    from django_q.signing import SignedPackage
+
+    ResultQA.objects.all().delete()
+    run_qa_chunk(study_collection.id, 0, 2)
+    assert ResultQA.objects.count() == 2
+    task = SignedPackage.loads(OrmQ.objects.get().payload)
+    assert task["func"] == "analysis.tasks.run_qa_chunk"
+    assert task["args"] == (study_collection.id, results[1].id, 2)
+    assert not mail.outbox
+    run_qa_chunk(*task["args"])
+    assert ResultQA.objects.count() == 3
+    assert OrmQ.objects.count() == 1
+    assert len(mail.outbox) == 1
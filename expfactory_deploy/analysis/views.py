@@ -1,10 +1,11 @@
+from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.db.models import F
 from django.http import HttpResponse, HttpResponseRedirect, JsonResponse, FileResponse
 from django.shortcuts import get_object_or_404, render, redirect
 from django.urls import reverse, reverse_lazy
 
-from django_q.tasks import schedule
+from django_q.tasks import async_task
 
 from analysis import models
 from analysis.management.commands.run_qa import study_collection_qa
@@ -44,6 +45,7 @@ def trigger_qa_by_sc(request, id, rerun):
 
 @login_required
 def trigger_qa_by_sc_chunked(request, id):
-    sched = schedule("analysis.tasks.run_qa_chunk", id, 0, 100, 60)
-    return redirect(reverse('admin:django_q_schedule_change', kwargs={'object_id': sched.id}))
+    async_task("analysis.tasks.run_qa_chunk", id)
+    messages.info(request, "QA rerun queued, managers will be emailed when it completes.")
+    return redirect(reverse("analysis:qa-by-sc", kwargs={"id": id}))
 
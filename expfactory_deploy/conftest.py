@@ -9,6 +9,15 @@ def media_storage(settings, tmpdir):
     settings.MEDIA_ROOT = tmpdir.strpath
 
 
+@pytest.fixture(autouse=True)
+def clear_caches():
+    from django.core.cache import cache
+    from experiments.utils import context_cache
+
+    cache.clear()
+    context_cache.clear_local()
+
+
 @pytest.fixture
 def user():
     return UserFactory()
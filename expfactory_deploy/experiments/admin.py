@@ -1,3 +1,5 @@
+import json
+
 from django.contrib import admin
 from django.db import models
 from django.forms import TextInput, Textarea
@@ -333,8 +335,9 @@ class ResultInline(admin.TabularInline):
     fields = ('battery_experiment', 'status', 'include', 'created', 'data_preview')
 
     def data_preview(self, obj):
-        if obj.data:
-            preview = obj.data[:100] + '...' if len(obj.data) > 100 else obj.data
+        data = obj.data or (json.dumps(obj.json_data) if obj.json_data is not None else '')
+        if data:
+            preview = data[:100] + '...' if len(data) > 100 else data
             return preview
         return 'No data'
     data_preview.short_description = 'Data Preview'
@@ -397,12 +400,15 @@ class ResultAdmin(admin.ModelAdmin):
     experiment_name.short_description = 'Experiment'
 
     def data_length(self, obj):
+        if obj.json_data is not None:
+            return len(json.dumps(obj.json_data))
         return len(obj.data) if obj.data else 0
     data_length.short_description = 'Data Size'
 
     def data_formatted(self, obj):
-        if obj.data:
-            return format_html('<pre>{}</pre>', obj.data[:1000] + '...' if len(obj.data) > 1000 else obj.data)
+        data = obj.data or (json.dumps(obj.json_data) if obj.json_data is not None else '')
+        if data:
+            return format_html('<pre>{}</pre>', data[:1000] + '...' if len(data) > 1000 else data)
         return 'No data'
     data_formatted.short_description = 'Data'
 
@@ -451,7 +457,12 @@ class AssignmentAdmin(admin.ModelAdmin):
     check_completion.short_description = "Check completion status"
 
     def reset_assignments(self, request, queryset):
-        updated = queryset.update(status='not-started')
+        # saved one by one so the prolific progress rollup sees the change
+        updated = 0
+        for assignment in queryset.exclude(status='not-started'):
+            assignment.status = 'not-started'
+            assignment.save(update_fields=['status'])
+            updated += 1
         self.message_user(request, f"Reset {updated} assignments to not-started.")
     reset_assignments.short_description = "Reset selected assignments"
 
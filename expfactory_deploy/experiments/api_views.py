@@ -1,29 +1,35 @@
-import ast
+import csv
+import io
 import json
 
 from django.db.models import F
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.dateparse import parse_datetime
 from django.views.decorators.csrf import csrf_exempt
 
 from rest_framework import serializers
 from rest_framework.authentication import SessionAuthentication, TokenAuthentication
-from rest_framework.decorators import api_view, authentication_classes, permission_classes
-from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.decorators import api_view, authentication_classes, permission_classes, renderer_classes
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import BaseRenderer
+from rest_framework.settings import api_settings
 
 from experiments import models
 
 def get_result(pk):
     result = get_object_or_404(models.Result, id=pk)
-    data = ast.literal_eval(result.data)
+    data = result.get_data()
     return JsonResponse({'data': data, 'subject': result.subject.id})
 
 filter_lookup = {
     'subject_id': 'assignment__subject__id',
     'prolific_id': 'assignment__subject__prolific_id',
     'battery_id': 'assignment__battery_id',
-    'sc_id': 'assignment__battery__study__study_collection__id'
+    'sc_id': 'assignment__battery__study__study_collection__id',
+    'modified__gt': 'modified__gt',
 }
 
 def get_results(**kwargs):
@@ -34,7 +40,7 @@ def get_results(**kwargs):
             continue
         filter_kwargs[filter_k] = v
     results = models.Result.objects.filter(**filter_kwargs)
-    results = results.values('id', 'data').annotate(
+    results = results.values('id', 'modified', 'json_data', 'data').annotate(
         study_collection_id=F("assignment__battery__study__study_collection__id"),
         study_collection_name=F("assignment__battery__study__study_collection__name"),
         battery_name=F("assignment__battery__title"),
@@ -59,7 +65,7 @@ def result_format(result):
         'exp_name': result.battery_experiment.experiment_instance.experiment_repo_id.name,
         'started_at': started_at,
         'completed_at': completed_at,
-        'data': ast.literal_eval(result.data)
+        'data': result.get_data()
     }
 
 def get_and_format(**kwargs):
@@ -69,34 +75,158 @@ def get_and_format(**kwargs):
 
 class ResultSerializer(serializers.BaseSerializer):
     def to_representation(self, instance):
+        chunks = self.context.get('chunks', {}).get(instance['id'], ())
+        instance['data'] = models.Result.load_data(instance.pop('json_data'), instance['data'], chunks)
         return instance
 
+
+class NDJSONRenderer(BaseRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data, default=str)
+
+
+class CSVRenderer(BaseRenderer):
+    """ Results are streamed by get_results_view with csv_lines, this only
+        renders other responses, e.g. errors, as a header and a row per dict.
+    """
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return ''
+        rows = data if isinstance(data, list) else [data]
+        rows = [x if isinstance(x, dict) else {'value': x} for x in rows]
+        columns = list(dict.fromkeys(key for row in rows for key in row))
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow([
+                json.dumps(row[col], default=str) if isinstance(row.get(col), (dict, list)) else row.get(col)
+                for col in columns
+            ])
+        return buffer.getvalue()
+
+
+class Echo:
+    # File-like object whose write just hands the line back to the csv writer's caller.
+    def write(self, value):
+        return value
+
+
+RESULT_COLUMNS = ["id", "modified", "study_collection_id", "study_collection_name", "battery_name", "battery_id", "exp_name", "prolific_id", "data"]
+
+# Result blobs can be several megabytes each, keep the cursor fetches small.
+STREAM_BATCH_SIZE = 500
+STREAM_CHUNK_SIZE = 20
+
+def stream_results(results, batch_size=STREAM_BATCH_SIZE):
+    """ Walk a get_results queryset in id order without OFFSET, yielding rows
+        with their payload decoded.
+    """
+    last_id = 0
+    while True:
+        batch = results.filter(id__gt=last_id).order_by('id')[:batch_size]
+        # trials of in progress results may still be in delta sync chunks
+        chunks = models.Result.chunks_for(list(batch.values_list('id', flat=True)))
+        serializer = ResultSerializer(context={'chunks': chunks})
+        count = 0
+        for row in batch.iterator(chunk_size=STREAM_CHUNK_SIZE):
+            count += 1
+            last_id = row['id']
+            yield serializer.to_representation(row)
+        if count < batch_size:
+            return
+
+def ndjson_lines(results):
+    for row in stream_results(results):
+        yield json.dumps(row, default=str) + '\n'
+
+def csv_lines(results, columns):
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    for row in stream_results(results):
+        row['data'] = json.dumps(row['data'], default=str)
+        yield writer.writerow([row.get(col) for col in columns])
+
+class IdCursorPagination(CursorPagination):
+    """ Keyset pagination on id. The next link carries an opaque cursor so
+        deep pages cost the same as the first one.
+    """
+    ordering = 'id'
+    page_size_query_param = 'limit'
+    max_page_size = 1000
+
+
+def get_paginator(request):
+    # Limit/offset stays the default for existing clients, ?paginate=cursor
+    # opts in to cursor paging, whose next links carry the cursor.
+    if 'cursor' in request.GET or request.GET.get('paginate') == 'cursor':
+        return IdCursorPagination()
+    return LimitOffsetPagination()
+
+def get_modified_after(request):
+    modified_gt = request.GET.get('modified__gt')
+    if modified_gt is None:
+        return None
+    parsed = parse_datetime(modified_gt)
+    if parsed is None:
+        raise ValidationError({'modified__gt': 'Expected an ISO 8601 datetime.'})
+    return parsed
+
 @api_view(['GET'])
 @authentication_classes([SessionAuthentication, TokenAuthentication])
 @permission_classes([IsAuthenticated])
+@renderer_classes([*api_settings.DEFAULT_RENDERER_CLASSES, NDJSONRenderer, CSVRenderer])
 def get_results_view(request, **kwargs):
-    paginator = LimitOffsetPagination()
-    # paginator.default_limit = 1
+    paginator = get_paginator(request)
 
     # why dont we just pass **Request.GET to get_results?
     query_args = {
-        'subject_id': request.GET.get('subject_id'),
+        'subject_id': request.GET.get('subject_id', kwargs.get('subject_id')),
         'prolific_id': request.GET.get('prolific_id'),
-        'battery_id': request.GET.get('battery_id'),
+        'battery_id': request.GET.get('battery_id', kwargs.get('battery_id')),
         'sc_id': request.GET.get('sc_id'),
+        'modified__gt': get_modified_after(request),
     }
     results = get_results(**query_args)
+
+    # ?format=ndjson or ?format=csv stream every matching result in one response.
+    if request.accepted_renderer.format == 'ndjson':
+        return StreamingHttpResponse(ndjson_lines(results), content_type=NDJSONRenderer.media_type)
+    if request.accepted_renderer.format == 'csv':
+        response = StreamingHttpResponse(csv_lines(results, RESULT_COLUMNS), content_type=CSVRenderer.media_type)
+        response['Content-Disposition'] = 'attachment; filename="results.csv"'
+        return response
+
     result_page = paginator.paginate_queryset(results, request)
-    serializer = ResultSerializer(result_page, many=True)
+    chunks = models.Result.chunks_for([x['id'] for x in result_page])
+    serializer = ResultSerializer(result_page, many=True, context={'chunks': chunks})
     return paginator.get_paginated_response(serializer.data)
 
+subject_filter_lookup = {
+    'subject_id': 'id',
+    'prolific_id': 'prolific_id',
+    'battery_id': 'assignment__battery_id',
+    'sc_id': 'studycollectionsubject__study_collection__id',
+}
+
 @api_view(['GET'])
 @authentication_classes([SessionAuthentication, TokenAuthentication])
 @permission_classes([IsAuthenticated])
 def list_subjects(request):
-    paginator = LimitOffsetPagination()
-    query_args = {
-        'subject_id': request.GET.get('subject_id'),
-        'battery_id': request.GET.get('battery_id'),
-        'sc_id': request.GET.get('sc_id'),
-    }
+    paginator = get_paginator(request)
+    filter_kwargs = {}
+    for k, filter_k in subject_filter_lookup.items():
+        v = request.GET.get(k)
+        if v is not None:
+            filter_kwargs[filter_k] = v
+    subjects = models.Subject.objects.filter(**filter_kwargs).values(
+        'id', 'prolific_id', 'handle', 'uuid', 'active'
+    ).distinct()
+    subject_page = paginator.paginate_queryset(subjects, request)
+    return paginator.get_paginated_response(subject_page)
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from experiments.models import Result
+
+
+class Command(BaseCommand):
+    help = "Move legacy repr encoded Result.data payloads into Result.json_data"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=200)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        last_id = 0
+        converted = 0
+        failed = []
+        while True:
+            batch = list(
+                Result.objects.filter(id__gt=last_id, json_data__isnull=True)
+                .exclude(data="")
+                .order_by("id")
+                .only("id", "data")[:batch_size]
+            )
+            if not batch:
+                break
+            last_id = batch[-1].id
+            to_update = []
+            for result in batch:
+                try:
+                    result.set_data(Result.load_data(None, result.data))
+                except (ValueError, SyntaxError, MemoryError, RecursionError):
+                    failed.append(result.id)
+                    continue
+                to_update.append(result)
+            with transaction.atomic():
+                Result.objects.bulk_update(to_update, ["json_data", "data"])
+            converted += len(to_update)
+            self.stdout.write(f"converted {converted} results, last id {last_id}")
+
+        if failed:
+            self.stdout.write(
+                self.style.WARNING(f"unable to decode results: {failed}")
+            )
+        self.stdout.write(self.style.SUCCESS(f"finished, converted {converted} results"))
@@ -0,0 +1,45 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from experiments.utils.file_export import export_parquet, export_results
+
+
+class Command(BaseCommand):
+    help = "Export new and changed completed results to json files"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output-dir", default=settings.RESULTS_EXPORT_DIR)
+        parser.add_argument("--battery", type=int, nargs="*", dest="battery_ids")
+        parser.add_argument("--workers", type=int, default=os.cpu_count())
+        parser.add_argument("--batch-size", type=int, default=50)
+        parser.add_argument(
+            "--full", action="store_true", help="Ignore the manifest and rewrite everything."
+        )
+        parser.add_argument(
+            "--format", choices=["json", "parquet"], default="json",
+            help="parquet writes one dataset of all trials partitioned by task.",
+        )
+        parser.add_argument("--task", nargs="*", dest="task_names", help="Limit parquet export to these tasks.")
+
+    def handle(self, *args, **options):
+        if options["format"] == "parquet":
+            export_parquet(
+                options["output_dir"],
+                battery_ids=options["battery_ids"],
+                task_names=options["task_names"],
+                log=self.stdout.write,
+            )
+            return
+        exported, failures = export_results(
+            options["output_dir"],
+            battery_ids=options["battery_ids"],
+            workers=options["workers"],
+            batch_size=options["batch_size"],
+            full=options["full"],
+            log=self.stdout.write,
+        )
+        for result_id, error in failures:
+            self.stdout.write(self.style.WARNING(f"result {result_id} failed: {error}"))
+        self.stdout.write(self.style.SUCCESS(f"finished, exported {exported} results"))
@@ -359,7 +359,7 @@ class Command(BaseCommand):
                     subject=assignment.subject,
                     status=random.choice(['not-started', 'started', 'completed', 'failed']),
                     include=random.choice(['not-set', 'n/a', 'include', 'reject']),
-                    data=f'{{"trial_data": [{{"rt": {random.randint(200, 2000)}, "response": "{random.choice(["left", "right"])}"}}]}}'
+                    json_data={"trial_data": [{"rt": random.randint(200, 2000), "response": random.choice(["left", "right"])}]}
                 )
                 results.append(result)
 
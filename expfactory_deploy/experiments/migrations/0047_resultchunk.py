@@ -0,0 +1,47 @@
+# Generated by Django 5.1.4 on 2026-10-17 17:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("experiments", "0046_result_include"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ResultChunk",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("seq", models.PositiveIntegerField()),
+                ("trials", models.JSONField(default=list)),
+                ("created", models.DateTimeField(auto_now_add=True)),
+                (
+                    "result",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="chunks",
+                        to="experiments.result",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ("seq",),
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("result", "seq"), name="unique_result_chunk"
+                    )
+                ],
+            },
+        ),
+    ]
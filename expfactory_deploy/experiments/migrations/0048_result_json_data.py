@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-17 17:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("experiments", "0047_resultchunk"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="result",
+            name="json_data",
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.1.4 on 2026-10-17 18:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("experiments", "0048_result_json_data"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ExportedResult",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("path", models.TextField()),
+                ("content_hash", models.CharField(max_length=64)),
+                ("result_modified", models.DateTimeField()),
+                ("exported_at", models.DateTimeField()),
+                (
+                    "result",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="export",
+                        to="experiments.result",
+                    ),
+                ),
+            ],
+        ),
+    ]
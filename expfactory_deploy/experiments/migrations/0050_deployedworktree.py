@@ -0,0 +1,46 @@
+# Generated by Django 5.1.4 on 2026-10-17 18:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("experiments", "0049_exportedresult"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DeployedWorktree",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("commit", models.TextField()),
+                ("path", models.TextField()),
+                ("created", models.DateTimeField(auto_now_add=True)),
+                (
+                    "origin",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="worktrees",
+                        to="experiments.repoorigin",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("origin", "commit"), name="unique_deployed_worktree"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.4 on 2026-10-17 18:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("experiments", "0050_deployedworktree"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="experimentinstance",
+            name="deploy_checked_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="experimentinstance",
+            name="deploy_error",
+            field=models.TextField(blank=True),
+        ),
+    ]
@@ -1,4 +1,3 @@
-import ast
 import datetime
 import json
 import os
@@ -11,15 +10,18 @@ import git
 import reversion
 from django.conf import settings
 from django.db import models
-from django.db.models import Q
+from django.db.models import Count, Exists, OuterRef, Window
 from django.dispatch import receiver
 from django.urls import reverse
+from django_q.tasks import async_task
 from giturlparse import parse
 from model_utils import Choices
 from model_utils.fields import MonitorField, StatusField
 from model_utils.models import StatusModel, TimeStampedModel
 from taggit.managers import TaggableManager
 
+from .utils import context_cache as context_cache
+from .utils import payload as payload
 from .utils import repo as repo
 from users.models import Group
 
@@ -75,17 +77,36 @@ class RepoOrigin(models.Model):
     def is_valid_commit(self, commit):
         return repo.is_valid_commit(self.path, commit)
 
+    def worktree_path(self, commit):
+        return str(Path(settings.DEPLOYMENT_DIR, Path(self.path).stem, commit))
+
     def checkout_commit(self, commit):
-        base_repo = git.Repo(self.path)
-        stem = Path(self.path).stem
-        deploy_to = str(Path(settings.DEPLOYMENT_DIR, stem, commit))
-        if deploy_to in base_repo.git.worktree("list"):
-            return deploy_to
-        elif not repo.is_valid_commit(self.path, commit):
-            return False
-        else:
-            base_repo.git.worktree("add", deploy_to, commit)
-            return deploy_to
+        """ Path of the worktree for commit, or False if the commit is not in
+            the repo. Worktrees already in the registry cost one query.
+        """
+        deployed = DeployedWorktree.objects.filter(origin=self, commit=commit).values_list("path", flat=True).first()
+        if deployed is not None and os.path.isdir(deployed):
+            return deployed
+        return self.add_worktree(commit)
+
+    def add_worktree(self, commit):
+        """ Idempotently materialize and register the worktree for commit.
+            Concurrent callers for the same repo wait on a file lock.
+        """
+        deploy_to = self.worktree_path(commit)
+        with repo.repo_lock(self.path):
+            base_repo = git.Repo(self.path)
+            if not os.path.isdir(deploy_to):
+                # forget worktrees whose directory was removed
+                base_repo.git.worktree("prune")
+            if deploy_to not in base_repo.git.worktree("list"):
+                if not repo.is_valid_commit(self.path, commit):
+                    return False
+                base_repo.git.worktree("add", deploy_to, commit)
+                instances = ExperimentInstance.objects.filter(experiment_repo_id__origin=self, commit=commit)
+                context_cache.invalidate(instances.values_list("id", flat=True), commit)
+            DeployedWorktree.objects.update_or_create(origin=self, commit=commit, defaults={"path": deploy_to})
+        return deploy_to
 
     def pull_origin(self):
         repo.pull_origin(self.path)
@@ -98,11 +119,15 @@ class RepoOrigin(models.Model):
         instances = ExperimentInstance.objects.filter(experiment_repo_id__origin=self.id).exclude(commit=latest)
         # we will want to filter battexps on use_latest in production
         battexps = BatteryExperiments.objects.filter(experiment_instance__id__in=instances.values_list('id', flat=True))
+        new_instances = set()
         for battexp in battexps:
             new_instance, _ = ExperimentInstance.objects.get_or_create(experiment_repo_id=battexp.experiment_instance.experiment_repo_id, commit=latest)
             print(f'batt exp: {battexp.id} updated {battexp.experiment_instance} to {new_instance}')
             battexp.experiment_instance = new_instance
             battexp.save()
+            new_instances.add(new_instance.id)
+        if new_instances:
+            async_task("experiments.tasks.deploy_instances", sorted(new_instances))
 
     def clone(self):
         os.makedirs(self.path, exist_ok=True)
@@ -116,6 +141,22 @@ class RepoOrigin(models.Model):
         return self.url
 
 
+class DeployedWorktree(models.Model):
+    """ Registry of commits checked out as worktrees under DEPLOYMENT_DIR,
+        so serving an experiment doesn't need to ask git.
+    """
+    origin = models.ForeignKey(RepoOrigin, on_delete=models.CASCADE, related_name="worktrees")
+    commit = models.TextField()
+    path = models.TextField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["origin", "commit"], name="unique_deployed_worktree")
+        ]
+
+    def __str__(self):
+        return self.path
 
 
 ''' Will likely want to have git clone be called as a task from here
@@ -171,6 +212,9 @@ class ExperimentInstance(models.Model):
     commit_date = models.DateField(blank=True, null=True)
     # should drop the _id
     experiment_repo_id = models.ForeignKey(ExperimentRepo, on_delete=models.CASCADE)
+    # outcome of the last pre-deploy, see experiments.tasks.deploy_instance
+    deploy_error = models.TextField(blank=True)
+    deploy_checked_at = models.DateTimeField(blank=True, null=True)
 
     @property
     def remote_url(self):
@@ -184,6 +228,10 @@ class ExperimentInstance(models.Model):
     def deploy_static(self):
         return self.experiment_repo_id.origin.checkout_commit(self.commit)
 
+    def deployed_location(self, worktree):
+        """ Filesystem path of this experiment inside a worktree of its repo. """
+        return self.experiment_repo_id.location.replace(self.experiment_repo_id.origin.path, worktree)
+
     def __str__(self):
         return f"{self.commit}"
 
@@ -290,13 +338,61 @@ class Result(TimeStampedModel, SubjectTaskStatusModel):
     )
     # in case we want to collect results without an assignment
     subject = models.ForeignKey(Subject, on_delete=models.SET_NULL, null=True)
+    # Legacy python repr encoded payload, superseded by json_data. Rows are
+    # moved over by the backfill_result_json command.
     data = models.TextField(blank=True)
+    json_data = models.JSONField(blank=True, null=True)
     INCLUDE = Choices("not-set", "n/a", "include", "reject", "parse-failed")
     include = StatusField(default="not-set")
 
+    @staticmethod
+    def load_data(json_data, data, chunks=()):
+        """ Decode a payload from the raw column values, for use with values()
+            querysets that never instantiate a Result. chunks are the
+            (seq, trials) pairs of a result that is still receiving delta syncs.
+        """
+        if json_data is not None:
+            loaded = json_data
+        else:
+            loaded = payload.decode(data)
+        return Result.merge_chunks(loaded, chunks)
+
+    @staticmethod
+    def merge_chunks(data, chunks):
+        """ Splice delta sync trials into the trialdata of a payload. """
+        if not chunks:
+            return data
+        trials = data.get("trialdata", [])
+        if type(trials) is str:
+            trials = json.loads(trials)
+        trials = list(trials)
+        for seq, chunk in sorted(chunks, key=lambda x: x[0]):
+            trials[seq:seq + len(chunk)] = chunk
+        return {**data, "trialdata": trials}
+
+    @staticmethod
+    def chunks_for(result_ids):
+        """ (seq, trials) of the delta sync chunks of each of result_ids. """
+        chunks = defaultdict(list)
+        rows = ResultChunk.objects.filter(result_id__in=result_ids).values_list("result_id", "seq", "trials")
+        for result_id, seq, trials in rows:
+            chunks[result_id].append((seq, trials))
+        return chunks
+
+    def get_data(self):
+        chunks = ()
+        # chunks are compacted once a result is completed
+        if self.pk is not None and self.status != self.STATUS.completed:
+            chunks = [(x.seq, x.trials) for x in self.chunks.all()]
+        return Result.load_data(self.json_data, self.data, chunks)
+
+    def set_data(self, data):
+        self.json_data = data
+        self.data = ""
+
     def set_include(self):
         include_raw = None
-        data = ast.literal_eval(self.data)
+        data = self.get_data()
         if 'trialdata' in data:
             trial_data = data['trialdata']
             if type(data['trialdata']) is str:
@@ -315,6 +411,47 @@ class Result(TimeStampedModel, SubjectTaskStatusModel):
             self.include = "reject"
         self.save()
 
+    def compact_chunks(self, data=None):
+        """ Fold trials appended by delta syncs back into data and drop the
+            chunks. If data is given it is a full payload that supersedes
+            them, and the chunks are simply discarded.
+        """
+        if data is None:
+            data = self.get_data()
+        self.set_data(data)
+        self.chunks.all().delete()
+
+
+class ResultChunk(models.Model):
+    """ Trials sent by a delta sync, starting at trial index seq. Appended
+        while a result is in progress and compacted into the result once the
+        experiment is finished.
+    """
+    result = models.ForeignKey(Result, on_delete=models.CASCADE, related_name="chunks")
+    seq = models.PositiveIntegerField()
+    trials = models.JSONField(default=list)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ("seq",)
+        constraints = [
+            models.UniqueConstraint(
+                name="unique_result_chunk", fields=["result", "seq"]
+            )
+        ]
+
+
+class ExportedResult(models.Model):
+    """ Manifest entry for a result written out by the export_results
+        command. A result is exported again only when its modified time or
+        target path no longer match.
+    """
+    result = models.OneToOneField(Result, on_delete=models.CASCADE, related_name="export")
+    path = models.TextField()
+    content_hash = models.CharField(max_length=64)
+    result_modified = models.DateTimeField()
+    exported_at = models.DateTimeField()
+
 
 class Assignment(SubjectTaskStatusModel):
     """ Associate a subject with a battery deployment that they should complete """
@@ -366,31 +503,39 @@ class Assignment(SubjectTaskStatusModel):
 
 
     def get_next_experiment(self):
-        if self.ordering is None:
+        """ First experiment instance without a completed or failed result for
+            this assignment, and the number of such experiments left. The
+            assignment is only saved when its status changes.
+        """
+        exempt = Result.objects.filter(
+            battery_experiment=OuterRef("pk"),
+            subject_id=self.subject_id,
+            assignment=self,
+            status__in=[Result.STATUS.completed, Result.STATUS.failed],
+        )
+        if self.ordering_id is None:
             order = "?" if self.battery.random_order else "order"
-            batt_exps = (
-                BatteryExperiments.objects.filter(battery=self.battery)
-                .order_by(order)
-            )
+            batt_exps = BatteryExperiments.objects.filter(battery_id=self.battery_id)
         else:
-            batt_exps = (
-                BatteryExperiments.objects.filter(battery=self.battery, experimentorderitem__experiment_order__id=self.ordering.id)
-                .order_by("experimentorderitem__order")
+            order = "experimentorderitem__order"
+            batt_exps = BatteryExperiments.objects.filter(
+                battery_id=self.battery_id, experimentorderitem__experiment_order_id=self.ordering_id
             )
-        exempt_results = Result.objects.filter(
-                Q(status=Result.STATUS.completed) | Q(status=Result.STATUS.failed),
-                battery_experiment__battery=self.battery, subject=self.subject,
-                assignment=self,
-            )
-        exempt = [exp.battery_experiment for exp in exempt_results]
-        unfinished = [batt_exp for batt_exp in batt_exps if batt_exp not in exempt]
-        if len(unfinished):
+        next_exp = (
+            batt_exps.filter(~Exists(exempt))
+            .annotate(remaining=Window(Count("id")))
+            .select_related("experiment_instance__experiment_repo_id")
+            .order_by(order)
+            .first()
+        )
+        if next_exp is not None:
             if self.status == "not-started":
                 self.status = "started"
                 self.save()
-            return unfinished[0].experiment_instance, len(unfinished)
-        self.status = "completed"
-        self.save()
+            return next_exp.experiment_instance, next_exp.remaining
+        if self.status != "completed":
+            self.status = "completed"
+            self.save()
         return None, 0
 
     def pass_check(self):
@@ -443,3 +588,19 @@ class ExperimentOrder(models.Model):
         for index, exp in enumerate(experiments):
             order_items.append(ExperimentOrderItem(battery_experiment_id=exp, experiment_order=self, order=index))
         ExperimentOrderItem.objects.bulk_create(order_items)
+
+    @staticmethod
+    def bulk_generate(battery, count):
+        """ Create count randomly ordered ExperimentOrders for battery with a
+            fixed number of queries, as Assignment.save does one at a time.
+        """
+        orders = ExperimentOrder.objects.bulk_create(
+            [ExperimentOrder(battery=battery) for _ in range(count)]
+        )
+        experiments = list(BatteryExperiments.objects.filter(battery=battery).values_list('id', flat=True))
+        order_items = []
+        for order in orders:
+            for index, exp in enumerate(random.sample(experiments, len(experiments))):
+                order_items.append(ExperimentOrderItem(battery_experiment_id=exp, experiment_order=order, order=index))
+        ExperimentOrderItem.objects.bulk_create(order_items)
+        return orders
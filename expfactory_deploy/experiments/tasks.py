@@ -0,0 +1,58 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django import db
+from django.conf import settings
+from django.utils import timezone
+
+from experiments.models import BatteryExperiments, ExperimentInstance
+
+
+def check_deploy(exp_instance):
+    """ Materialize the worktree for an experiment instance and return a
+        description of what is wrong with it, or an empty string.
+    """
+    try:
+        worktree = exp_instance.deploy_static()
+    except Exception as e:
+        return f"Unable to check out commit {exp_instance.commit}: {e}"
+    if worktree is False:
+        return f"Commit {exp_instance.commit} not found in {exp_instance.experiment_repo_id.origin}"
+    config = os.path.join(exp_instance.deployed_location(worktree), "config.json")
+    if not os.path.isfile(config):
+        return f"{config} does not exist"
+    return ""
+
+
+def deploy_instance(instance_id):
+    exp_instance = ExperimentInstance.objects.select_related("experiment_repo_id__origin").get(id=instance_id)
+    error = check_deploy(exp_instance)
+    ExperimentInstance.objects.filter(id=instance_id).update(
+        deploy_error=error, deploy_checked_at=timezone.now()
+    )
+    return error
+
+
+def _deploy_in_thread(instance_id):
+    try:
+        return deploy_instance(instance_id)
+    finally:
+        db.connection.close()
+
+
+def deploy_instances(instance_ids):
+    """ Pre-deploy experiment instances ahead of the first participant that
+        needs them. Checkouts of the same repo serialize on its lock, those of
+        different repos run in parallel. Returns {instance id: error}.
+    """
+    instance_ids = list(instance_ids)
+    with ThreadPoolExecutor(max_workers=settings.DEPLOY_WORKERS) as executor:
+        errors = dict(zip(instance_ids, executor.map(_deploy_in_thread, instance_ids)))
+    return {k: v for k, v in errors.items() if v}
+
+
+def deploy_battery(battery_id):
+    instance_ids = set(
+        BatteryExperiments.objects.filter(battery_id=battery_id).values_list("experiment_instance_id", flat=True)
+    )
+    return deploy_instances(sorted(instance_ids))
@@ -0,0 +1,60 @@
+import pytest
+from django.core.cache import cache
+
+from experiments.models import ExperimentInstance
+from experiments.tests.test_models import all_models
+from experiments.utils import context_cache
+
+
+@pytest.mark.django_db
+def test_context_cached_per_commit(all_models):
+    exp_instance = ExperimentInstance.objects.first()
+    calls = []
+
+    def build(instance):
+        calls.append(instance.commit)
+        return {"js_vars": {"_survey": [{"q": "one"}]}, "exp_id": instance.commit}
+
+    context = context_cache.get_context(exp_instance, build)
+    context["js_vars"]["_survey"].append("mutated")
+    context["post_url"] = "/push"
+    assert context_cache.get_context(exp_instance, build) == {
+        "js_vars": {"_survey": [{"q": "one"}]}, "exp_id": exp_instance.commit
+    }
+    assert len(calls) == 1
+
+    # another process only has the shared cache
+    context_cache.clear_local()
+    context_cache.get_context(exp_instance, build)
+    assert len(calls) == 1
+
+    context_cache.invalidate([exp_instance.id], exp_instance.commit)
+    assert cache.get(context_cache.context_key(exp_instance.id, exp_instance.commit)) is None
+    context_cache.get_context(exp_instance, build)
+    assert len(calls) == 2
+
+    exp_instance.commit = "0" * 40
+    assert context_cache.get_context(exp_instance, build)["exp_id"] == "0" * 40
+    assert len(calls) == 3
+
+
+@pytest.mark.django_db
+def test_context_rebuilt_without_worktree(all_models, tmp_path):
+    exp_instance = ExperimentInstance.objects.first()
+    worktree = tmp_path / "worktree"
+    worktree.mkdir()
+    calls = []
+
+    def build(instance):
+        calls.append(instance.commit)
+        worktree.mkdir(exist_ok=True)
+        return {"exp_id": instance.commit, context_cache.DEPLOYED_PATH: str(worktree)}
+
+    context_cache.get_context(exp_instance, build)
+    context_cache.get_context(exp_instance, build)
+    assert len(calls) == 1
+
+    worktree.rmdir()
+    context_cache.get_context(exp_instance, build)
+    assert len(calls) == 2
+    assert worktree.is_dir()
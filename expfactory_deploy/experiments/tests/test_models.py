@@ -1,6 +1,11 @@
+import json
+from io import StringIO
+
 import pytest
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import Client
 from django.urls import reverse
 
 from experiments.models import (
@@ -13,6 +18,7 @@ from experiments.models import (
     Subject,
     Assignment,
     ExperimentOrder,
+    Result,
 )
 from users.models import Group
 
@@ -97,3 +103,205 @@ def test_model_relationships(all_models):
     assert battery.experiment_instances.first() == experiment_instance
     assert subject.assignment_set.count() == 1
     assert subject.assignment_set.first() == assignment
+
+
+@pytest.mark.django_db
+def test_backfill_result_json(all_models):
+    assignment = Assignment.objects.first()
+    payload = {"status": "finished", "trialdata": [{"rt": 1, "correct": True, "stim": None}]}
+    legacy = Result.objects.create(assignment=assignment, subject=assignment.subject, data=str(payload))
+    assert legacy.get_data() == payload
+
+    call_command("backfill_result_json", stdout=StringIO())
+    legacy.refresh_from_db()
+    assert legacy.data == ""
+    assert legacy.json_data == payload
+
+
+@pytest.mark.django_db
+def test_export_results(all_models, tmp_path):
+    assignment = Assignment.objects.first()
+    batt_exp = BatteryExperiments.objects.first()
+    json_result = Result.objects.create(
+        assignment=assignment, battery_experiment=batt_exp, subject=assignment.subject,
+        status="completed", json_data={"trialdata": [{"rt": 1}]},
+    )
+    Result.objects.create(
+        assignment=assignment, battery_experiment=batt_exp, subject=assignment.subject,
+        status="completed", data=str({"trialdata": [{"rt": None}]}),
+    )
+
+    def export():
+        out = StringIO()
+        call_command("export_results", output_dir=str(tmp_path), workers=2, stdout=out)
+        return out.getvalue()
+
+    assert "exported 2 results" in export()
+    files = sorted((tmp_path / f"battery-{assignment.battery_id}").iterdir())
+    assert [f.name for f in files] == [
+        f"sub-part_id_battery-{assignment.battery_id}_order-0_task-test_experiment_repo_asgn-{assignment.id}_data.json",
+        f"sub-part_id_battery-{assignment.battery_id}_order-1_task-test_experiment_repo_asgn-{assignment.id}_data.json",
+    ]
+    assert json.loads(files[1].read_text()) == {"trialdata": [{"rt": None}]}
+
+    assert "exported 2" not in export()
+    json_result.set_data({"trialdata": [{"rt": 2}]})
+    json_result.save()
+    assert "exported 1 results" in export()
+    assert json.loads(files[0].read_text()) == {"trialdata": [{"rt": 2}]}
+
+    # a tenth result widens the order padding, files under the old names go
+    for i in range(8):
+        Result.objects.create(
+            assignment=assignment, battery_experiment=batt_exp, subject=assignment.subject,
+            status="completed", json_data={"trialdata": [{"rt": i}]},
+        )
+    assert "exported 10 results" in export()
+    names = sorted(f.name for f in (tmp_path / f"battery-{assignment.battery_id}").iterdir())
+    assert len(names) == 10
+    assert names[0] == (
+        f"sub-part_id_battery-{assignment.battery_id}_order-00_task-test_experiment_repo_asgn-{assignment.id}_data.json"
+    )
+
+
+@pytest.mark.django_db
+def test_export_parquet(all_models, tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    assignment = Assignment.objects.first()
+    batt_exp = BatteryExperiments.objects.first()
+    Result.objects.create(
+        assignment=assignment, battery_experiment=batt_exp, subject=assignment.subject,
+        status="completed", json_data={"trialdata": [{"rt": 1, "response": "f"}, {"rt": None, "response": ["f", "j"]}]},
+    )
+    Result.objects.create(
+        assignment=assignment, battery_experiment=batt_exp, subject=assignment.subject,
+        status="completed", data=str({"trialdata": json.dumps([{"rt": 3, "response": "j"}])}),
+    )
+    call_command("export_results", output_dir=str(tmp_path), format="parquet", stdout=StringIO())
+
+    table = pq.read_table(tmp_path / "trialdata", filters=[("exp_name", "=", "test_experiment_repo")])
+    frame = table.to_pandas()
+    assert len(frame) == 3
+    assert list(frame["response"]) == ["f", '["f", "j"]', "j"]
+    assert set(frame["subject"]) == {"part_id"}
+    assert str(table.schema.field("subject").type).startswith("dictionary")
+
+    # one part file per batch, replacing the parts of the previous export
+    from experiments.utils.file_export import export_parquet
+    task_dir = tmp_path / "trialdata" / "exp_name=test_experiment_repo"
+    export_parquet(str(tmp_path), batch_size=1, log=lambda x: None)
+    assert sorted(f.name for f in task_dir.iterdir()) == ["part-00000.parquet", "part-00001.parquet"]
+    assert len(pq.read_table(tmp_path / "trialdata")) == 3
+    export_parquet(str(tmp_path), log=lambda x: None)
+    assert [f.name for f in task_dir.iterdir()] == ["part-00000.parquet"]
+
+
+def make_origin(tmp_path, files):
+    """ RepoOrigin for a fresh git repo containing files, returns it and the commit. """
+    import git
+
+    repo_path = tmp_path / "repo"
+    base_repo = git.Repo.init(repo_path)
+    for name in files:
+        (repo_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (repo_path / name).write_text("{}")
+    base_repo.index.add(files)
+    commit = base_repo.index.commit("initial").hexsha
+    origin = RepoOrigin.objects.create(url="https://example.com/repo.git", path=str(repo_path), name="repo")
+    return origin, commit
+
+
+@pytest.mark.django_db
+def test_checkout_commit_registry(tmp_path, settings, monkeypatch):
+    import shutil
+
+    import git
+
+    from experiments.models import DeployedWorktree
+
+    settings.DEPLOYMENT_DIR = str(tmp_path / "workdirs")
+    origin, commit = make_origin(tmp_path, ["config.json"])
+
+    deploy_to = origin.checkout_commit(commit)
+    assert deploy_to == str(tmp_path / "workdirs" / "repo" / commit)
+    assert (tmp_path / "workdirs" / "repo" / commit / "config.json").exists()
+    assert DeployedWorktree.objects.get(origin=origin, commit=commit).path == deploy_to
+
+    # registered worktrees don't touch git
+    with monkeypatch.context() as m:
+        m.setattr(git, "Repo", None)
+        assert origin.checkout_commit(commit) == deploy_to
+
+    shutil.rmtree(deploy_to)
+    assert origin.checkout_commit(commit) == deploy_to
+    assert (tmp_path / "workdirs" / "repo" / commit / "config.json").exists()
+    assert DeployedWorktree.objects.count() == 1
+
+    assert origin.checkout_commit("notacommit") is False
+    assert origin.checkout_commit("0" * 40) is False
+
+
+@pytest.mark.django_db(transaction=True)
+def test_deploy_battery(all_models, tmp_path, settings):
+    from experiments.tasks import deploy_battery
+
+    settings.DEPLOYMENT_DIR = str(tmp_path / "workdirs")
+    origin, commit = make_origin(tmp_path, ["good/config.json", "bad/index.html"])
+    battery = Battery.objects.first()
+    BatteryExperiments.objects.filter(battery=battery).delete()
+    instances = {}
+    for order, name in enumerate(["good", "bad"]):
+        exp_repo = ExperimentRepo.objects.create(
+            name=name, origin=origin, location=f"{origin.path}/{name}", framework=Framework.objects.first()
+        )
+        instances[name] = ExperimentInstance.objects.create(experiment_repo_id=exp_repo, commit=commit)
+        BatteryExperiments.objects.create(battery=battery, experiment_instance=instances[name], order=order)
+
+    errors = deploy_battery(battery.id)
+    assert list(errors) == [instances["bad"].id]
+    good = ExperimentInstance.objects.get(id=instances["good"].id)
+    bad = ExperimentInstance.objects.get(id=instances["bad"].id)
+    assert good.deploy_error == "" and good.deploy_checked_at is not None
+    assert bad.deploy_error.endswith("bad/config.json does not exist")
+
+    client = Client()
+    client.force_login(get_user_model().objects.get(username="testuser"))
+    response = client.get(reverse("experiments:battery-detail", kwargs={"pk": battery.id}))
+    assert bad.deploy_error in response.content.decode("utf-8")
+
+
+@pytest.mark.django_db
+def test_get_next_experiment(all_models, django_assert_num_queries):
+    assignment = Assignment.objects.select_related("battery").first()
+    first = BatteryExperiments.objects.first()
+    instances = [first.experiment_instance]
+    for order in [2, 3]:
+        instance = ExperimentInstance.objects.create(
+            experiment_repo_id=first.experiment_instance.experiment_repo_id, commit=f"commit{order}"
+        )
+        BatteryExperiments.objects.create(experiment_instance=instance, battery=assignment.battery, order=order)
+        instances.append(instance)
+    assignment.status = "started"
+    assignment.save()
+
+    with django_assert_num_queries(1):
+        instance, remaining = assignment.get_next_experiment()
+        assert instance.experiment_repo_id.name == "test_experiment_repo"
+    assert (instance, remaining) == (instances[0], 3)
+
+    for instance, status in zip(instances[:2], ["completed", "failed"]):
+        Result.objects.create(
+            assignment=assignment, subject=assignment.subject, status=status,
+            battery_experiment=BatteryExperiments.objects.get(experiment_instance=instance),
+        )
+    assert assignment.get_next_experiment() == (instances[2], 1)
+
+    Result.objects.create(
+        assignment=assignment, subject=assignment.subject, status="completed",
+        battery_experiment=BatteryExperiments.objects.get(experiment_instance=instances[2]),
+    )
+    assert assignment.get_next_experiment() == (None, 0)
+    assignment = Assignment.objects.select_related("battery").get(id=assignment.id)
+    assert assignment.status == "completed"
+    with django_assert_num_queries(1):
+        assert assignment.get_next_experiment() == (None, 0)
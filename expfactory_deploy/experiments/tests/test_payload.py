@@ -0,0 +1,33 @@
+import ast
+
+import pytest
+
+from experiments.utils import payload
+
+
+@pytest.mark.parametrize("data", [
+    {"trialdata": [{"rt": None, "correct": True, "missed": False, "score": 0.5}]},
+    {"stimulus": '<div class="centerbox">press</div>', "feedback": "don't wait"},
+    {"text": "both ' and \" quotes", "escapes": "tab\tnewline\n\x07 \\ done"},
+    {"unicode": "café ☃", "words": "True False None nan inf"},
+    {"nested": {"list": [1, -2, 3.5e-07, [], {}]}, "key's": "value"},
+])
+def test_decode_repr(data):
+    raw = repr(data)
+    assert payload.decode(raw) == ast.literal_eval(raw) == data
+
+
+def test_decode_json_and_empty():
+    assert payload.decode('{"a": [1, null, true]}') == {"a": [1, None, True]}
+    assert payload.decode("") == {}
+
+
+def test_decode_nonfinite():
+    decoded = payload.decode(repr({"a": float("nan"), "b": float("-inf")}))
+    assert decoded["a"] != decoded["a"]
+    assert decoded["b"] == float("-inf")
+
+
+def test_decode_falls_back_to_literal_eval():
+    # tuples have no json equivalent
+    assert payload.decode("{'a': (1, 2)}") == {"a": (1, 2)}
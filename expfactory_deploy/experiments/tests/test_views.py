@@ -1,4 +1,7 @@
+import json
+
 import pytest
+from django.contrib.auth import get_user_model
 from django.test import Client
 from django.urls import reverse
 
@@ -67,3 +70,225 @@ def test_serve_battery(client, all_models):
     )
     assert response.status_code == 200
     assert not(assignment.battery.consent in response.content.decode("utf-8"))
+
+
+@pytest.mark.django_db
+def test_delta_sync(client, all_models):
+    assignment = models.Assignment.objects.first()
+    exp_instance = models.ExperimentInstance.objects.first()
+    url = reverse(
+        "experiments:push-results",
+        kwargs={"assignment_id": assignment.pk, "experiment_id": exp_instance.pk}
+    )
+    trials = [{"trial_index": i, "rt": i * 10} for i in range(5)]
+
+    def post(data):
+        return client.post(
+            url, json.dumps(data), content_type="application/json", HTTP_USER_AGENT="pytest"
+        )
+
+    post({"status": "started", "seq": 0, "trialdata": trials[:2]})
+    post({"status": "started", "seq": 2, "trialdata": trials[2:4]})
+    # a retried sync replaces the chunk rather than duplicating it
+    post({"status": "started", "seq": 2, "trialdata": trials[2:4]})
+
+    result = models.Result.objects.get(assignment=assignment)
+    assert result.status == "started"
+    assert result.chunks.count() == 2
+    # readers see the chunked trials before the result is completed
+    assert result.get_data()["trialdata"] == trials[:4]
+    assert result.get_data()["user_agent"] == "pytest"
+    result.status = "failed"
+    assert result.get_data()["trialdata"] == trials[:4]
+
+    post({"status": "finished", "trialdata": trials})
+    result = models.Result.objects.get(assignment=assignment)
+    assert result.status == "completed"
+    assert models.ResultChunk.objects.count() == 0
+    assert result.data == ""
+    assert result.get_data()["trialdata"] == trials
+
+
+@pytest.mark.django_db(transaction=True)
+def test_result_ingest(client, all_models, monkeypatch):
+    import threading
+
+    from django.test import Client
+
+    from experiments.utils import ingest
+
+    ingest._pool()
+    assignment = models.Assignment.objects.first()
+    exp_instance = models.ExperimentInstance.objects.first()
+    url = reverse(
+        "experiments:ingest-results",
+        kwargs={"assignment_id": assignment.pk, "experiment_id": exp_instance.pk}
+    )
+    trials = [{"trial_index": i, "rt": i * 10} for i in range(5)]
+
+    def post(data):
+        return client.post(
+            url, json.dumps(data), content_type="application/json", HTTP_USER_AGENT="pytest"
+        )
+
+    # chunks that arrive out of order are both kept
+    assert post({"status": "started", "seq": 2, "trialdata": trials[2:4]}).status_code == 200
+    assert post({"status": "started", "seq": 0, "trialdata": trials[:2]}).status_code == 200
+    assert models.ResultChunk.objects.count() == 2
+    assert client.post(url, "[1, ", content_type="application/json").status_code == 400
+    # participants may not have a csrf cookie
+    csrf_client = Client(enforce_csrf_checks=True)
+    response = csrf_client.post(
+        url, json.dumps({"status": "started", "seq": 2, "trialdata": trials[2:4]}),
+        content_type="application/json", HTTP_USER_AGENT="pytest"
+    )
+    assert response.status_code == 200
+
+    with monkeypatch.context() as m:
+        m.setattr(ingest, "_slots", threading.BoundedSemaphore(1))
+        ingest._slots.acquire()
+        response = post({"status": "started", "seq": 4, "trialdata": trials[4:]})
+        assert response.status_code == 503
+
+    assert post({"status": "finished", "trialdata": trials}).status_code == 200
+    # a sync arriving after the finished post doesn't start a new result
+    assert post({"status": "started", "seq": 4, "trialdata": trials[4:]}).status_code == 200
+    result = models.Result.objects.get(assignment=assignment)
+    assert result.status == "completed"
+    assert models.ResultChunk.objects.count() == 0
+    assert result.get_data()["trialdata"] == trials
+    assert result.get_data()["user_agent"] == "pytest"
+
+
+@pytest.mark.django_db(transaction=True)
+def test_result_ingest_query_budget(client, all_models):
+    from expfactory_deploy.utils.query_budget import assert_query_budget
+
+    assignment = models.Assignment.objects.first()
+    exp_instance = models.ExperimentInstance.objects.first()
+    url = reverse(
+        "experiments:ingest-results",
+        kwargs={"assignment_id": assignment.pk, "experiment_id": exp_instance.pk}
+    )
+    posts = [
+        {"status": "started", "seq": 0, "trialdata": [{"rt": 1}]},
+        {"status": "started", "seq": 1, "trialdata": [{"rt": 2}]},
+        {"status": "finished", "trialdata": [{"rt": 1}, {"rt": 2}]},
+    ]
+    for data in posts:
+        with assert_query_budget("experiments:ingest-results") as recorder:
+            response = client.post(
+                url, json.dumps(data), content_type="application/json", HTTP_USER_AGENT="pytest"
+            )
+        assert response.status_code == 200
+        # the write itself, made on an ingest worker thread, is counted
+        assert any("INSERT" in sql or "UPDATE" in sql for sql in recorder.fingerprints)
+
+
+@pytest.mark.django_db
+def test_completed_result_queues_qa(client, all_models, django_capture_on_commit_callbacks):
+    from django_q.models import OrmQ
+    from django_q.signing import SignedPackage
+
+    assignment = models.Assignment.objects.first()
+    exp_instance = models.ExperimentInstance.objects.first()
+    url = reverse(
+        "experiments:push-results",
+        kwargs={"assignment_id": assignment.pk, "experiment_id": exp_instance.pk}
+    )
+
+    def post(data):
+        with django_capture_on_commit_callbacks(execute=True):
+            client.post(
+                url, json.dumps(data), content_type="application/json", HTTP_USER_AGENT="pytest"
+            )
+
+    post({"status": "started", "trialdata": [{"rt": 1}]})
+    assert OrmQ.objects.count() == 0
+    post({"status": "finished", "trialdata": [{"rt": 1}]})
+    queued = [SignedPackage.loads(x.payload) for x in OrmQ.objects.all()]
+    assert [(x["func"], x["args"]) for x in queued] == [
+        ("analysis.tasks.qa_result", (models.Result.objects.get().id,))
+    ]
+
+
+@pytest.mark.django_db
+def test_results_ndjson(client, all_models):
+    assignment = models.Assignment.objects.first()
+    batt_exp = models.BatteryExperiments.objects.first()
+    for i in range(3):
+        models.Result.objects.create(
+            assignment=assignment, battery_experiment=batt_exp, subject=assignment.subject,
+            json_data={"trialdata": [{"rt": i}]},
+        )
+    client.force_login(get_user_model().objects.first())
+    url = reverse("experiments:api-results-by-param")
+
+    response = client.get(url, {"battery_id": assignment.battery.id, "format": "ndjson"})
+    assert response.status_code == 200
+    assert response["Content-Type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+    assert [row["data"]["trialdata"][0]["rt"] for row in rows] == [0, 1, 2]
+    assert rows[0]["exp_name"] == batt_exp.experiment_instance.experiment_repo_id.name
+
+    # trials of an in progress result are read from its delta sync chunks
+    started = models.Result.objects.create(
+        assignment=assignment, battery_experiment=batt_exp, subject=assignment.subject,
+        status="started", json_data={"user_agent": "pytest"},
+    )
+    models.ResultChunk.objects.create(result=started, seq=0, trials=[{"rt": 3}])
+    response = client.get(url, {"battery_id": assignment.battery.id, "format": "ndjson"})
+    rows = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+    assert rows[-1]["data"]["trialdata"] == [{"rt": 3}]
+    response = client.get(url, {"battery_id": assignment.battery.id})
+    assert response.json()["results"][-1]["data"]["trialdata"] == [{"rt": 3}]
+    started.delete()
+
+    response = client.get(url, {"battery_id": assignment.battery.id, "format": "csv"})
+    lines = b"".join(response.streaming_content).decode().splitlines()
+    assert lines[0].startswith("id,modified,study_collection_id")
+    assert len(lines) == 4
+
+    # errors are rendered as csv too
+    response = client.get(url, {"modified__gt": "yesterday", "format": "csv"})
+    assert response.status_code == 400
+    assert response.content.decode().splitlines() == [
+        "modified__gt", "Expected an ISO 8601 datetime."
+    ]
+
+
+@pytest.mark.django_db
+def test_results_cursor_pagination(client, all_models):
+    assignment = models.Assignment.objects.first()
+    for i in range(5):
+        models.Result.objects.create(
+            assignment=assignment, subject=assignment.subject, json_data={"i": i}
+        )
+    client.force_login(get_user_model().objects.first())
+    url = reverse("experiments:api-results-by-param")
+
+    seen = []
+    response = client.get(url, {"limit": 2, "paginate": "cursor"})
+    while True:
+        page = response.json()
+        seen.extend(row["data"]["i"] for row in page["results"])
+        if page["next"] is None:
+            break
+        assert "cursor=" in page["next"]
+        response = client.get(page["next"])
+    assert seen == [0, 1, 2, 3, 4]
+
+    response = client.get(url, {"modified__gt": page["results"][-1]["modified"]})
+    assert response.json()["results"] == []
+    response = client.get(url, {"modified__gt": "yesterday"})
+    assert response.status_code == 400
+
+    response = client.get(url, {"limit": 2, "offset": 4})
+    assert [row["data"]["i"] for row in response.json()["results"]] == [4]
+    # clients sending only a limit keep limit/offset pages
+    page = client.get(url, {"limit": 2}).json()
+    assert page["count"] == 5
+    assert "offset=2" in page["next"]
+
+    response = client.get(reverse("experiments:api-subjects"), {"battery_id": assignment.battery.id})
+    assert [row["id"] for row in response.json()["results"]] == [assignment.subject.id]
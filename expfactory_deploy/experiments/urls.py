@@ -177,6 +177,11 @@ urlpatterns = [
         views.Results.as_view(),
         name="push-results",
     ),
+    path(
+        "ingest/<int:assignment_id>/<int:experiment_id>/",
+        views.ResultIngest.as_view(),
+        name="ingest-results",
+    ),
     path("results/<int:result_id>/", views.single_result, name="result-detail"),
     path("assignments/generate/<int:battery_id>/<int:num_subjects>", views.batch_assignment_create, name="assignment-generate"),
     path("serve/complete", views.Complete.as_view(), name="complete"),
@@ -187,6 +192,7 @@ urlpatterns = [
     path("api/results/battery/<int:battery_id>/", api_views.get_results_view, name="api-results-by-battery"),
     path("api/results/subject/<int:subject_id>/", api_views.get_results_view, name="api-results-by-subject"),
     path("api/results/", api_views.get_results_view, name="api-results-by-param"),
+    path("api/subjects/", api_views.list_subjects, name="api-subjects"),
 ]
 
 app_name = "experiments"
@@ -0,0 +1,87 @@
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+'''
+Cache of the rendered jspsych context for an experiment instance. Building it
+checks out the worktree with a git subprocess, reads config.json and any
+survey.tsv, none of which change for a given commit. Entries are kept in the
+shared django cache and in a small per process LRU in front of it, and are
+only dropped when a worktree is (re)added for the commit. A context that
+names its worktree under DEPLOYED_PATH is rebuilt if that directory is gone,
+which also recreates the worktree. Callers always get a deep copy since views
+add request specific keys to the context.
+'''
+
+KEY_PREFIX = 'jspsych-context:v2'
+DEPLOYED_PATH = 'deployed_path'
+
+_lock = threading.Lock()
+_local = OrderedDict()
+
+
+def context_key(instance_id, commit):
+    return f'{KEY_PREFIX}:{instance_id}:{commit}'
+
+
+def _local_get(key):
+    with _lock:
+        entry = _local.get(key)
+        if entry is None:
+            return None
+        stored_at, context = entry
+        if time.monotonic() - stored_at > settings.EXPERIMENT_CONTEXT_LOCAL_TTL:
+            del _local[key]
+            return None
+        _local.move_to_end(key)
+        return context
+
+
+def _local_set(key, context):
+    with _lock:
+        _local[key] = (time.monotonic(), context)
+        _local.move_to_end(key)
+        while len(_local) > settings.EXPERIMENT_CONTEXT_LOCAL_SIZE:
+            _local.popitem(last=False)
+
+
+def _deployed(context):
+    path = context.get(DEPLOYED_PATH)
+    return path is None or os.path.isdir(path)
+
+
+def get_context(exp_instance, build):
+    """ Cached context for exp_instance, build(exp_instance) computes it on a
+        miss or when its worktree was removed.
+    """
+    key = context_key(exp_instance.id, exp_instance.commit)
+    context = _local_get(key)
+    if context is None or not _deployed(context):
+        context = cache.get(key)
+        if context is None or not _deployed(context):
+            context = build(exp_instance)
+            cache.set(key, context, timeout=None)
+        _local_set(key, context)
+    return copy.deepcopy(context)
+
+
+def invalidate(instance_ids, commit):
+    """ Drop cached contexts, called when a worktree for commit is added.
+        Other processes keep their local copy for at most
+        EXPERIMENT_CONTEXT_LOCAL_TTL seconds.
+    """
+    keys = [context_key(x, commit) for x in instance_ids]
+    cache.delete_many(keys)
+    with _lock:
+        for key in keys:
+            _local.pop(key, None)
+
+
+def clear_local():
+    with _lock:
+        _local.clear()
@@ -1,4 +1,4 @@
-import ast
+import json
 import math
 from collections import defaultdict
 from pathlib import Path
@@ -29,7 +29,7 @@ def export_results(results):
     res_by_task = defaultdict(list)
     for result in results:
         name = result.battery_experiment.experiment_instance.experiment_repo_id.name
-        data = task_data(result.data)
+        data = task_data(result)
         res_by_task[name].append({'subject': result.subject.__str__(), 'data': data})
     return res_by_task
 
@@ -84,7 +84,7 @@ def export_battery(bid):
         for result in results:
             task_name = result.battery_experiment.experiment_instance.experiment_repo_id.name
             beh_fname = f'{sid}_task-{task_name}_beh.json'
-            beh[beh_fname] = task_data(result.data)
+            beh[beh_fname] = task_data(result)
     return ds
 '''
 
@@ -95,9 +95,8 @@ def task_serializer(task):
         # note?
     }
 
-def task_data(data):
+def task_data(result):
     try:
-        data_ast = ast.literal_eval(data)
-        return json.dumps(data_ast)
+        return json.dumps(result.get_data())
     except:
-        return data
+        return result.data
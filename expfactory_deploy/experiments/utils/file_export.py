@@ -0,0 +1,310 @@
+import hashlib
+import itertools
+import json
+import math
+import os
+import tempfile
+
+from django.db.models import Count, F, TextField, Window
+from django.db.models.functions import Cast, RowNumber
+from django.utils import timezone
+
+from experiments import models as models
+from experiments.utils import payload as payload
+from experiments.utils.fork_pool import run_forked
+
+'''
+Export of completed results to one json file per result, laid out as
+battery-<id>/sub-<subject>_battery-<id>_order-<n>_task-<name>_asgn-<id>_data.json.
+The ExportedResult table records what has been written so that reruns only
+touch new or modified results. Decoding and writing happens in worker
+processes, the database is only ever queried from the parent. When a result's
+file name changes, e.g. a new sibling widens the order- padding, the old file
+is removed once no exported result is recorded under that name any more.
+'''
+
+RESULT_FNAME = 'sub-{sub}_{batt}_order-{order}_task-{exp_name}_asgn-{aid}_data.json'
+
+
+def result_rows(battery_ids=None):
+    """ Metadata for every completed result, without the payload. Order within
+        an assignment is computed over all of its completed results so file
+        names stay stable no matter which subset is exported.
+    """
+    results = models.Result.objects.filter(status='completed', assignment__isnull=False)
+    if battery_ids:
+        results = results.filter(assignment__battery_id__in=battery_ids)
+    return results.annotate(
+        order=Window(
+            RowNumber(),
+            partition_by=[F('assignment_id')],
+            order_by=[F('completed_at').asc(), F('id').asc()],
+        ),
+        siblings=Window(Count('id'), partition_by=[F('assignment_id')]),
+        battery_id=F('assignment__battery_id'),
+        prolific_id=F('assignment__subject__prolific_id'),
+        assignment_subject_id=F('assignment__subject_id'),
+        exp_name=F('battery_experiment__experiment_instance__experiment_repo_id__name'),
+    ).values(
+        'id', 'modified', 'assignment_id', 'order', 'siblings', 'battery_id',
+        'prolific_id', 'assignment_subject_id', 'exp_name',
+    ).order_by('id')
+
+
+def result_path(row):
+    batt = f"battery-{row['battery_id']}"
+    padding = math.floor(math.log(row['siblings'], 10)) + 1
+    fname = RESULT_FNAME.format(
+        sub=row['prolific_id'] or row['assignment_subject_id'],
+        batt=batt,
+        order=str(row['order'] - 1).zfill(padding),
+        exp_name=row['exp_name'] or 'none',
+        aid=row['assignment_id'],
+    )
+    return os.path.join(batt, fname)
+
+
+def atomic_write(path, content):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def write_result(output_dir, task):
+    """ Runs in a worker process. task is (id, path, old_hash, json_text, data). """
+    result_id, path, old_hash, json_text, data = task
+    if json_text is not None:
+        content = json_text.encode('utf-8')
+    else:
+        content = json.dumps(payload.decode(data)).encode('utf-8')
+    content_hash = hashlib.sha256(content).hexdigest()
+    full_path = os.path.join(output_dir, path)
+    if content_hash != old_hash or not os.path.isfile(full_path):
+        atomic_write(full_path, content)
+    return result_id, path, content_hash
+
+
+def write_batch(output_dir, tasks):
+    written, failed = [], []
+    for task in tasks:
+        try:
+            written.append(write_result(output_dir, task))
+        except (ValueError, SyntaxError, OSError, MemoryError, RecursionError) as e:
+            failed.append((task[0], repr(e)))
+    return written, failed
+
+
+def stale_rows(rows, full=False):
+    """ (row, path, old hash, old path) for rows that need to be written. """
+    manifest = {}
+    if not full:
+        manifest = {
+            x[0]: x[1:] for x in
+            models.ExportedResult.objects.values_list('result_id', 'path', 'content_hash', 'result_modified')
+        }
+    for row in rows:
+        path = result_path(row)
+        old_path, old_hash, old_modified = manifest.get(row['id'], (None, None, None))
+        if old_path == path and old_modified == row['modified']:
+            continue
+        yield row, path, old_hash if old_path == path else None, old_path
+
+
+def remove_moved(output_dir, old_paths, batch_size=500):
+    """ Delete files left behind by results that were written under a new
+        name, unless another result is now exported there.
+    """
+    old_paths = sorted(set(old_paths))
+    removed = 0
+    for i in range(0, len(old_paths), batch_size):
+        batch = old_paths[i:i + batch_size]
+        claimed = set(models.ExportedResult.objects.filter(path__in=batch).values_list('path', flat=True))
+        for path in batch:
+            if path in claimed:
+                continue
+            try:
+                os.unlink(os.path.join(output_dir, path))
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+def record_written(written, modified):
+    now = timezone.now()
+    entries = [
+        models.ExportedResult(
+            result_id=result_id, path=path, content_hash=content_hash,
+            result_modified=modified[result_id], exported_at=now,
+        )
+        for result_id, path, content_hash in written
+    ]
+    models.ExportedResult.objects.bulk_create(
+        entries,
+        update_conflicts=True,
+        unique_fields=['result'],
+        update_fields=['path', 'content_hash', 'result_modified', 'exported_at'],
+    )
+
+
+def export_results(output_dir, battery_ids=None, workers=None, batch_size=50, full=False, log=print):
+    """ Export new and changed results. Returns (exported count, failures). """
+    workers = workers or os.cpu_count() or 1
+    pending = stale_rows(result_rows(battery_ids).iterator(chunk_size=2000), full)
+    exported = 0
+    failures = []
+    moved = []
+
+    def batches():
+        while True:
+            batch = []
+            for stale in pending:
+                batch.append(stale)
+                if len(batch) == batch_size:
+                    break
+            if not batch:
+                return
+            by_id = {row['id']: (path, old_hash) for row, path, old_hash, _ in batch}
+            blobs = models.Result.objects.filter(id__in=by_id).annotate(
+                json_text=Cast('json_data', output_field=TextField())
+            ).values_list('id', 'json_text', 'data')
+            tasks = [(rid, *by_id[rid], json_text, data) for rid, json_text, data in blobs]
+            modified = {row['id']: row['modified'] for row, _, _, _ in batch}
+            moved.extend(old_path for _, path, _, old_path in batch if old_path and old_path != path)
+            yield (output_dir, tasks), modified
+
+    def on_done(outcome, modified):
+        nonlocal exported
+        written, failed = outcome
+        record_written(written, modified)
+        failures.extend(failed)
+        exported += len(written)
+        log(f"exported {exported} results")
+
+    run_forked(write_batch, batches(), on_done, workers)
+    removed = remove_moved(output_dir, moved)
+    if removed:
+        log(f"removed {removed} files of renamed results")
+    return exported, failures
+
+
+def trialdata_frame(data):
+    import pandas
+
+    trialdata = data.get('trialdata', []) if isinstance(data, dict) else []
+    if isinstance(trialdata, str):
+        trialdata = json.loads(trialdata)
+    return pandas.DataFrame(trialdata)
+
+
+def arrow_table(frame):
+    """ Convert a concatenated trial frame to an arrow table. Columns that mix
+        types (e.g. a response that is sometimes a list) are stored as json
+        text and string columns are dictionary encoded.
+    """
+    import pyarrow as pa
+
+    columns = {}
+    for name in frame.columns:
+        column = frame[name]
+        if column.dtype == object:
+            try:
+                array = pa.array(column, from_pandas=True)
+            except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError):
+                array = pa.array(
+                    [x if x is None or isinstance(x, str) else json.dumps(x, default=str) for x in column],
+                    type=pa.string(),
+                )
+            if pa.types.is_string(array.type):
+                array = array.dictionary_encode()
+            columns[str(name)] = array
+        else:
+            columns[str(name)] = pa.array(column, from_pandas=True)
+    return pa.table(columns)
+
+
+def write_parquet_part(path, batch, log=print):
+    """ Write the trialdata of a batch of result_rows to one parquet file,
+        returns the number of results and trials written.
+    """
+    import pandas
+    import pyarrow.parquet as pq
+
+    frames = []
+    blobs = models.Result.objects.filter(id__in=batch).values_list('id', 'json_data', 'data')
+    for result_id, json_data, data in blobs:
+        row = batch[result_id]
+        try:
+            frame = trialdata_frame(models.Result.load_data(json_data, data))
+        except (ValueError, SyntaxError) as e:
+            log(f"result {result_id} could not be decoded: {e!r}")
+            continue
+        frame['result_id'] = result_id
+        frame['assignment_id'] = row['assignment_id']
+        frame['battery_id'] = row['battery_id']
+        frame['subject'] = str(row['prolific_id'] or row['assignment_subject_id'])
+        frames.append(frame)
+    if not frames:
+        return 0, 0
+    table = arrow_table(pandas.concat(frames, ignore_index=True))
+    pq.write_table(table, path, use_dictionary=True)
+    return len(frames), table.num_rows
+
+
+def parquet_batches(rows, batch_size):
+    """ Stream (task_name, {id: row}) batches of result_rows ordered by task,
+        never mixing tasks.
+    """
+    batch = {}
+    batch_task = None
+    for row in rows.iterator(chunk_size=2000):
+        task_name = row['exp_name'] or 'none'
+        if batch and (task_name != batch_task or len(batch) == batch_size):
+            yield batch_task, batch
+            batch = {}
+        batch_task = task_name
+        batch[row['id']] = row
+    if batch:
+        yield batch_task, batch
+
+
+def export_parquet(output_dir, battery_ids=None, task_names=None, batch_size=200, log=print):
+    """ Write trialdata of completed results as one hive partitioned parquet
+        dataset, output_dir/trialdata/exp_name=<task>/part-<n>.parquet, with
+        one part file per batch_size results so only a single batch is held
+        in memory. Column types are inferred per part file. A task's previous
+        part files are replaced once all of its new ones are written.
+    """
+    root = os.path.join(output_dir, 'trialdata')
+    rows = result_rows(battery_ids).order_by('exp_name', 'id')
+    if task_names:
+        rows = rows.filter(battery_experiment__experiment_instance__experiment_repo_id__name__in=task_names)
+
+    batches = parquet_batches(rows, batch_size)
+    for task_name, task_batches in itertools.groupby(batches, key=lambda x: x[0]):
+        task_dir = os.path.join(root, f'exp_name={task_name}')
+        os.makedirs(task_dir, exist_ok=True)
+        parts = results = trials = 0
+        for _, batch in task_batches:
+            path = os.path.join(task_dir, f'part-{parts:05d}.parquet.tmp')
+            written, num_rows = write_parquet_part(path, batch, log)
+            if written:
+                parts += 1
+                results += written
+                trials += num_rows
+        if not parts:
+            continue
+        for name in os.listdir(task_dir):
+            if name.endswith('.parquet'):
+                os.remove(os.path.join(task_dir, name))
+        for part in range(parts):
+            path = os.path.join(task_dir, f'part-{part:05d}.parquet')
+            os.replace(f'{path}.tmp', path)
+        log(f"wrote {trials} trials from {results} results for {task_name}")
@@ -0,0 +1,41 @@
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django import db
+
+'''
+Bounded process pool for batch jobs that do the CPU heavy part in workers,
+like result export and batch QA. Workers are forked so they share the already
+configured django settings. Database connections are closed and every worker
+is forked before the first job is pulled, so no worker inherits an open
+connection and workers that query open their own.
+'''
+
+
+def run_forked(func, jobs, on_done, workers):
+    """ Call func(*args) in a worker for every (args, context) in jobs, and
+        on_done(result, context) in this process as each one finishes. jobs
+        is consumed lazily with at most workers * 2 calls in flight.
+    """
+    if not db.connection.in_atomic_block:
+        db.connections.close_all()
+    mp_context = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context) as executor:
+        # forked pools start all their workers on the first submit
+        executor.submit(int).result()
+        jobs = iter(jobs)
+        in_flight = {}
+        exhausted = False
+        while True:
+            while not exhausted and len(in_flight) < workers * 2:
+                job = next(jobs, None)
+                if job is None:
+                    exhausted = True
+                    break
+                args, context = job
+                in_flight[executor.submit(func, *args)] = context
+            if not in_flight:
+                break
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                on_done(future.result(), in_flight.pop(future))
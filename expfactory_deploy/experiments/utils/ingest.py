@@ -0,0 +1,210 @@
+import asyncio
+import contextvars
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import sentry_sdk
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.db import close_old_connections, transaction
+from django_q.tasks import async_task
+
+from experiments import models as models
+from expfactory_deploy.utils.query_budget import record_in_thread
+
+'''
+Storing results posted by experiments, shared by the Results and ResultIngest
+views. store_result locks the assignment row, so posts for one participant are
+written one at a time even when they reach different server processes.
+ResultIngest runs the writes on a pool of RESULT_INGEST_WORKERS threads per
+process and only answers once they are committed. At most
+RESULT_INGEST_QUEUE_SIZE intermediate syncs wait for the pool, past that they
+are refused and the client sends the same trials again with its next sync.
+'''
+
+_lock = threading.Lock()
+_executor = None
+_slots = None
+
+
+def parse(body):
+    """ Decode a posted result, raises ValueError if it isn't one. """
+    data = json.loads(body)
+    if type(data) is not dict:
+        raise ValueError("result must be a json object")
+    if data.get("seq") is not None:
+        data["seq"] = int(data["seq"])
+    return data
+
+
+def prepare(data, assignment, user_agent, ip):
+    """ Fill in request details, returns whether this is the finished post. """
+    finished = data.get("status") == "finished"
+    if assignment.status == "not-started":
+        assignment.status = "started"
+    if assignment.subject.prolific_id is not None and data.get('prolific_id') is None:
+        data['prolific_id'] = assignment.subject.prolific_id
+    data['user_agent'] = user_agent
+    data['ip'] = ip
+    return finished
+
+
+def _send_reload_email(body, attachments=()):
+    try:
+        message = EmailMessage(
+            "Potential Experiment Reload",
+            body,
+            settings.SERVER_EMAIL,
+            [a[1] for a in settings.MANAGERS],
+        )
+        for name, content in attachments:
+            message.attach(name, content, "application/json")
+        message.send()
+    except Exception as e:
+        sentry_sdk.capture_exception(e)
+
+
+def append_chunk(result, data):
+    """ Delta syncs carry a "seq" key and only the trials from that index on.
+        They are appended to the result as chunks instead of rewriting data.
+    """
+    seq = int(data.pop("seq"))
+    trials = data.get("trialdata", [])
+    if type(trials) is str:
+        trials = json.loads(trials)
+    # a second first chunk means the experiment started over, rather than
+    # the first sync simply arriving late
+    chunks = set(result.chunks.values_list("seq", flat=True))
+    if seq == 0 and 0 in chunks and len(chunks) > 1:
+        _send_reload_email(f"""
+            Subject: {result.subject.id} - {result.subject.prolific_id}
+            Assignment: { result.assignment_id }
+            Result: { result.id }
+            Previous Modified: { result.modified.isoformat() }
+            Current Time: { datetime.utcnow().isoformat() }
+            Delta sync restarted from the first trial.
+        """)
+        # Trials from the earlier run are stale. Later chunks are kept
+        # otherwise, they may just have arrived first.
+        result.chunks.filter(seq__gt=0).delete()
+    models.ResultChunk.objects.update_or_create(
+        result=result, seq=seq, defaults={"trials": trials}
+    )
+
+
+def store_result(assignment, batt_exp, data, finished):
+    """ Write a prepared post to the participant's in progress result, or a
+        new one. Runs in the caller's transaction. Returns None for a sync
+        that arrived after the experiment was finished.
+    """
+    # serializes posts for this assignment until the transaction ends
+    models.Assignment.objects.select_for_update().filter(id=assignment.id).exists()
+    new_status = "completed" if finished else "started"
+    results = list(models.Result.objects.filter(
+        assignment=assignment, battery_experiment=batt_exp, subject=assignment.subject
+    ))
+    inprogress_statuses = ["started", "not-started"]
+
+    inprogress_results = [x for x in results if x.status in inprogress_statuses]
+    if not finished and not len(inprogress_results) and any(x.status == "completed" for x in results):
+        return None
+    if not finished and data.get("seq") is not None:
+        if len(inprogress_results):
+            result = inprogress_results[0]
+        else:
+            envelope = {k: v for k, v in data.items() if k not in ["trialdata", "seq"]}
+            result = models.Result.objects.create(
+                assignment=assignment, battery_experiment=batt_exp, subject=assignment.subject,
+                json_data=envelope, status=new_status
+            )
+        append_chunk(result, data)
+    elif len(inprogress_results):
+        result = inprogress_results[0]
+        try:
+            # includes the trials of any delta syncs
+            old_data = result.get_data()
+            prev_length = len(old_data.__str__())
+            new_length = len(data.__str__())
+            if prev_length > new_length:
+                _send_reload_email(
+                    f"""
+                        Subject: {assignment.subject.id} - {assignment.subject.prolific_id}
+                        Assignment: { assignment.id }
+                        Result: { result.id }
+                        Previous Modified: { result.modified.isoformat() }
+                        Current Time: { datetime.utcnow().isoformat() }
+                        Old Length: { prev_length }
+                        New Length: { new_length }
+                    """,
+                    [
+                        (f"old_data_rid{result.id}.json", json.dumps(old_data, indent=4, default=str)),
+                        (f"new_data_rid{result.id}.json", json.dumps(data, indent=4, default=str)),
+                    ],
+                )
+        except Exception as e:
+            sentry_sdk.capture_exception(e)
+        # a full post supersedes any delta sync chunks
+        result.compact_chunks(data)
+        result.status = new_status
+        result.save()
+    else:
+        result = models.Result(
+            assignment=assignment, battery_experiment=batt_exp, subject=assignment.subject,
+            json_data=data, status=new_status
+        )
+        result.save()
+
+    if finished:
+        # QA is computed out of band once the result is committed.
+        result_id = result.id
+        transaction.on_commit(
+            lambda: async_task("analysis.tasks.qa_result", result_id),
+            robust=True,
+        )
+
+    if assignment.status == "not-started":
+        assignment.status = "started"
+        assignment.save()
+
+    return result
+
+
+def _pool():
+    global _executor, _slots
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.RESULT_INGEST_WORKERS, thread_name_prefix="result-ingest"
+            )
+            _slots = threading.BoundedSemaphore(settings.RESULT_INGEST_QUEUE_SIZE)
+    return _executor, _slots
+
+
+def _store(assignment, batt_exp, data, finished):
+    close_old_connections()
+    try:
+        with record_in_thread(), transaction.atomic():
+            result = store_result(assignment, batt_exp, data, finished)
+            return result and result.id
+    finally:
+        close_old_connections()
+
+
+async def store(assignment, batt_exp, data, finished):
+    """ Store a post on the worker pool and wait for it to commit. Returns
+        False if the post was an intermediate sync and too many were already
+        waiting.
+    """
+    executor, slots = _pool()
+    if not finished and not slots.acquire(blocking=False):
+        return False
+    try:
+        await asyncio.wrap_future(executor.submit(
+            contextvars.copy_context().run, _store, assignment, batt_exp, data, finished
+        ))
+    finally:
+        if not finished:
+            slots.release()
+    return True
@@ -0,0 +1,66 @@
+import ast
+import json
+import re
+from json.encoder import encode_basestring
+
+'''
+Decoding for result payloads stored before Result.json_data existed. Those
+were written by assigning a dict to a TextField, so the column holds the
+python repr of whatever json.loads produced. ast.literal_eval handles that but
+builds a full syntax tree first, which is slow and memory hungry for the
+multi megabyte payloads long tasks produce. The repr of json derived data is
+close enough to json that a single regex pass can rewrite it.
+'''
+
+# Runs of punctuation, numbers and single quoted strings without double quotes
+# or escapes only need their quotes swapped, which str.translate does in C.
+# Everything else is handled one token at a time.
+_TOKEN = re.compile(
+    r"""((?:[^'"\\TFNni]+|'[^'"\\]*')+)"""
+    r"""|('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")"""
+    r"""|(True|False|None|nan|inf)""",
+    re.DOTALL,
+)
+
+_QUOTES = {ord("'"): '"'}
+
+_WORDS = {
+    "True": "true",
+    "False": "false",
+    "None": "null",
+    "nan": "NaN",
+    "inf": "Infinity",
+}
+
+
+def _replace(match):
+    plain, string, word = match.groups()
+    if plain is not None:
+        return plain.translate(_QUOTES)
+    if word is not None:
+        return _WORDS[word]
+    if "\\" not in string:
+        if string[0] == '"':
+            return string
+        return encode_basestring(string[1:-1])
+    # Python escapes such as \x or \' are not valid json.
+    return encode_basestring(ast.literal_eval(string))
+
+
+def repr_to_json(raw):
+    return _TOKEN.sub(_replace, raw)
+
+
+def decode(raw):
+    """ Decode a payload that is either json or the repr of json data. """
+    if not raw:
+        return {}
+    try:
+        return json.loads(raw)
+    except ValueError:
+        pass
+    try:
+        return json.loads(repr_to_json(raw))
+    except ValueError:
+        pass
+    return ast.literal_eval(raw)
@@ -1,12 +1,15 @@
+import fcntl
 import json
 import os
 import pathlib
 import time
+from contextlib import contextmanager
 
 import git
 import jsonschema
 from django.conf import settings
 from git.exc import GitError
+from gitdb.exc import BadName
 
 """
 Given a repo, crawl its subdirectories and return paths to directories with valid config.json
@@ -93,11 +96,26 @@ def commit_date(repo_location, commit=None):
 def is_valid_commit(repo_location, commit):
     try:
         repo = git.Repo(repo_location)
-        repo.commit(commit)
+        # full hex shas aren't looked up until the commit is read
+        repo.commit(commit).tree
         return True
-    except GitError as e:
+    except (GitError, BadName, ValueError) as e:
         return False
 
 def pull_origin(repo_location):
     repo = git.Repo(repo_location)
     repo.remotes.origin.pull()
+
+
+@contextmanager
+def repo_lock(repo_location):
+    """ Exclusive lock on a repository across processes, held while its
+        worktrees are modified.
+    """
+    lock_path = pathlib.Path(repo_location, ".git", "expfactory-worktree.lock")
+    with open(lock_path, "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -1,9 +1,10 @@
-import json
 import sys
 from datetime import datetime
+from functools import partial
 from pathlib import Path
 from urllib.parse import urlencode
 
+from asgiref.sync import sync_to_async
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Field, Layout, Submit
 from django.conf import settings
@@ -13,23 +14,23 @@ from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.postgres.aggregates import ArrayAgg
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.serializers import serialize
-from django.core.mail import EmailMessage
+from django.db import transaction
 from django.db.models import F, Q
 from django.forms import formset_factory, TextInput
-from django.http import HttpResponse, HttpResponseRedirect, JsonResponse, FileResponse
-from django.shortcuts import get_object_or_404, render, redirect
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseRedirect, JsonResponse, FileResponse
+from django.shortcuts import aget_object_or_404, get_object_or_404, render, redirect
 from django.urls import reverse, reverse_lazy
 from django.utils import timezone
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import DetailView, ListView, TemplateView, View
 from django.views.generic.edit import CreateView, DeleteView, UpdateView, FormView
+from django_q.tasks import async_task
 from taggit.models import Tag
 
-import sentry_sdk
-
 from experiments import forms as forms
 from experiments import models as models
+from experiments.utils import context_cache, ingest
 from experiments.utils.repo import find_new_experiments, get_latest_commit
 from experiments.utils.assignments import batch_assignments
 from experiments.utils.export import export_battery, export_subject, export_single_result
@@ -294,6 +295,10 @@ def publish_battery(request, pk):
     battery = get_object_or_404(models.Battery, pk=pk)
     battery.status = "published"
     battery.save()
+    transaction.on_commit(
+        partial(async_task, "experiments.tasks.deploy_battery", battery.id),
+        robust=True,
+    )
     return HttpResponseRedirect(reverse_lazy("experiments:battery-detail", kwargs={'pk':pk}))
 
 @login_required
@@ -363,21 +368,24 @@ class BatteryClone(LoginRequiredMixin, View):
         return redirect('experiments:battery-list')
 
 def jspsych_context(exp_instance):
+    return context_cache.get_context(exp_instance, build_jspsych_context)
+
+def build_jspsych_context(exp_instance):
     deploy_static_fs = exp_instance.deploy_static()
     deploy_static_url = deploy_static_fs.replace(
         settings.DEPLOYMENT_DIR, settings.STATIC_DEPLOYMENT_URL
     )
-    location = exp_instance.experiment_repo_id.location
-    origin_path = exp_instance.experiment_repo_id.origin.path
-    exp_fs_path = Path(location.replace(origin_path, deploy_static_fs))
-    exp_url_path = Path(location.replace(origin_path, deploy_static_url))
+    exp_fs_path = Path(exp_instance.deployed_location(deploy_static_fs))
+    exp_url_path = Path(exp_instance.deployed_location(deploy_static_url))
 
     # default js/css location for poldracklab style experiments
     static_url_path = Path(settings.STATIC_NON_REPO_URL, "default")
 
-    return generate_experiment_context(
+    context = generate_experiment_context(
         exp_fs_path, static_url_path, exp_url_path
     )
+    context[context_cache.DEPLOYED_PATH] = deploy_static_fs
+    return context
 
 class Preview(View):
     def get(self, request, *args, **kwargs):
@@ -462,7 +470,7 @@ class Serve(View):
                     self.subject.last_exp = self.experiment.experiment_repo_id
                 self.subject.last_url = request.build_absolute_uri()
                 self.subject.last_url_at = timezone.now()
-                self.subject.save()
+                self.subject.save(update_fields=["last_exp", "last_url", "last_url_at"])
             except Exception as e:
                 print(e)
                 return
@@ -481,6 +489,8 @@ class Serve(View):
         if self.assignment.consent_accepted is not True and self.battery.consent:
             return redirect(self.get_consent_url())
 
+        # reuse the battery already loaded rather than fetching it again
+        self.assignment.battery = self.battery
         self.experiment, num_left = self.assignment.get_next_experiment()
         self.set_last_load(request)
 
@@ -488,7 +498,7 @@ class Serve(View):
             return self.complete(request)
 
         exp_context = jspsych_context(self.experiment)
-        exp_context["post_url"] = reverse_lazy("experiments:push-results", args=[self.assignment.id, self.experiment.id])
+        exp_context["post_url"] = reverse_lazy("experiments:ingest-results", args=[self.assignment.id, self.experiment.id])
 
         # We could insert this into finish message
         # exp_context["num_left"] = num_left
@@ -613,66 +623,51 @@ class Results(View):
     # If more frameworks are added this would dispatch to their respective
     # versions of this function.
     # expfactory-docker purges keys and process survey data at this step
-    def process_exp_data(self, post_data, assignment):
-        data = json.loads(post_data)
-        finished = data.get("status") == "finished"
-        if assignment.status == "not-started":
-            assignment.status = "started"
-        if assignment.subject.prolific_id != None and data.get('prolific_id') is None:
-            data['prolific_id'] = assignment.subject.prolific_id
-        return data, finished
-
     def post(self, request, *args, **kwargs):
         assignment_id = self.kwargs.get("assignment_id")
         experiment_id = self.kwargs.get("experiment_id")
         exp_instance = get_object_or_404(models.ExperimentInstance, id=experiment_id)
         assignment = get_object_or_404(models.Assignment, id=assignment_id)
         batt_exp = get_object_or_404(models.BatteryExperiments, battery=assignment.battery, experiment_instance=exp_instance)
-        data, finished = self.process_exp_data(request.body, assignment)
-        data['user_agent'] = request.META['HTTP_USER_AGENT']
-        data['ip'] = request.META['REMOTE_ADDR']
-
-        new_status = "completed" if finished else "started"
-        results = models.Result.objects.filter(assignment=assignment, battery_experiment=batt_exp, subject=assignment.subject)
-        inprogress_statuses = ["started", "not-started"]
-
-
-        inprogress_results = [x for x in results if x.status in inprogress_statuses]
-        if len(inprogress_results):
-            result = inprogress_results[0]
-            try:
-                prev_length = len(result.data.__str__())
-                new_length = len(data.__str__())
-                if prev_length > new_length:
-                    message = EmailMessage(
-                        f"Potential Experiment Reload",
-                        f"""
-                            Subject: {assignment.subject.id} - {assignment.subject.prolific_id}
-                            Assignment: { assignment.id }
-                            Result: { result.id }
-                            Previous Modified: { result.modified.isoformat() }
-                            Current Time: { datetime.utcnow().isoformat() }
-                            Old Length: { prev_length }
-                            New Length: { new_length }
-                        """,
-                        settings.SERVER_EMAIL,
-                        [a[1] for a in settings.MANAGERS],
-                    )
-                    message.attach(f"old_data_rid{result.id}.json", json.dumps(result.data, indent=4, default=str), "application/json")
-                    message.attach(f"new_data_rid{result.id}.json", json.dumps(data, indent=4, default=str), "application/json")
-                    message.send()
-            except Exception as e:
-                sentry_sdk.capture_exception(e)
-            result.data = data
-            result.status = new_status
-            result.save()
-        else:
-            models.Result(assignment=assignment, battery_experiment=batt_exp, subject=assignment.subject, data=data, status=new_status).save()
+        try:
+            data = ingest.parse(request.body)
+        except ValueError:
+            return HttpResponseBadRequest("invalid result")
+        finished = ingest.prepare(data, assignment, request.META['HTTP_USER_AGENT'], request.META['REMOTE_ADDR'])
+        ingest.store_result(assignment, batt_exp, data, finished)
+        return HttpResponse('recieved')
 
-        if assignment.status == "not-started":
-            assignment.status = "started"
-            assignment.save()
 
+@method_decorator(csrf_exempt, name='dispatch')
+class ResultIngest(View):
+    """ Async version of Results. The body is decoded and the result written
+        on worker threads, the event loop only waits for them. Posts are
+        answered once committed.
+    """
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # writes get their own transaction in ingest's executors
+        return transaction.non_atomic_requests(super().as_view(**initkwargs))
+
+    async def post(self, request, *args, **kwargs):
+        if int(request.META.get("CONTENT_LENGTH") or 0) > settings.DATA_UPLOAD_MAX_MEMORY_SIZE:
+            return HttpResponse("result too large", status=413)
+        try:
+            data = await sync_to_async(lambda: ingest.parse(request.read()), thread_sensitive=False)()
+        except ValueError:
+            return HttpResponseBadRequest("invalid result")
+        exp_instance = await aget_object_or_404(models.ExperimentInstance, id=self.kwargs.get("experiment_id"))
+        assignment = await aget_object_or_404(
+            models.Assignment.objects.select_related("subject"), id=self.kwargs.get("assignment_id")
+        )
+        batt_exp = await aget_object_or_404(
+            models.BatteryExperiments, battery_id=assignment.battery_id, experiment_instance=exp_instance
+        )
+        finished = ingest.prepare(data, assignment, request.META.get('HTTP_USER_AGENT'), request.META.get('REMOTE_ADDR'))
+        if not await ingest.store(assignment, batt_exp, data, finished):
+            response = HttpResponse('busy', status=503)
+            response["Retry-After"] = "5"
+            return response
         return HttpResponse('recieved')
 
 class SubjectDetail(LoginRequiredMixin, DetailView):
@@ -9,7 +9,8 @@ from django.contrib import messages
 from django.http import HttpResponseRedirect
 from prolific.models import (
     StudyCollection, Study, StudyRank, StudySubject, 
-    StudyCollectionSubject, SimpleCC, ProlificAPIResult, BlockedParticipant
+    StudyCollectionSubject, SimpleCC, ProlificAPIResult, BlockedParticipant, Timer,
+    ProlificSubmission, ParticipantGroupMember, MirrorSyncState, CollectionProgressRollup
 )
 
 
@@ -527,6 +528,50 @@ class BlockedParticipantAdmin(admin.ModelAdmin):
     deactivate_participants.short_description = "Deactivate selected participants"
 
 
+@admin.register(Timer)
+class TimerAdmin(admin.ModelAdmin):
+    list_display = ('id', 'func', 'args', 'due_at', 'claimed_at', 'fired_at', 'failed')
+    list_filter = ('func', 'fired_at')
+    readonly_fields = ('created', 'claimed_at', 'fired_at', 'result', 'error')
+
+    def failed(self, obj):
+        return bool(obj.error)
+    failed.boolean = True
+
+
+@admin.register(CollectionProgressRollup)
+class CollectionProgressRollupAdmin(admin.ModelAdmin):
+    list_display = ('study_collection', 'study', 'status', 'count')
+    list_filter = ('status',)
+    raw_id_fields = ('study_collection', 'study')
+
+
+@admin.register(ProlificSubmission)
+class ProlificSubmissionAdmin(admin.ModelAdmin):
+    list_display = ('submission_id', 'participant_id', 'study', 'status', 'started_at', 'completed_at', 'synced_at')
+    list_filter = ('status',)
+    search_fields = ('submission_id', 'participant_id', 'study__remote_id')
+    raw_id_fields = ('study',)
+
+
+@admin.register(ParticipantGroupMember)
+class ParticipantGroupMemberAdmin(admin.ModelAdmin):
+    list_display = ('participant_group', 'participant_id', 'added_at', 'synced_at')
+    search_fields = ('participant_group', 'participant_id')
+
+
+@admin.register(MirrorSyncState)
+class MirrorSyncStateAdmin(admin.ModelAdmin):
+    list_display = ('kind', 'key', 'synced_at', 'failed')
+    list_filter = ('kind',)
+    search_fields = ('key',)
+    readonly_fields = ('synced_at', 'error')
+
+    def failed(self, obj):
+        return bool(obj.error)
+    failed.boolean = True
+
+
 # Keep existing django-q customizations
 from django_q import models as q_models
 from django_q import admin as q_admin
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ProlificConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "prolific"
+
+    def ready(self):
+        import prolific.signals  # noqa F401
@@ -1,5 +1,4 @@
 from datetime import datetime
-import ast
 import csv
 import json
 import os
@@ -244,12 +243,12 @@ class ManualUploadForm(forms.Form):
 
         if started_count == 1 and other_count == 0:
             result = results.get(status='started')
-            if result.data != '':
+            if result.json_data is not None or result.data != '':
                 old_data_fname = os.path.join(self.sub_dir, f"{self.fname_stub}_old_data.json")
-                old_data = ast.literal_eval(result.data)
+                old_data = result.get_data()
                 with open(old_data_fname, 'w') as fp:
                     json.dump(old_data,fp)
-            result.data = export
+            result.compact_chunks(export)
             result.status = 'completed'
             result.save()
             self.saved_to_result = True
@@ -275,7 +274,7 @@ class ManualUploadForm(forms.Form):
                     assignment=assgn,
                     battery_experiment=batt_exp,
                     subject=self.subject,
-                    data=export,
+                    json_data=export,
                     status='completed'
                 ).save()
                 self.saved_to_result = True
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from prolific import rollup
+
+
+class Command(BaseCommand):
+    help = "Recompute collection progress counts from subjects and assignments"
+
+    def add_arguments(self, parser):
+        parser.add_argument("collection_ids", nargs="*", type=int)
+
+    def handle(self, *args, **options):
+        rows = rollup.rebuild(options["collection_ids"] or None)
+        self.stdout.write(f"wrote {rows} rollup rows")
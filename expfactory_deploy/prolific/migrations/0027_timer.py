@@ -0,0 +1,44 @@
+# Generated by Django 5.1.4 on 2026-10-17 18:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("prolific", "0026_alter_prolificapiresult_collection"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Timer",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("func", models.TextField()),
+                ("args", models.JSONField(default=list)),
+                ("due_at", models.DateTimeField()),
+                ("created", models.DateTimeField(auto_now_add=True)),
+                ("claimed_at", models.DateTimeField(blank=True, null=True)),
+                ("fired_at", models.DateTimeField(blank=True, null=True)),
+                ("result", models.TextField(blank=True)),
+                ("error", models.TextField(blank=True)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("fired_at__isnull", True)),
+                        fields=["due_at"],
+                        name="pending_timer_due_at",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.4 on 2026-10-17 18:26
+
+from django.db import migrations
+from django.utils import timezone
+
+SWEEP_NAME = "prolific-timer-sweep"
+
+
+def create_sweep_schedule(apps, schema_editor):
+    Schedule = apps.get_model("django_q", "Schedule")
+    Schedule.objects.update_or_create(
+        name=SWEEP_NAME,
+        defaults={
+            "func": "prolific.timers.sweep",
+            "schedule_type": "I",
+            "minutes": 1,
+            "repeats": -1,
+            "next_run": timezone.now(),
+        },
+    )
+
+
+def delete_sweep_schedule(apps, schema_editor):
+    Schedule = apps.get_model("django_q", "Schedule")
+    Schedule.objects.filter(name=SWEEP_NAME).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("prolific", "0027_timer"),
+        ("django_q", "0014_schedule_cluster"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_sweep_schedule, delete_sweep_schedule),
+    ]
@@ -0,0 +1,105 @@
+# Generated by Django 5.1.4 on 2026-10-17 18:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("prolific", "0028_timer_sweep_schedule"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MirrorSyncState",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "kind",
+                    models.TextField(
+                        choices=[("submissions", "submissions"), ("group", "group")]
+                    ),
+                ),
+                (
+                    "key",
+                    models.TextField(
+                        help_text="Prolific study id or participant group id."
+                    ),
+                ),
+                ("synced_at", models.DateTimeField(blank=True, null=True)),
+                ("watermark", models.DateTimeField(blank=True, null=True)),
+                ("error", models.TextField(blank=True)),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("kind", "key"), name="unique_mirror_sync_state"
+                    )
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="ParticipantGroupMember",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("participant_group", models.TextField()),
+                ("participant_id", models.TextField()),
+                ("added_at", models.DateTimeField(blank=True, null=True)),
+                ("synced_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("participant_group", "participant_id"),
+                        name="unique_participant_group_member",
+                    )
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="ProlificSubmission",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("submission_id", models.TextField(unique=True)),
+                ("participant_id", models.TextField(db_index=True)),
+                ("status", models.TextField()),
+                ("started_at", models.DateTimeField(blank=True, null=True)),
+                ("completed_at", models.DateTimeField(blank=True, null=True)),
+                ("study_code", models.TextField(blank=True, null=True)),
+                ("synced_at", models.DateTimeField(auto_now=True)),
+                (
+                    "study",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="submissions",
+                        to="prolific.study",
+                    ),
+                ),
+            ],
+        ),
+    ]
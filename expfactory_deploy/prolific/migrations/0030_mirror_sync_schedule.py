@@ -0,0 +1,37 @@
+# Generated by Django 5.1.4 on 2026-10-17 18:34
+
+from django.db import migrations
+from django.utils import timezone
+
+SYNC_NAME = "prolific-mirror-sync"
+
+
+def create_sync_schedule(apps, schema_editor):
+    Schedule = apps.get_model("django_q", "Schedule")
+    Schedule.objects.update_or_create(
+        name=SYNC_NAME,
+        defaults={
+            "func": "prolific.sync.sync_mirrors",
+            "schedule_type": "I",
+            "minutes": 10,
+            "repeats": -1,
+            "next_run": timezone.now(),
+        },
+    )
+
+
+def delete_sync_schedule(apps, schema_editor):
+    Schedule = apps.get_model("django_q", "Schedule")
+    Schedule.objects.filter(name=SYNC_NAME).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("prolific", "0029_prolific_mirror"),
+        ("django_q", "0014_schedule_cluster"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_sync_schedule, delete_sync_schedule),
+    ]
@@ -0,0 +1,87 @@
+# Generated by Django 5.1.4 on 2026-10-17 18:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def populate_rollup(apps, schema_editor):
+    Rollup = apps.get_model("prolific", "CollectionProgressRollup")
+    StudyCollectionSubject = apps.get_model("prolific", "StudyCollectionSubject")
+    StudySubject = apps.get_model("prolific", "StudySubject")
+    rows = [
+        Rollup(study_collection_id=x["study_collection_id"], status=x["status"], count=x["count"])
+        for x in StudyCollectionSubject.objects.order_by()
+        .values("study_collection_id", "status")
+        .annotate(count=Count("id"))
+    ]
+    rows += [
+        Rollup(
+            study_collection_id=x["study__study_collection_id"],
+            study_id=x["study_id"],
+            status=x["assignment__status"],
+            count=x["count"],
+        )
+        for x in StudySubject.objects.order_by()
+        .values("study__study_collection_id", "study_id", "assignment__status")
+        .annotate(count=Count("id"))
+        if x["assignment__status"] is not None
+    ]
+    Rollup.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("prolific", "0030_mirror_sync_schedule"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CollectionProgressRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("status", models.TextField()),
+                ("count", models.IntegerField(default=0)),
+                (
+                    "study",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="prolific.study",
+                    ),
+                ),
+                (
+                    "study_collection",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="prolific.studycollection",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        condition=models.Q(("study__isnull", False)),
+                        fields=("study_collection", "study", "status"),
+                        name="unique_study_progress_rollup",
+                    ),
+                    models.UniqueConstraint(
+                        condition=models.Q(("study__isnull", True)),
+                        fields=("study_collection", "status"),
+                        name="unique_collection_progress_rollup",
+                    ),
+                ],
+            },
+        ),
+        migrations.RunPython(populate_rollup, migrations.RunPython.noop),
+    ]
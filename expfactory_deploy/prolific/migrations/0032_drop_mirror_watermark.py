@@ -0,0 +1,17 @@
+# Generated by Django 5.1.4 on 2026-10-17 19:01
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("prolific", "0031_collection_progress_rollup"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="mirrorsyncstate",
+            name="watermark",
+        ),
+    ]
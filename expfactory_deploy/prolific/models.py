@@ -1,5 +1,5 @@
 from collections import defaultdict
-from datetime import datetime, timedelta
+from datetime import timedelta
 from uuid import uuid4
 
 import sentry_sdk
@@ -195,41 +195,41 @@ class StudyCollection(models.Model):
         if not study.participant_group:
             # raise Exception("No participant group")
             return
-        response = api.get_participants(study.participant_group)
-        print(response)
-        to_promote = set([x["participant_id"] for x in response["results"]])
-        print("first promote")
-        print(to_promote)
+        groups = sorted(set(x.participant_group for x in studies if x.participant_group))
+        members_by_group = dict(
+            zip(groups, api.call_many(api.get_participants, groups))
+        )
+        first_group = set(
+            [x["participant_id"] for x in members_by_group[study.participant_group]["results"]]
+        )
 
-        to_promote = to_promote - blocked
-        for study in studies:
-            if len(to_promote) == 0:
-                return
-            if not study.remote_id:
-                raise Exception("No study id")
-            if not study.participant_group:
-                raise Exception("No participant group")
-            submissions = api.list_submissions(study.remote_id)
-            submitted = set()
-            for submission in submissions:
-                print(submission)
-                pid = submission.get("participant_id")
-                submitted.add(pid)
-                to_promote.add(pid)
-                completed_at = submission.get("completed_at")
-                if not completed_at and pid in to_promote:
-                    to_promote.remove(pid)
-                    continue
-                completed_at = datetime.fromisoformat(completed_at)
-                if (
-                    completed_at
-                    > datetime.now(completed_at.tzinfo) - self.inter_study_delay
-                ):
-                    to_promote.remove(pid)
-            add_to_group = to_promote - submitted - blocked
-            if len(add_to_group):
-                study.add_to_allowlist(list(add_to_group))
-            to_promote = to_promote - add_to_group - blocked
+        remote_ids = [x.remote_id for x in studies if x.remote_id]
+        submissions_by_study = dict(
+            zip(remote_ids, api.call_many(api.list_submissions, remote_ids))
+        )
+        from prolific import sync
+
+        for group, response in members_by_group.items():
+            sync.store_group(group, response["results"])
+        for x in studies:
+            if x.remote_id:
+                sync.store_submissions(x, submissions_by_study[x.remote_id])
+        # Only participants actually in a study's group count as allowlisted,
+        # StudySubjects may exist for adds that failed on Prolific's side.
+        allowlisted = set(
+            (x.id, member["participant_id"])
+            for x in studies if x.participant_group
+            for member in members_by_group[x.participant_group]["results"]
+        )
+        from prolific.utils import allowlist_promotions
+
+        promotions = allowlist_promotions(
+            studies, first_group, submissions_by_study, blocked, self.inter_study_delay
+        )
+        for study, pids in promotions:
+            pids = sorted(x for x in pids if (study.id, x) not in allowlisted)
+            if pids:
+                study.add_to_allowlist(pids)
         return
 
     """
@@ -379,18 +379,27 @@ class Study(models.Model):
         if not self.participant_group:
             # make new group
             return
-        api.add_to_part_group(self.participant_group, pids)
-        for pid in pids:
-            if pid is not None:
-                subject, created = Subject.objects.get_or_create(prolific_id=pid)
-                study_subject, ss_created = StudySubject.objects.get_or_create(
-                    study=self, subject=subject
-                )
+        if api.add_to_part_group(self.participant_group, pids) is not True:
+            return
+        from prolific.utils import bulk_add_study_subjects, bulk_create_subjects
+
+        subjects = bulk_create_subjects([pid for pid in pids if pid is not None])
+        bulk_add_study_subjects(subjects, self)
+        ParticipantGroupMember.objects.bulk_create(
+            [
+                ParticipantGroupMember(participant_group=self.participant_group, participant_id=x.prolific_id)
+                for x in subjects
+            ],
+            ignore_conflicts=True,
+        )
 
     def remove_participant(self, pid):
         if not self.participant_group:
             return
         api.remove_from_part_group(self.participant_group, [pid])
+        ParticipantGroupMember.objects.filter(
+            participant_group=self.participant_group, participant_id=pid
+        ).delete()
         if pid is not None:
             try:
                 subject = Subject.objects.get(prolific_id=pid)
@@ -656,3 +665,107 @@ class BlockedParticipant(TimeStampedModel):
     prolific_id = models.TextField(unique=True)
     active = models.BooleanField(default=True)
     note = models.TextField(blank=True)
+
+
+class Timer(models.Model):
+    """
+    A deferred call of a prolific task, e.g. the warning sent if a subject
+    hasn't started their first study in time. prolific.timers.sweep runs the
+    due ones, see that module.
+    """
+    func = models.TextField()
+    args = models.JSONField(default=list)
+    due_at = models.DateTimeField()
+    created = models.DateTimeField(auto_now_add=True)
+    claimed_at = models.DateTimeField(blank=True, null=True)
+    fired_at = models.DateTimeField(blank=True, null=True)
+    result = models.TextField(blank=True)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["due_at"],
+                condition=models.Q(fired_at__isnull=True),
+                name="pending_timer_due_at",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.func}{tuple(self.args)} at {self.due_at}"
+
+
+class ProlificSubmission(models.Model):
+    """
+    Local copy of a submission as listed by Prolific, refreshed by
+    prolific.sync. submission_id is the session id participants are served
+    with.
+    """
+    submission_id = models.TextField(unique=True)
+    study = models.ForeignKey(Study, on_delete=models.CASCADE, related_name="submissions")
+    participant_id = models.TextField(db_index=True)
+    status = models.TextField()
+    started_at = models.DateTimeField(blank=True, null=True)
+    completed_at = models.DateTimeField(blank=True, null=True)
+    study_code = models.TextField(blank=True, null=True)
+    synced_at = models.DateTimeField(auto_now=True)
+
+
+class ParticipantGroupMember(models.Model):
+    """ Local copy of a Prolific participant group's membership. """
+    participant_group = models.TextField()
+    participant_id = models.TextField()
+    added_at = models.DateTimeField(blank=True, null=True)
+    synced_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["participant_group", "participant_id"],
+                name="unique_participant_group_member",
+            )
+        ]
+
+
+class MirrorSyncState(models.Model):
+    """
+    When the mirror of a study's submissions or a group's membership was last
+    refreshed, and why the latest attempt failed if it did.
+    """
+    KIND = Choices("submissions", "group")
+    kind = models.TextField(choices=KIND)
+    key = models.TextField(help_text="Prolific study id or participant group id.")
+    synced_at = models.DateTimeField(blank=True, null=True)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["kind", "key"], name="unique_mirror_sync_state")
+        ]
+
+
+class CollectionProgressRollup(models.Model):
+    """
+    Precomputed progress counts for a study collection. Rows without a study
+    count the collection's StudyCollectionSubjects by status, rows with one
+    count the study's StudySubjects by the status of their assignment. Kept
+    current by prolific.signals, rebuild_progress_rollup recomputes them.
+    """
+    study_collection = models.ForeignKey(StudyCollection, on_delete=models.CASCADE)
+    study = models.ForeignKey(Study, on_delete=models.CASCADE, blank=True, null=True)
+    status = models.TextField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["study_collection", "study", "status"],
+                condition=models.Q(study__isnull=False),
+                name="unique_study_progress_rollup",
+            ),
+            models.UniqueConstraint(
+                fields=["study_collection", "status"],
+                condition=models.Q(study__isnull=True),
+                name="unique_collection_progress_rollup",
+            ),
+        ]
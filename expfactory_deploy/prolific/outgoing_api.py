@@ -1,13 +1,23 @@
 import json
-from functools import wraps
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from functools import partial, wraps
+from http import HTTPStatus
 from time import sleep
 
+import httpx
+from django import db
 from django.core.mail import EmailMessage
 from django.conf import settings
+from django.utils import timezone
 
 
 from pyrolific import Client, AuthenticatedClient
 from pyrolific import models as api_models
+from pyrolific.types import Response
 from pyrolific.api.studies import (
     get_studies,
     get_project_studies,
@@ -32,17 +42,90 @@ from pyrolific.api.messages import send_message as _send_message
 import sentry_sdk
 
 token = settings.PROLIFIC_KEY
+BASE_URL = "https://api.prolific.com"
+
+""" Both clients keep one pooled httpx.Client for the life of the process,
+    pyrolific builds it on first use with these arguments. """
+httpx_args = {
+    "limits": httpx.Limits(
+        max_connections=settings.PROLIFIC_API_CONCURRENCY,
+        max_keepalive_connections=settings.PROLIFIC_API_CONCURRENCY,
+    ),
+}
+timeout = httpx.Timeout(settings.PROLIFIC_API_TIMEOUT)
 
 client_kwargs = {
     "authorization": f"Token {token}",
-    "client": Client(base_url="https://api.prolific.com"),
+    "client": Client(base_url=BASE_URL, timeout=timeout, httpx_args=httpx_args),
 }
 
 auth_client = AuthenticatedClient(
-    base_url="https://api.prolific.com", token=token, prefix="Token"
+    base_url=BASE_URL, token=token, prefix="Token", timeout=timeout, httpx_args=httpx_args
 )
 
 
+class TokenBucket:
+    """ Process wide rate limit, rate tokens per second up to burst. reserve
+        takes a token and returns how long the caller has to wait for it.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait:
+            sleep(wait)
+
+
+bucket = TokenBucket(settings.PROLIFIC_API_RATE, settings.PROLIFIC_API_BURST)
+
+
+def retry_after(response):
+    """ Seconds asked for by a Retry-After header, None if absent. """
+    value = response.headers.get("retry-after") if response.headers else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - timezone.now()).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff(attempt, response=None):
+    """ Seconds to wait before retry number attempt, full jitter exponential
+        backoff unless the response says how long to wait.
+    """
+    if response is not None:
+        delay = retry_after(response)
+        if delay is not None:
+            return min(delay, settings.PROLIFIC_API_BACKOFF_MAX)
+    cap = min(settings.PROLIFIC_API_BACKOFF_MAX, settings.PROLIFIC_API_BACKOFF * 2 ** attempt)
+    return random.uniform(0, cap)
+
+
+def should_retry(response):
+    return response.status_code.value == 429 or response.status_code.value > 499
+
+
 class NoProlificKeyException(Exception):
     pass
 
@@ -61,23 +144,122 @@ def api_client(f):
     return wrapper
 
 
-""" Api Documentation doesn't suggest pagination on this endpoint but api response
-    has fields for it. Haven't seen it used so far. """
+def send_with_retries(send):
+    """ Call send, which makes one request and returns a pyrolific Response,
+        until it succeeds or PROLIFIC_API_MAX_ATTEMPTS are used up.
+    """
+    attempt = 0
+    while True:
+        bucket.acquire()
+        try:
+            response = send()
+        except httpx.TransportError:
+            attempt += 1
+            if attempt >= settings.PROLIFIC_API_MAX_ATTEMPTS:
+                raise
+            sleep(backoff(attempt))
+            continue
+        attempt += 1
+        if not should_retry(response) or attempt >= settings.PROLIFIC_API_MAX_ATTEMPTS:
+            return response
+        sleep(backoff(attempt, response))
+
+
+def _call_in_thread(func, arg):
+    try:
+        return func(arg)
+    finally:
+        # error responses are logged to the database from the worker thread
+        db.connection.close()
+
+
+def call_many(func, args):
+    """ [func(arg) for arg in args] with up to PROLIFIC_API_CONCURRENCY calls
+        in flight, for the sync helpers below, e.g.
+        call_many(list_submissions, study_ids). Exceptions are raised in
+        the caller.
+    """
+    args = list(args)
+    if len(args) < 2:
+        return [func(arg) for arg in args]
+    workers = min(settings.PROLIFIC_API_CONCURRENCY, len(args))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_call_in_thread, [func] * len(args), args))
 
 
 def make_call(api_func, ac=False, **kwargs):
-    retry = 0
-    while retry < 3:
-        sleep(retry * 3)
+    def send():
         if ac:
-            response = api_func.sync_detailed(client=auth_client, **kwargs)
-        else:
-            response = api_func.sync_detailed(**kwargs, **client_kwargs)
-        if response.status_code.value > 499:
-            retry += 1
-        else:
-            break
+            return api_func.sync_detailed(client=auth_client, **kwargs)
+        return api_func.sync_detailed(**kwargs, **client_kwargs)
+
+    return handle_response(api_func, kwargs, send_with_retries(send))
+
+
+# Response models of the list endpoints iter_pages follows next links for.
+PAGE_MODELS = {
+    get_studies: api_models.StudiesListResponse,
+    get_project_studies: api_models.StudiesListResponse,
+    get_participant_group_participants: api_models.ParticipantGroupMembershipListResponse,
+    get_submissions: api_models.SubmissionListResponse,
+}
+
+
+def fetch_next(api_func, href):
+    """ Page of a list endpoint from the next link of the previous page.
+        pyrolific has no paging parameters, so the link is requested as is and
+        parsed with the endpoint's response model from PAGE_MODELS.
+    """
+    model = PAGE_MODELS[api_func]
+
+    def send():
+        response = auth_client.get_httpx_client().get(href)
+        parsed = model.from_dict(response.json()) if response.status_code == 200 else None
+        return Response(
+            status_code=HTTPStatus(response.status_code),
+            content=response.content,
+            headers=response.headers,
+            parsed=parsed,
+        )
+
+    return handle_response(api_func, {"href": href}, send_with_retries(send))
 
+
+def next_href(page):
+    next_link = (page.get("_links") or {}).get("next") or {}
+    return next_link.get("href")
+
+
+def iter_pages(api_func, ac=False, prefetch=False, **kwargs):
+    """ Pages of a list endpoint, following _links.next until there is none.
+        Pages are fetched as they are consumed, with prefetch the next one is
+        requested in the background while the caller handles the current one.
+    """
+    executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    try:
+        page = make_call(api_func, ac=ac, **kwargs)
+        while True:
+            if hasattr(page, "status_code"):
+                raise GenericProlificException(f"response has status_code {page}")
+            href = next_href(page)
+            future = None
+            if href and executor:
+                future = executor.submit(_call_in_thread, partial(fetch_next, api_func), href)
+            yield page
+            if not href:
+                return
+            page = future.result() if future else fetch_next(api_func, href)
+    finally:
+        if executor:
+            executor.shutdown()
+
+
+def iter_results(api_func, ac=False, prefetch=False, **kwargs):
+    for page in iter_pages(api_func, ac=ac, prefetch=prefetch, **kwargs):
+        yield from page.get("results", [])
+
+
+def handle_response(api_func, kwargs, response):
     if response.status_code.value > 399:
         from prolific.models import ProlificAPIResult
 
@@ -104,28 +286,25 @@ def make_call(api_func, ac=False, **kwargs):
 
     if response.status_code == 204:
         return True
-    response = response.parsed.to_dict()
-    if "links" in response and response["_links"]["next"]["href"] is not None:
-        raise GenericProlificException("Next link found, implement pagination")
-    return response
+    return response.parsed.to_dict()
 
 
-def list_studies(pid=None):
+def iter_studies(pid=None, prefetch=False, **kwargs):
     if pid:
-        response = make_call(get_project_studies, project_id=pid)
-    else:
-        response = make_call(get_studies)
-    if hasattr(response, "status_code"):
-        raise GenericProlificException(response)
-    return [x for x in response.get("results", [])]
+        return iter_results(get_project_studies, prefetch=prefetch, project_id=pid, **kwargs)
+    return iter_results(get_studies, prefetch=prefetch, **kwargs)
+
+
+def list_studies(pid=None):
+    return list(iter_studies(pid))
 
 
 def list_active_studies(state="ACTIVE"):
     state = api_models.GetStudiesState(state)
-    response = make_call(get_studies, state=state)
-    if hasattr(response, "status_code"):
+    try:
+        return list(iter_studies(state=state))
+    except GenericProlificException:
         return []
-    return [x for x in response.get("results", [])]
 
 
 def study_detail(id):
@@ -182,9 +361,12 @@ def remove_from_part_group(group_id, part_ids):
     return response
 
 
+def iter_group_participants(gid, prefetch=False):
+    return iter_results(get_participant_group_participants, ac=True, prefetch=prefetch, id=gid)
+
+
 def get_participants(gid):
-    response = make_call(get_participant_group_participants, ac=True, id=gid)
-    return response
+    return {"results": list(iter_group_participants(gid))}
 
 
 """ Response to publish call puts studies in a state called 'PUBLISHING' that the api library doesn't know about.
@@ -202,11 +384,12 @@ def publish(sid):
     return response
 
 
+def iter_submissions(study_id=None, prefetch=False):
+    return iter_results(get_submissions, prefetch=prefetch, study=study_id)
+
+
 def list_submissions(sid=None):
-    response = make_call(get_submissions, study=sid)
-    if hasattr(response, "status_code"):
-        raise GenericProlificException(f"response has status_code {response}")
-    return response["results"]
+    return list(iter_submissions(sid, prefetch=True))
 
 
 def get_submission(session_id):
@@ -0,0 +1,109 @@
+from collections import Counter, defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+
+from prolific import models as models
+
+"""
+Maintenance and reads of CollectionProgressRollup. Counters are adjusted by
+deltas keyed (study_collection_id, study_id, status), study_id None being the
+collection wide StudyCollectionSubject counts. Writes that skip signals
+(queryset.update, bulk_create outside of prolific.utils) are not counted,
+rebuild recomputes everything from the source tables.
+"""
+
+
+def apply(deltas):
+    for (sc_id, study_id, status), delta in deltas.items():
+        if not delta:
+            continue
+        rows = models.CollectionProgressRollup.objects.filter(
+            study_collection_id=sc_id, study_id=study_id, status=status
+        )
+        # A decrement without a row means the rollup is already off, or that
+        # the collection or study is being deleted along with its rows.
+        if rows.update(count=F("count") + delta) or delta < 0:
+            continue
+        try:
+            with transaction.atomic():
+                models.CollectionProgressRollup.objects.create(
+                    study_collection_id=sc_id, study_id=study_id, status=status, count=delta
+                )
+        except IntegrityError:
+            # created concurrently
+            rows.update(count=F("count") + delta)
+
+
+def transition(sc_id, study_id, old_status, new_status):
+    """ Move one from old_status to new_status, either may be None for
+        rows that are created or deleted.
+    """
+    deltas = Counter()
+    if old_status is not None:
+        deltas[(sc_id, study_id, old_status)] -= 1
+    if new_status is not None:
+        deltas[(sc_id, study_id, new_status)] += 1
+    apply(deltas)
+
+
+def collection_counts(collection_ids):
+    """ {collection id: {status: count}} of StudyCollectionSubjects. """
+    counts = defaultdict(dict)
+    rows = models.CollectionProgressRollup.objects.filter(
+        study_collection_id__in=collection_ids, study__isnull=True
+    ).exclude(count=0).values_list("study_collection_id", "status", "count")
+    for sc_id, status, count in rows:
+        counts[sc_id][status] = count
+    return counts
+
+
+def study_counts(collection_id):
+    """ {study id: {assignment status: count}} for a collection's studies. """
+    counts = defaultdict(dict)
+    rows = models.CollectionProgressRollup.objects.filter(
+        study_collection_id=collection_id, study__isnull=False
+    ).exclude(count=0).values_list("study_id", "status", "count")
+    for study_id, status, count in rows:
+        counts[study_id][status] = count
+    return counts
+
+
+def rebuild(collection_ids=None):
+    """ Recompute the rollup for collection_ids, or every collection. """
+    collections = models.StudyCollection.objects.all()
+    if collection_ids:
+        collections = collections.filter(id__in=collection_ids)
+    collection_ids = list(collections.values_list("id", flat=True))
+
+    with transaction.atomic():
+        scs = (
+            models.StudyCollectionSubject.objects.filter(study_collection_id__in=collection_ids)
+            .order_by()
+            .values("study_collection_id", "status")
+            .annotate(count=Count("id"))
+        )
+        study_subjects = (
+            models.StudySubject.objects.filter(study__study_collection_id__in=collection_ids)
+            .order_by()
+            .values("study__study_collection_id", "study_id", "assignment__status")
+            .annotate(count=Count("id"))
+        )
+        rows = [
+            models.CollectionProgressRollup(
+                study_collection_id=x["study_collection_id"], status=x["status"], count=x["count"]
+            )
+            for x in scs
+        ] + [
+            models.CollectionProgressRollup(
+                study_collection_id=x["study__study_collection_id"],
+                study_id=x["study_id"],
+                status=x["assignment__status"],
+                count=x["count"],
+            )
+            for x in study_subjects
+            if x["assignment__status"] is not None
+        ]
+        models.CollectionProgressRollup.objects.filter(study_collection_id__in=collection_ids).delete()
+        models.CollectionProgressRollup.objects.bulk_create(rows, batch_size=500)
+    return len(rows)
@@ -0,0 +1,90 @@
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.dispatch import receiver
+
+from experiments.models import Assignment
+from prolific import rollup
+from prolific.models import StudyCollectionSubject, StudySubject
+
+"""
+Keep CollectionProgressRollup in step with status transitions. The status a
+row was loaded with is remembered on the instance so saves only touch the
+rollup when the status actually changed. If status was deferred when the row
+was loaded, the stored value is read just before a save that writes it.
+"""
+
+_UNKNOWN = object()
+
+
+def _remember_status(instance):
+    # status may be deferred, don't load it just for this
+    instance._rollup_status = instance.__dict__.get("status", _UNKNOWN)
+
+
+def _status_saved(instance, update_fields=None):
+    # a save with status still deferred doesn't write it
+    if update_fields is not None and "status" not in update_fields:
+        return False
+    return "status" in instance.__dict__
+
+
+@receiver(post_init, sender=StudyCollectionSubject)
+@receiver(post_init, sender=Assignment)
+def remember_status(sender, instance, **kwargs):
+    _remember_status(instance)
+
+
+@receiver(pre_save, sender=StudyCollectionSubject)
+@receiver(pre_save, sender=Assignment)
+def load_status(sender, instance, update_fields=None, **kwargs):
+    if instance._rollup_status is _UNKNOWN and instance.pk is not None and _status_saved(instance, update_fields):
+        instance._rollup_status = (
+            sender.objects.filter(pk=instance.pk).values_list("status", flat=True).first()
+        )
+
+
+@receiver(post_save, sender=StudyCollectionSubject)
+def collection_subject_saved(sender, instance, created, update_fields=None, **kwargs):
+    if not _status_saved(instance, update_fields):
+        return
+    old_status = None if created else instance._rollup_status
+    if old_status != instance.status:
+        rollup.transition(instance.study_collection_id, None, old_status, instance.status)
+    _remember_status(instance)
+
+
+@receiver(post_delete, sender=StudyCollectionSubject)
+def collection_subject_deleted(sender, instance, **kwargs):
+    # the row is gone, a deferred status can't be loaded any more
+    status = instance.__dict__.get("status", instance._rollup_status)
+    if status is not _UNKNOWN:
+        rollup.transition(instance.study_collection_id, None, status, None)
+
+
+@receiver(post_save, sender=Assignment)
+def assignment_saved(sender, instance, created, update_fields=None, **kwargs):
+    if not _status_saved(instance, update_fields):
+        return
+    old_status = instance._rollup_status
+    _remember_status(instance)
+    if created or old_status == instance.status:
+        return
+    studies = StudySubject.objects.filter(assignment=instance).values_list(
+        "study__study_collection_id", "study_id"
+    )
+    for sc_id, study_id in studies:
+        rollup.transition(sc_id, study_id, old_status, instance.status)
+
+
+@receiver(post_save, sender=StudySubject)
+def study_subject_saved(sender, instance, created, **kwargs):
+    if created and instance.assignment_id:
+        rollup.transition(
+            instance.study.study_collection_id, instance.study_id, None, instance.assignment.status
+        )
+
+
+@receiver(post_delete, sender=StudySubject)
+def study_subject_deleted(sender, instance, **kwargs):
+    status = Assignment.objects.filter(id=instance.assignment_id).values_list("status", flat=True).first()
+    if status is not None:
+        rollup.transition(instance.study.study_collection_id, instance.study_id, status, None)
@@ -0,0 +1,148 @@
+from django.db import transaction
+from django.utils import timezone
+from django_q.tasks import async_task
+from django.utils.dateparse import parse_datetime
+
+from prolific import models as models
+from prolific import outgoing_api as api
+
+"""
+Local mirror of Prolific submissions and participant group membership, so
+progress pages don't call the API while they render. sync_mirrors runs on a
+schedule and queues a sync_study task for each study of an active collection
+and a sync_group task for each of their participant groups, so no single task
+runs long enough to hit the cluster timeout or hold up the timer sweep.
+Prolific's list endpoints can't be filtered by date, so every page is still
+read, but only submissions that are new or changed since the last sync are
+written. MirrorSyncState records when each study or group was last synced.
+"""
+
+
+def _datetime(value):
+    if not value:
+        return None
+    if isinstance(value, str):
+        return parse_datetime(value)
+    return value
+
+
+def mark_synced(kind, key, error=""):
+    """ Record a sync of key, or with error a failed one, which leaves
+        synced_at as it was so staleness shows the last good sync.
+    """
+    defaults = {"error": error}
+    if not error:
+        defaults["synced_at"] = timezone.now()
+    models.MirrorSyncState.objects.update_or_create(kind=kind, key=key, defaults=defaults)
+
+
+def store_submissions(study, submissions):
+    """ Upsert the submissions Prolific listed for study. Returns how many
+        rows were new or changed.
+    """
+    existing = {
+        x[0]: x[1:] for x in models.ProlificSubmission.objects.filter(study=study).values_list(
+            "submission_id", "status", "completed_at"
+        )
+    }
+    changed = []
+    for submission in submissions:
+        started_at = _datetime(submission.get("started_at"))
+        completed_at = _datetime(submission.get("completed_at"))
+        status = str(submission.get("status", ""))
+        if existing.get(submission["id"]) == (status, completed_at):
+            continue
+        changed.append(models.ProlificSubmission(
+            submission_id=submission["id"],
+            study=study,
+            participant_id=submission.get("participant_id") or "",
+            status=status,
+            started_at=started_at,
+            completed_at=completed_at,
+            study_code=submission.get("study_code"),
+        ))
+    models.ProlificSubmission.objects.bulk_create(
+        changed,
+        update_conflicts=True,
+        unique_fields=["submission_id"],
+        update_fields=["status", "started_at", "completed_at", "study_code", "synced_at"],
+        batch_size=500,
+    )
+    mark_synced(models.MirrorSyncState.KIND.submissions, study.remote_id)
+    return len(changed)
+
+
+def store_group(group_id, participants):
+    """ Replace the mirrored membership of group_id with participants. """
+    members = {
+        x["participant_id"]: _datetime(x.get("datetime_created") or x.get("added_at"))
+        for x in participants
+    }
+    with transaction.atomic():
+        existing = set(
+            models.ParticipantGroupMember.objects.filter(participant_group=group_id).values_list(
+                "participant_id", flat=True
+            )
+        )
+        models.ParticipantGroupMember.objects.filter(
+            participant_group=group_id, participant_id__in=existing - set(members)
+        ).delete()
+        models.ParticipantGroupMember.objects.bulk_create(
+            [
+                models.ParticipantGroupMember(
+                    participant_group=group_id, participant_id=pid, added_at=members[pid]
+                )
+                for pid in set(members) - existing
+            ],
+            ignore_conflicts=True,
+            batch_size=500,
+        )
+    mark_synced(models.MirrorSyncState.KIND.group, group_id)
+
+
+def sync_study(study_id):
+    """ Refresh the mirrored submissions of one study. Failures are recorded
+        on its sync state.
+    """
+    study = models.Study.objects.get(id=study_id)
+    try:
+        submissions = api.list_submissions(study.remote_id)
+    except Exception as e:
+        mark_synced(models.MirrorSyncState.KIND.submissions, study.remote_id, error=repr(e))
+        return
+    return store_submissions(study, submissions)
+
+
+def sync_group(group_id):
+    """ Refresh the mirrored membership of one participant group. """
+    try:
+        participants = api.get_participants(group_id)
+    except Exception as e:
+        mark_synced(models.MirrorSyncState.KIND.group, group_id, error=repr(e))
+        return
+    store_group(group_id, participants["results"])
+
+
+def sync_mirrors():
+    """ Queue a sync of every study and participant group of active
+        collections. Returns how many tasks were queued.
+    """
+    studies = models.Study.objects.filter(study_collection__active=True).exclude(remote_id="")
+    groups = set()
+    for study_id, group_id in studies.values_list("id", "participant_group"):
+        async_task("prolific.sync.sync_study", study_id)
+        if group_id:
+            groups.add(group_id)
+    for group_id in sorted(groups):
+        async_task("prolific.sync.sync_group", group_id)
+    return studies.count() + len(groups)
+
+
+def staleness(studies):
+    """ {remote id or group id: MirrorSyncState} for studies, for templates
+        to show how old the mirrored data is.
+    """
+    keys = set()
+    for study in studies:
+        keys.update(x for x in (study.remote_id, study.participant_group) if x)
+    return {x.key: x for x in models.MirrorSyncState.objects.filter(key__in=keys)}
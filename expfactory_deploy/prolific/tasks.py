@@ -1,13 +1,18 @@
 from datetime import datetime, timedelta
 
+from django.conf import settings
+from django.core.cache import cache
 from django.db.models import Count
 
 from experiments import models as em
 from prolific import models as pm
 from prolific import outgoing_api as api
-from prolific.utils import add_subjects_to_collection
-
-from django_q.tasks import schedule
+from prolific.utils import (
+    add_subjects_to_collection,
+    bulk_add_subjects_to_collection,
+    bulk_create_subjects,
+)
+from prolific.timers import schedule
 
 """
 on add participant to studycollection:
@@ -32,6 +37,31 @@ def add_to_collection(subject_id, collection_id, group_index=None):
     add_subjects_to_collection([subject], collection, group_index)
 
 
+def onboarding_key(collection_id):
+    return f"prolific-onboarding:{collection_id}"
+
+
+def onboard_participants(collection_id, prolific_ids, batch_size=500):
+    """ Add prolific_ids to a collection in batches, recording progress
+        under onboarding_key for the collection subject list.
+    """
+    collection = pm.StudyCollection.objects.get(id=collection_id)
+    prolific_ids = list(dict.fromkeys(prolific_ids))
+    progress = {"total": len(prolific_ids), "done": 0, "finished": False}
+    for i in range(0, len(prolific_ids), batch_size):
+        subjects = bulk_create_subjects(prolific_ids[i:i + batch_size])
+        bulk_add_subjects_to_collection(subjects, collection)
+        progress["done"] = min(i + batch_size, len(prolific_ids))
+        cache.set(onboarding_key(collection_id), progress, settings.ONBOARDING_PROGRESS_TIMEOUT)
+
+    first_study = collection.study_set.order_by("rank").first()
+    if first_study:
+        first_study.add_to_allowlist(prolific_ids)
+    progress["finished"] = True
+    cache.set(onboarding_key(collection_id), progress, settings.ONBOARDING_PROGRESS_TIMEOUT)
+    return progress["done"]
+
+
 def on_complete_battery(sc, current_study, subject_id):
     study = sc.next_study(current_study)
     delay = sc.inter_study_delay if sc.inter_study_delay is not None else timedelta(0)
@@ -5,6 +5,7 @@ from django.urls import reverse
 
 from prolific import models as pm
 from experiments import models as em
+from experiments.tests.test_models import all_models
 from users.models import Group
 
 
@@ -30,3 +31,269 @@ def prolific_models():
         subject=assignment.subject,
         group_index=5
     )
+
+
+@pytest.mark.django_db
+def test_onboard_participants(all_models, prolific_models):
+    from datetime import timedelta
+
+    from django.core.cache import cache
+
+    from prolific.tasks import onboard_participants, onboarding_key
+
+    collection = pm.StudyCollection.objects.get(name='test sc')
+    collection.number_of_groups = 3
+    collection.time_to_start_first_study = timedelta(days=1)
+    collection.collection_time_to_warning = timedelta(days=7)
+    collection.save()
+    study = collection.study_set.get()
+    study.battery.random_order = True
+    study.battery.save()
+
+    ids = ['part_id', 'new_1', 'new_2', 'new_3', 'new_2']
+    assert onboard_participants(collection.id, ids, batch_size=2) == 4
+    assert cache.get(onboarding_key(collection.id)) == {'total': 4, 'done': 4, 'finished': True}
+
+    new_scs = pm.StudyCollectionSubject.objects.filter(
+        study_collection=collection, subject__prolific_id__startswith='new_'
+    ).order_by('id')
+    # the fixture subject already counts towards the groups
+    assert [x.group_index for x in new_scs] == [2, 0, 1]
+    assert all(x.current_study_id == study.id for x in new_scs)
+
+    study_subjects = pm.StudySubject.objects.filter(study=study).select_related('assignment')
+    assert study_subjects.count() == 4
+    for ss in study_subjects:
+        assert ss.assignment.battery_id == study.battery_id
+        assert ss.assignment.alt_id == study.remote_id or ss.subject.prolific_id == 'part_id'
+        if ss.subject.prolific_id != 'part_id':
+            assert ss.assignment.ordering.experimentorderitem_set.count() == 1
+    assert pm.Timer.objects.filter(func='prolific.tasks.initial_warning').count() == 3
+    assert pm.Timer.objects.filter(func='prolific.tasks.collection_warning').count() == 3
+
+    # rerunning adds nothing
+    onboard_participants(collection.id, ids)
+    assert pm.StudyCollectionSubject.objects.filter(study_collection=collection).count() == 4
+    assert pm.Timer.objects.count() == 6
+
+
+@pytest.mark.django_db
+def test_timer_sweep(all_models, prolific_models):
+    from datetime import datetime, timedelta
+    from unittest.mock import patch
+
+    from django.utils import timezone
+
+    from prolific import timers
+
+    scs = pm.StudyCollectionSubject.objects.get()
+    scs.status = 'completed'
+    scs.save()
+    due = timers.schedule('prolific.tasks.collection_warning', scs.id, next_run=datetime.now())
+    later = timers.schedule(
+        'prolific.tasks.collection_warning', scs.id, next_run=datetime.now() + timedelta(hours=1)
+    )
+    broken = timers.schedule('prolific.tasks.collection_warning', 0, next_run=datetime.now())
+    lost = timers.schedule('prolific.tasks.collection_warning', scs.id, next_run=datetime.now())
+    # claimed by a sweeper that died before firing it
+    pm.Timer.objects.filter(id=lost.id).update(claimed_at=timezone.now() - timedelta(hours=1))
+
+    assert timers.sweep(batch_size=2) == 3
+    due.refresh_from_db()
+    assert due.fired_at is not None
+    assert 'listed as ended' in due.result
+    later.refresh_from_db()
+    assert later.fired_at is None and later.claimed_at is None
+    broken.refresh_from_db()
+    assert broken.fired_at is not None and 'DoesNotExist' in broken.error
+    lost.refresh_from_db()
+    assert lost.fired_at is not None
+    assert timers.sweep() == 0
+
+    # the deadline is checked before every timer, unreached claims are released
+    first = timers.schedule('prolific.tasks.collection_warning', scs.id, next_run=datetime.now())
+    second = timers.schedule('prolific.tasks.collection_warning', scs.id, next_run=datetime.now())
+    with patch.object(timers.time, 'monotonic', side_effect=[0, 0, 0, 100]):
+        assert timers.sweep() == 1
+    first.refresh_from_db()
+    second.refresh_from_db()
+    assert first.fired_at is not None
+    assert second.fired_at is None and second.claimed_at is None
+
+    # a sweep killed while a timer runs doesn't run it again
+    killed = timers.schedule('sys.exit', next_run=datetime.now())
+    with pytest.raises(SystemExit):
+        timers.sweep()
+    pm.Timer.objects.filter(id=killed.id).update(claimed_at=timezone.now() - timedelta(hours=1))
+    assert timers.sweep() == 0
+
+
+def test_allowlist_promotions():
+    from datetime import datetime, timedelta, timezone
+
+    from prolific.utils import allowlist_promotions
+
+    studies = [
+        pm.Study(id=i, remote_id=f'remote_{i}', participant_group=f'group_{i}', rank=i)
+        for i in range(3)
+    ]
+    long_ago = (datetime.now(timezone.utc) - timedelta(days=2)).isoformat()
+    recently = datetime.now(timezone.utc).isoformat()
+    submissions = {
+        'remote_0': [
+            {'participant_id': 'done', 'completed_at': long_ago},
+            {'participant_id': 'recent', 'completed_at': recently},
+            {'participant_id': 'started', 'completed_at': None},
+            {'participant_id': 'blocked', 'completed_at': long_ago},
+        ],
+        'remote_1': [{'participant_id': 'done', 'completed_at': long_ago}],
+    }
+    first_group = {'done', 'recent', 'started', 'new', 'blocked'}
+    promotions = allowlist_promotions(
+        studies, first_group, submissions, {'blocked'}, timedelta(days=1)
+    )
+    assert [(study.id, pids) for study, pids in promotions] == [
+        (0, {'new'}), (2, {'done'})
+    ]
+    # without a delay recent completions count too
+    promotions = allowlist_promotions(studies, first_group, submissions, {'blocked'}, None)
+    assert [(study.id, pids) for study, pids in promotions] == [
+        (0, {'new'}), (1, {'recent'}), (2, {'done'})
+    ]
+
+
+@pytest.mark.django_db
+def test_sync_mirrors(all_models, prolific_models, admin_client):
+    from unittest.mock import patch
+
+    from django_q.models import OrmQ
+    from django_q.signing import SignedPackage
+
+    from prolific import outgoing_api as api
+    from prolific import sync
+
+    study = pm.Study.objects.get(remote_id='study_id')
+    study.participant_group = 'group_id'
+    study.save()
+
+    def submission(session_id, pid, status, completed_at=None):
+        return {
+            'id': session_id, 'participant_id': pid, 'status': status,
+            'started_at': '2024-01-01T00:00:00Z', 'completed_at': completed_at,
+        }
+
+    submissions = [
+        submission('session_id', 'part_id', 'ACTIVE'),
+        submission('other_session', 'other_id', 'APPROVED', '2024-01-02T00:00:00Z'),
+    ]
+    participants = {'results': [
+        {'participant_id': 'part_id', 'datetime_created': '2024-01-01T00:00:00Z'},
+        {'participant_id': 'other_id', 'datetime_created': '2024-01-01T00:00:00Z'},
+    ]}
+    # one task per study and group
+    assert sync.sync_mirrors() == 2
+    queued = [SignedPackage.loads(x.payload) for x in OrmQ.objects.all()]
+    assert sorted((x["func"], x["args"]) for x in queued) == [
+        ("prolific.sync.sync_group", ('group_id',)), ("prolific.sync.sync_study", (study.id,))
+    ]
+    with patch.object(api, 'list_submissions', return_value=submissions), \
+            patch.object(api, 'get_participants', return_value=participants):
+        sync.sync_study(study.id)
+        sync.sync_group('group_id')
+    assert dict(pm.ProlificSubmission.objects.values_list('submission_id', 'status')) == {
+        'session_id': 'ACTIVE', 'other_session': 'APPROVED'
+    }
+    state = pm.MirrorSyncState.objects.get(kind='submissions', key='study_id')
+    assert state.synced_at is not None
+
+    # only changed submissions are written, departed members are removed
+    submissions[0] = submission('session_id', 'part_id', 'AWAITING REVIEW', '2024-01-03T00:00:00Z')
+    participants['results'].pop()
+    assert sync.store_submissions(study, submissions) == 1
+    sync.store_group('group_id', participants['results'])
+    assert pm.ProlificSubmission.objects.get(submission_id='session_id').status == 'AWAITING REVIEW'
+    assert list(pm.ParticipantGroupMember.objects.values_list('participant_id', flat=True)) == ['part_id']
+
+    # failures keep the time of the last good sync
+    state.refresh_from_db()
+    synced_at = state.synced_at
+    with patch.object(api, 'list_submissions', side_effect=api.GenericProlificException('down')):
+        sync.sync_study(study.id)
+    state.refresh_from_db()
+    assert 'down' in state.error
+    assert state.synced_at == synced_at
+
+    # progress pages read the mirror instead of the api
+    collection = study.study_collection
+    with patch.object(api, 'make_call', side_effect=AssertionError('api called')):
+        response = admin_client.get(reverse('prolific:collection-progress-by-prolific', args=[collection.id]))
+        assert response.context['subject_study_status']['part_id'] == {'study_id': 'AWAITING REVIEW'}
+        scs = pm.StudyCollectionSubject.objects.get(study_collection=collection)
+        response = admin_client.get(reverse('prolific:collection-subject-detail', args=[scs.id]))
+        assert response.context['status'][0][1] == 'AWAITING REVIEW'
+
+
+@pytest.mark.django_db
+def test_progress_rollup(all_models, prolific_models, admin_client):
+    from prolific import rollup
+    from prolific.tasks import onboard_participants
+
+    collection = pm.StudyCollection.objects.get(name='test sc')
+    study = collection.study_set.get()
+    assignment = pm.StudySubject.objects.get(study=study).assignment
+    assignment.status = 'started'
+    assignment.save()
+    assert rollup.collection_counts([collection.id])[collection.id] == {'n/a': 1}
+    assert rollup.study_counts(collection.id)[study.id] == {'started': 1}
+
+    scs = pm.StudyCollectionSubject.objects.get(study_collection=collection)
+    scs.status = 'started'
+    scs.save()
+    scs.save()
+    scs = pm.StudyCollectionSubject.objects.get(id=scs.id)
+    scs.status = 'completed'
+    scs.save()
+    assignment = em.Assignment.objects.get(id=assignment.id)
+    assignment.status = 'completed'
+    assignment.save()
+    assert rollup.collection_counts([collection.id])[collection.id] == {'completed': 1}
+    assert rollup.study_counts(collection.id)[study.id] == {'completed': 1}
+
+    # bulk onboarding skips signals but still counts
+    onboard_participants(collection.id, ['new_1', 'new_2'])
+    assert rollup.collection_counts([collection.id])[collection.id] == {'completed': 1, 'n/a': 2}
+    assert rollup.study_counts(collection.id)[study.id] == {'completed': 1, 'not-started': 2}
+
+    pm.StudySubject.objects.filter(subject__prolific_id='new_1').delete()
+    pm.StudyCollectionSubject.objects.filter(subject__prolific_id='new_1').delete()
+    counts = rollup.collection_counts([collection.id])
+    study_counts = rollup.study_counts(collection.id)
+    assert counts[collection.id] == {'completed': 1, 'n/a': 1}
+    assert study_counts[study.id] == {'completed': 1, 'not-started': 1}
+
+    # a rebuild from the source tables agrees with the incremental counts
+    pm.CollectionProgressRollup.objects.update(count=0)
+    rollup.rebuild([collection.id])
+    assert rollup.collection_counts([collection.id]) == counts
+    assert rollup.study_counts(collection.id) == study_counts
+
+    response = admin_client.get(reverse('prolific:collection-progress-by-data', args=[collection.id]))
+    assert response.context['study_status_counts'][study.id] == {'completed': 1, 'not-started': 1}
+    assert 'study_assignments' not in response.context
+    response = admin_client.get(
+        reverse('prolific:collection-progress-by-data', args=[collection.id]), {'subjects': '1'}
+    )
+    assert study.id in response.context['study_assignments']
+
+    # saves of rows loaded with status deferred are counted
+    deferred = em.Assignment.objects.only('id').get(id=assignment.id)
+    deferred.status = 'failed'
+    deferred.save()
+    assert rollup.study_counts(collection.id)[study.id] == {'failed': 1, 'not-started': 1}
+
+    # the admin reset action goes through the signals
+    admin_client.post(
+        reverse('admin:experiments_assignment_changelist'),
+        {'action': 'reset_assignments', '_selected_action': [assignment.id]},
+    )
+    assert rollup.study_counts(collection.id)[study.id] == {'not-started': 2}
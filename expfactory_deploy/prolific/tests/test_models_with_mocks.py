@@ -115,10 +115,48 @@ class StudyCollectionModelTests(TestCase):
         # Call set_allowlists
         self.study_collection.set_allowlists()
         
-        # Verify API calls were made
-        assert_api_called(mock_api, 'get_participants', expected_calls=1)
+        # Verify API calls were made, one membership listing per study group
+        assert_api_called(mock_api, 'get_participants', expected_calls=2)
         assert_api_called(mock_api, 'list_submissions', expected_calls=2)
 
+    @mock_prolific_api()
+    def test_set_allowlists_readds_missing_members(self, mock_api):
+        """A StudySubject without group membership, e.g. from a failed add, is added again."""
+        from unittest.mock import patch
+
+        from prolific import outgoing_api
+        from prolific.utils import bulk_add_study_subjects, bulk_create_subjects
+
+        Study.objects.create(
+            battery=self.battery, study_collection=self.study_collection, rank=0,
+            remote_id="study_123", participant_group="pg_123"
+        )
+        study2 = Study.objects.create(
+            battery=self.battery, study_collection=self.study_collection, rank=1,
+            remote_id="study_456", participant_group="pg_456"
+        )
+        bulk_add_study_subjects(bulk_create_subjects(["p1", "p2"]), study2)
+        members = {"pg_123": ["p1", "p2"], "pg_456": ["p2"]}
+        completed_at = (
+            datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=1)
+        ).isoformat()
+        submissions = {
+            "study_123": [
+                {"id": f"sub_{pid}", "participant_id": pid, "status": "APPROVED", "completed_at": completed_at}
+                for pid in ["p1", "p2"]
+            ],
+            "study_456": [],
+        }
+        with patch.object(
+            outgoing_api, "get_participants",
+            side_effect=lambda gid: {"results": [{"participant_id": x} for x in members[gid]]},
+        ), patch.object(outgoing_api, "list_submissions", side_effect=lambda sid: submissions[sid]):
+            self.study_collection.set_allowlists()
+
+        assert_api_called(mock_api, 'add_to_part_group', expected_calls=1)
+        args = get_api_call_args(mock_api, 'add_to_part_group')
+        self.assertEqual(args, {"group_id": "pg_456", "participant_ids": ["p1"]})
+
 
 class StudyModelTests(TestCase):
     """Test Study model methods that interact with Prolific API."""
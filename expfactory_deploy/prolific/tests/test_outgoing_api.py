@@ -1,11 +1,14 @@
 import datetime
+from unittest.mock import patch
 
+import httpx
 from django.conf import settings
 from django.test import TestCase
 
 from experiments import models as em
 from prolific import models as pm
 from prolific import outgoing_api as api
+from prolific.tests.mock_api import ProlificAPIMock, assert_api_called
 from users.models import User
 
 
@@ -44,3 +47,107 @@ class ProlificAPITest(TestCase):
     def test_generate_hit(self):
         scs = list(pm.StudyCollection.objects.all())
         self.assertEqual(len(scs), 1)
+
+
+class ProlificClientTest(TestCase):
+    """ make_call against a stub transport instead of the real API. """
+
+    def setUp(self):
+        self.requests = []
+        self.responses = []
+        self.sleeps = []
+        transport = httpx.MockTransport(self.handle)
+        httpx_args = {**api.httpx_args, "transport": transport}
+        patches = [
+            patch.object(api, "httpx_args", httpx_args),
+            patch.object(api, "auth_client", api.AuthenticatedClient(
+                base_url=api.BASE_URL, token="token", prefix="Token", httpx_args=httpx_args
+            )),
+            patch.dict(api.client_kwargs, client=api.Client(
+                base_url=api.BASE_URL, httpx_args=httpx_args
+            )),
+            patch.object(api, "sleep", self.sleeps.append),
+            patch.object(api, "bucket", api.TokenBucket(rate=1000, burst=1000)),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def handle(self, request):
+        self.requests.append(request)
+        return self.responses.pop(0)
+
+    def test_retry_after(self):
+        self.responses = [
+            httpx.Response(429, headers={"Retry-After": "7"}),
+            httpx.Response(503),
+            httpx.Response(200, json={"results": [{"participant_id": "pid"}]}),
+        ]
+        response = api.get_participants("group_id")
+        self.assertEqual(response["results"][0]["participant_id"], "pid")
+        self.assertEqual(len(self.requests), 3)
+        self.assertEqual(self.sleeps[0], 7)
+        self.assertLessEqual(self.sleeps[1], settings.PROLIFIC_API_BACKOFF * 4)
+
+    def test_gives_up(self):
+        self.responses = [httpx.Response(500)] * settings.PROLIFIC_API_MAX_ATTEMPTS
+        with self.assertRaises(api.GenericProlificException):
+            api.get_participants("group_id")
+        self.assertEqual(len(self.requests), settings.PROLIFIC_API_MAX_ATTEMPTS)
+        self.assertEqual(pm.ProlificAPIResult.objects.count(), 1)
+
+    def page(self, results, next_page=None):
+        href = None
+        if next_page:
+            href = f"{api.BASE_URL}/api/v1/submissions/?study=study_id&page={next_page}"
+        return httpx.Response(200, json={
+            "results": results,
+            "_links": {"next": {"href": href}, "previous": {"href": None}},
+        })
+
+    def submission(self, pid):
+        return {
+            "id": f"submission_{pid}",
+            "participant_id": pid,
+            "status": "APPROVED",
+            "started_at": "2024-01-01T00:00:00Z",
+            "has_siblings": False,
+            "study_code": "code",
+        }
+
+    def test_iter_submissions(self):
+        self.responses = [
+            self.page([self.submission("a"), self.submission("b")], next_page=2),
+            self.page([self.submission("c")], next_page=3),
+            self.page([]),
+        ]
+        submissions = api.iter_submissions("study_id")
+        self.assertEqual(next(submissions)["participant_id"], "a")
+        # later pages are only requested once they are needed
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual([x["participant_id"] for x in submissions], ["b", "c"])
+        self.assertEqual(len(self.requests), 3)
+        self.assertEqual(self.requests[1].url.params["page"], "2")
+        self.assertEqual(self.requests[2].headers["Authorization"], "Token token")
+
+    def test_list_submissions_prefetch(self):
+        self.responses = [
+            self.page([self.submission("a")], next_page=2),
+            httpx.Response(503),
+            self.page([self.submission("b")]),
+        ]
+        submissions = api.list_submissions("study_id")
+        self.assertEqual([x["participant_id"] for x in submissions], ["a", "b"])
+        self.assertEqual(len(self.requests), 3)
+
+    def test_call_many(self):
+        with ProlificAPIMock() as mock_api:
+            results = api.call_many(api.study_detail, ["a", "b", "c"])
+        self.assertEqual([x["id"] for x in results], ["a", "b", "c"])
+        assert_api_called(mock_api, "study_detail", expected_calls=3)
+
+    def test_token_bucket(self):
+        bucket = api.TokenBucket(rate=10, burst=2)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertAlmostEqual(bucket.reserve(), 0.1, places=2)
@@ -1,7 +1,9 @@
+import json
 from urllib.parse import urlencode
 import pytest
 
 from django.conf import settings
+from django.core.cache import cache
 from django.test import Client
 from django.urls import reverse
 
@@ -95,3 +97,111 @@ def test_serve_battery(client, all_models, prolific_models):
     content = response.content.decode("utf-8")
     assert assignment.battery.consent not in content
     assert "group_index': 5" in content
+
+
+@pytest.mark.django_db
+def test_participant_query_budgets(client, all_models, prolific_models):
+    from expfactory_deploy.utils.query_budget import assert_query_budget
+    from experiments.utils import context_cache
+
+    assignment = pm.StudySubject.objects.first().assignment
+    exp_instance = em.ExperimentInstance.objects.first()
+    # skip the worktree checkout, the test repo isn't available here
+    context_cache.get_context(exp_instance, lambda x: {"experiment_load": "", "js_vars": {}})
+    params = {
+        settings.PROLIFIC_PARTICIPANT_PARAM: 'part_id',
+        settings.PROLIFIC_STUDY_PARAM: 'study_id',
+        settings.PROLIFIC_SESSION_PARAM: 'session_id',
+    }
+    battery_kwargs = {"battery_id": assignment.battery.pk}
+
+    with assert_query_budget("prolific:consent"):
+        assert client.get(reverse("prolific:consent", kwargs=battery_kwargs), data=params).status_code == 200
+    assignment.consent_accepted = True
+    assignment.save()
+    with assert_query_budget("prolific:serve-battery"):
+        assert client.get(reverse("prolific:serve-battery", kwargs=battery_kwargs), data=params).status_code == 200
+
+    url = reverse("experiments:push-results", kwargs={"assignment_id": assignment.pk, "experiment_id": exp_instance.pk})
+    for status in ["started", "finished"]:
+        with assert_query_budget("experiments:push-results"):
+            client.post(
+                url, json.dumps({"status": status, "trialdata": [{"rt": 1}]}),
+                content_type="application/json", HTTP_USER_AGENT="pytest",
+            )
+
+    with pytest.raises(AssertionError, match="repeated a query 3 times"):
+        with assert_query_budget("loop"):
+            for subject in em.Subject.objects.all():
+                for _ in range(3):
+                    em.Assignment.objects.filter(subject=subject).first()
+
+
+@pytest.mark.django_db
+def test_participant_cache(client, all_models, prolific_models):
+    from expfactory_deploy.utils.query_budget import record_queries
+    from experiments.utils import context_cache
+    from prolific.views import participant_key
+
+    assignment = pm.StudySubject.objects.first().assignment
+    context_cache.get_context(em.ExperimentInstance.objects.first(), lambda x: {"experiment_load": "", "js_vars": {}})
+    params = {
+        settings.PROLIFIC_PARTICIPANT_PARAM: 'part_id',
+        settings.PROLIFIC_STUDY_PARAM: 'study_id',
+        settings.PROLIFIC_SESSION_PARAM: 'session_id',
+    }
+    consent_url = reverse("prolific:consent", kwargs={"battery_id": assignment.battery.pk})
+    serve_url = reverse("prolific:serve-battery", kwargs={"battery_id": assignment.battery.pk})
+    key = participant_key(client.get(consent_url, data=params).wsgi_request)
+    assert cache.get(key) == {
+        "subject_id": assignment.subject.id,
+        "assignment_id": assignment.id,
+        "battery_id": assignment.battery.id,
+        "group_index": 5,
+        "consent_accepted": None,
+    }
+
+    client.post(f"{consent_url}?{urlencode(params)}", data={"accept": True})
+    assert cache.get(key)["consent_accepted"] is True
+
+    with record_queries() as first:
+        response = client.get(serve_url, data=params)
+    assert "group_index': 5" in response.content.decode("utf-8")
+    cache.delete(key)
+    with record_queries() as uncached:
+        client.get(serve_url, data=params)
+    assert first.count < uncached.count
+
+    em.Result.objects.create(
+        assignment=assignment, subject=assignment.subject, status="completed",
+        battery_experiment=em.BatteryExperiments.objects.first(),
+    )
+    client.get(serve_url, data=params)
+    assert cache.get(key) is None
+
+
+@pytest.mark.django_db
+def test_collection_progress_queries(admin_client, all_models, prolific_models):
+    from expfactory_deploy.utils.query_budget import assert_query_budget
+
+    collection = pm.StudyCollection.objects.get(name='test sc')
+    first = pm.Study.objects.get(study_collection=collection)
+    first.participant_group = 'group_0'
+    first.save()
+    second_battery = em.Battery.objects.create(title="second", user=first.battery.user)
+    pm.Study.objects.create(battery=second_battery, study_collection=collection, rank=1)
+    for i in range(5):
+        subject = em.Subject.objects.create(prolific_id=f"pid_{i}")
+        pm.StudyCollectionSubject.objects.create(study_collection=collection, subject=subject)
+        em.Assignment.objects.create(subject=subject, battery=first.battery, status="completed")
+        if i % 2:
+            em.Assignment.objects.create(subject=subject, battery=second_battery, status="completed")
+    pm.ParticipantGroupMember.objects.create(participant_group='group_0', participant_id='pid_1')
+
+    with assert_query_budget("prolific:collection-progress"):
+        response = admin_client.get(reverse("prolific:collection-progress", args=[collection.id]))
+    groups = {subject.prolific_id: x for subject, x in response.context["subject_groups"].items()}
+    assert len(groups) == 6
+    assert groups['pid_1'][first.battery_id] == {"completed": 1, "date_added": None}
+    assert groups['pid_1'][second_battery.id] == {"completed": 1}
+    assert groups['pid_2'][second_battery.id] == {"completed": 0}
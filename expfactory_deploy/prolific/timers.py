@@ -0,0 +1,99 @@
+import logging
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from prolific.models import Timer
+
+"""
+Deadline indexed timers for the per subject warnings and delays in
+prolific.tasks. These used to be one django-q Schedule each, which the
+cluster polls and turns into queued tasks one at a time. Here they are rows
+in Timer, and a single periodic schedule runs sweep, which claims due timers
+in batches with SELECT ... FOR UPDATE SKIP LOCKED so concurrent sweepers never
+run the same timer. A timer is marked fired just before it runs, so a sweeper
+that dies mid call never repeats it. Claims on timers it hadn't reached yet
+are picked up again after PROLIFIC_TIMER_CLAIM_TIMEOUT.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def _due_at(next_run):
+    if timezone.is_naive(next_run):
+        return timezone.make_aware(next_run)
+    return next_run
+
+
+def make_timer(func, *args, next_run):
+    """ Unsaved Timer, for bulk_create. """
+    return Timer(func=func, args=list(args), due_at=_due_at(next_run))
+
+
+def schedule(func, *args, next_run):
+    """ Call func(*args) once next_run has passed. Same calling convention
+        as django_q.tasks.schedule for one off schedules.
+    """
+    return Timer.objects.create(func=func, args=list(args), due_at=_due_at(next_run))
+
+
+def claim_due(batch_size):
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.PROLIFIC_TIMER_CLAIM_TIMEOUT)
+    with transaction.atomic():
+        ids = list(
+            Timer.objects.select_for_update(skip_locked=True)
+            .filter(fired_at__isnull=True, due_at__lte=now)
+            .filter(Q(claimed_at__isnull=True) | Q(claimed_at__lt=stale))
+            .order_by("due_at")
+            .values_list("id", flat=True)[:batch_size]
+        )
+        Timer.objects.filter(id__in=ids).update(claimed_at=now)
+    return list(Timer.objects.filter(id__in=ids).order_by("due_at"))
+
+
+def release(timers):
+    """ Give back claims on timers that weren't run, for the next sweep. """
+    Timer.objects.filter(id__in=[x.id for x in timers], fired_at__isnull=True).update(claimed_at=None)
+
+
+def fire(timer):
+    # Marked fired before the call. If the sweep is killed while it runs the
+    # timer is not retried, sending a message or kick twice is worse than
+    # missing one.
+    timer.fired_at = timezone.now()
+    timer.save(update_fields=["fired_at"])
+    try:
+        result = import_string(timer.func)(*timer.args)
+        timer.result = "" if result is None else str(result)
+    except Exception:
+        logger.exception("timer %s failed", timer.id)
+        timer.error = traceback.format_exc()
+    timer.save(update_fields=["result", "error"])
+
+
+def sweep(batch_size=None):
+    """ Run due timers until there are none left or PROLIFIC_TIMER_SWEEP_SECONDS
+        have passed, so a sweep finishes well within the cluster's task
+        timeout. Returns how many ran.
+    """
+    batch_size = batch_size or settings.PROLIFIC_TIMER_BATCH_SIZE
+    deadline = time.monotonic() + settings.PROLIFIC_TIMER_SWEEP_SECONDS
+    fired = 0
+    while time.monotonic() < deadline:
+        timers = claim_due(batch_size)
+        if not timers:
+            return fired
+        for i, timer in enumerate(timers):
+            if time.monotonic() >= deadline:
+                release(timers[i:])
+                return fired
+            fire(timer)
+            fired += 1
+    return fired
@@ -1,35 +1,189 @@
+from collections import Counter
+from datetime import datetime, timedelta
+
+from django.db import transaction
+
+from experiments import models as em
 from prolific import models as models
+from prolific import rollup
+from prolific.timers import make_timer
 
 """
-    Copied from prolific.views.ParticipantFormView.form_valid.
-    form_valid's code should be relaced with call to this.
+    Set based onboarding of participants. Creating subjects, collection
+    subjects, assignments and study subjects one get_or_create at a time costs
+    several queries per participant on top of the per row work in their save
+    methods, these do the same with a handful of queries per batch.
 """
 
 
 def add_subjects_to_collection(subjects, collection, group_index=None):
-    from prolific.tasks import on_add_to_collection
-    first_study = collection.study_set.order_by("rank").first()
-    for subject in subjects:
-        (
-            subject_collection,
-            scs_created,
-        ) = models.StudyCollectionSubject.objects.get_or_create(
-            study_collection=collection, subject=subject
-        )
-        if first_study:
-            study_subject, ss_created = models.StudySubject.objects.get_or_create(
-                study=first_study, subject=subject
-            )
-        print(f"first study: {first_study}, ss.study: {study_subject.study}")
-        if scs_created:
-            if group_index:
-                subject_collection.group_index = group_index
-                subject_collection.save()
-            on_add_to_collection(subject_collection)
-        if first_study and scs_created:
-            subject_collection.current_study = first_study
+    bulk_add_subjects_to_collection(subjects, collection, group_index)
 
     ids = [x.prolific_id for x in subjects]
+    first_study = collection.study_set.order_by("rank").first()
     if first_study:
         print(f"calling add to allow on {first_study.id} with pids: {ids}")
         first_study.add_to_allowlist(ids)
+
+
+def allowlist_promotions(studies, first_group, submissions_by_study, blocked, delay):
+    """ [(study, pids)] of participants that should be on each study's
+        allowlist. Everyone in the first study's group starts out eligible,
+        participants who completed a study at least delay ago are eligible
+        for the next one, and eligible participants without a submission
+        for a study belong on its allowlist. submissions_by_study maps remote
+        ids to the submissions listed by Prolific.
+    """
+    delay = delay if delay is not None else timedelta(0)
+    to_promote = set(first_group) - blocked
+    promotions = []
+    for study in studies:
+        if not to_promote:
+            break
+        if not study.remote_id:
+            raise Exception("No study id")
+        if not study.participant_group:
+            raise Exception("No participant group")
+        submitted = set()
+        completed = set()
+        for submission in submissions_by_study.get(study.remote_id, []):
+            pid = submission.get("participant_id")
+            submitted.add(pid)
+            completed_at = submission.get("completed_at")
+            if not completed_at:
+                continue
+            completed_at = datetime.fromisoformat(completed_at)
+            if completed_at <= datetime.now(completed_at.tzinfo) - delay:
+                completed.add(pid)
+        add_to_group = to_promote - submitted
+        if add_to_group:
+            promotions.append((study, add_to_group))
+        to_promote = completed - blocked
+    return promotions
+
+
+def bulk_create_subjects(prolific_ids):
+    """ Subjects for prolific_ids, in the same order, creating missing ones. """
+    em.Subject.objects.bulk_create(
+        [em.Subject(prolific_id=x) for x in prolific_ids], ignore_conflicts=True
+    )
+    subjects = {x.prolific_id: x for x in em.Subject.objects.filter(prolific_id__in=prolific_ids)}
+    return [subjects[x] for x in prolific_ids]
+
+
+def bulk_get_or_create_assignments(subjects, study):
+    """ {subject id: assignment} for study's battery, the bulk version of
+        what StudySubject.save does when it is first saved.
+    """
+    battery = study.battery
+    assignments = {}
+    existing = em.Assignment.objects.filter(
+        subject__in=subjects, battery=battery, alt_id=study.remote_id
+    ).order_by("id")
+    for assignment in existing:
+        assignments.setdefault(assignment.subject_id, assignment)
+    missing = [x for x in subjects if x.id not in assignments]
+    if not missing:
+        return assignments
+
+    orderings = [None] * len(missing)
+    if battery.random_order:
+        orderings = em.ExperimentOrder.bulk_generate(battery, len(missing))
+    created = em.Assignment.objects.bulk_create([
+        em.Assignment(subject=subject, battery=battery, alt_id=study.remote_id, ordering=ordering)
+        for subject, ordering in zip(missing, orderings)
+    ])
+    assignments.update({x.subject_id: x for x in created})
+    return assignments
+
+
+def bulk_add_study_subjects(subjects, study):
+    """ Make sure each subject has a StudySubject, and so an assignment, for
+        study. Returns {subject id: study subject id}.
+    """
+    existing = set(
+        models.StudySubject.objects.filter(study=study, subject__in=subjects).values_list("subject_id", flat=True)
+    )
+    missing = list({x.id: x for x in subjects if x.id not in existing}.values())
+    if missing:
+        assignments = bulk_get_or_create_assignments(missing, study)
+        models.StudySubject.objects.bulk_create(
+            [models.StudySubject(study=study, subject=x, assignment=assignments[x.id]) for x in missing],
+            ignore_conflicts=True,
+        )
+        # bulk_create skips the signals that maintain the progress rollup
+        rollup.apply(Counter(
+            (study.study_collection_id, study.id, assignments[x.id].status) for x in missing
+        ))
+    return dict(
+        models.StudySubject.objects.filter(study=study, subject__in=subjects).values_list("subject_id", "id")
+    )
+
+
+def bulk_add_subjects_to_collection(subjects, collection, group_index=None):
+    """ Add subjects to collection and its first study. Group indices follow
+        StudyCollectionSubject.save and timers those of
+        prolific.tasks.on_add_to_collection, for subjects new to the
+        collection. Returns the created StudyCollectionSubjects.
+    """
+    first_study = collection.study_set.order_by("rank").first()
+    with transaction.atomic():
+        existing = set(
+            models.StudyCollectionSubject.objects.filter(
+                study_collection=collection, subject__in=subjects
+            ).values_list("subject_id", flat=True)
+        )
+        new_subjects = list({x.id: x for x in subjects if x.id not in existing}.values())
+        number_of_groups = collection.number_of_groups
+        current_count = collection.studycollectionsubject_set.count()
+        new_scs = []
+        for i, subject in enumerate(new_subjects):
+            index = 0
+            if number_of_groups > 0:
+                index = (current_count + i + 1) % number_of_groups
+            new_scs.append(models.StudyCollectionSubject(
+                study_collection=collection,
+                subject=subject,
+                group_index=group_index or index,
+                current_study=first_study,
+            ))
+        new_scs = models.StudyCollectionSubject.objects.bulk_create(new_scs)
+        rollup.apply(Counter((collection.id, None, x.status) for x in new_scs))
+
+        if first_study:
+            study_subjects = bulk_add_study_subjects(subjects, first_study)
+            schedule_collection_timers(collection, new_scs, study_subjects)
+    return new_scs
+
+
+def schedule_collection_timers(collection, new_scs, study_subjects):
+    """ Initial and collection warning timers for newly added collection
+        subjects, created in one insert.
+    """
+    now = datetime.now()
+    timers = []
+    if (
+        collection.time_to_start_first_study is not None
+        and collection.time_to_start_first_study > timedelta(0)
+    ):
+        timers.extend(
+            make_timer(
+                "prolific.tasks.initial_warning",
+                study_subjects[scs.subject_id],
+                next_run=now + collection.time_to_start_first_study,
+            )
+            for scs in new_scs
+        )
+    if (
+        collection.collection_time_to_warning is not None
+        and collection.collection_time_to_warning > timedelta(0)
+    ):
+        timers.extend(
+            make_timer(
+                "prolific.tasks.collection_warning",
+                scs.id,
+                next_run=now + collection.collection_time_to_warning,
+            )
+            for scs in new_scs
+        )
+    models.Timer.objects.bulk_create(timers, batch_size=500)
@@ -1,14 +1,18 @@
+import hashlib
 import json
 
 from collections import defaultdict
 from datetime import timedelta
+from functools import partial
 
 from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
-from django.db.models import Count, F, Prefetch, Q
+from django.db import transaction
+from django.db.models import Count, F, Prefetch
 from django.http import (
     Http404,
     HttpResponseRedirect,
@@ -18,6 +22,7 @@ from django.urls import reverse, reverse_lazy
 from django.utils import timezone
 from django.views.generic import ListView, TemplateView, View
 from django.views.generic.edit import CreateView, FormView, UpdateView
+from django_q.tasks import async_task
 
 from experiments import views as exp_views
 from experiments import models as exp_models
@@ -26,8 +31,10 @@ from experiments import forms as exp_forms
 from prolific import models
 from prolific import forms
 from prolific import outgoing_api
+from prolific import rollup
+from prolific import sync
 
-from prolific.tasks import on_add_to_collection
+from prolific.tasks import onboarding_key
 from prolific.utils import add_subjects_to_collection
 
 """
@@ -74,18 +81,107 @@ def subject_from_query_params(request):
         return exp_models.Subject.objects.get_or_create(prolific_id=prolific_id)[0]
 
 
+def group_index_for(subject_id, assignment):
+    scs = list(
+        models.StudyCollectionSubject.objects.filter(
+            subject_id=subject_id,
+            study_collection__study__studysubject__assignment=assignment,
+        ).distinct()
+    )
+    if len(scs) != 1:
+        raise Exception(
+            f"assignment {assignment.id} produced {len(scs)} SCS objects in get_js_vars"
+        )
+    return scs[0].group_index
+
+
+"""
+    Resolving a participant from prolific's query params takes a get_or_create
+    and several StudySubject lookups, and every page of the serve flow repeats
+    it. The result is cached per (participant, study, session) as
+    {subject_id, assignment_id, battery_id, group_index, consent_accepted},
+    updated when consent is given and dropped once the battery is complete.
+"""
+
+
+def participant_key(request):
+    params = [
+        request.GET.get(settings.PROLIFIC_PARTICIPANT_PARAM, ""),
+        request.GET.get(settings.PROLIFIC_STUDY_PARAM, ""),
+        request.GET.get(settings.PROLIFIC_SESSION_PARAM, ""),
+    ]
+    digest = hashlib.sha1("\0".join(params).encode("utf-8")).hexdigest()
+    return f"prolific-participant:v1:{digest}"
+
+
+def resolve_participant(request):
+    """ (subject, assignment, participant) for the query params of request.
+        On a cache hit subject only has its id and prolific id loaded.
+    """
+    prolific_id = request.GET.get(settings.PROLIFIC_PARTICIPANT_PARAM, None)
+    key = participant_key(request)
+    participant = cache.get(key) if prolific_id is not None else None
+    if participant is not None:
+        subject = exp_models.Subject.from_db(
+            "default", ["id", "prolific_id"], [participant["subject_id"], prolific_id]
+        )
+        assignment = exp_models.Assignment.objects.select_related("battery").get(
+            id=participant["assignment_id"]
+        )
+        return subject, assignment, participant
+
+    subject = subject_from_query_params(request)
+    study_id = request.GET.get(settings.PROLIFIC_STUDY_PARAM, None)
+    session_id = request.GET.get(settings.PROLIFIC_SESSION_PARAM, None)
+    assignment = assignment_from_query_params(subject, study_id, session_id)
+    group_index = None
+    try:
+        group_index = group_index_for(subject.id, assignment)
+    except Exception:
+        # get_js_vars raises with the details if it is ever needed
+        pass
+    participant = {
+        "subject_id": subject.id,
+        "assignment_id": assignment.id,
+        "battery_id": assignment.battery_id,
+        "group_index": group_index,
+        "consent_accepted": assignment.consent_accepted,
+    }
+    if prolific_id is not None:
+        cache.set(key, participant, settings.PROLIFIC_PARTICIPANT_CACHE_TIMEOUT)
+    return subject, assignment, participant
+
+
+def update_participant(request, **changes):
+    key = participant_key(request)
+    participant = cache.get(key)
+    if participant is not None:
+        participant.update(changes)
+        cache.set(key, participant, settings.PROLIFIC_PARTICIPANT_CACHE_TIMEOUT)
+
+
+def forget_participant(request):
+    cache.delete(participant_key(request))
+
+
 class ProlificServe(exp_views.Serve):
+    participant = None
+
     def set_subject(self):
-        self.subject = subject_from_query_params(self.request)
+        self.subject, self.assignment, self.participant = resolve_participant(self.request)
+
+    def set_battery(self):
+        if self.assignment.battery_id == self.kwargs.get("battery_id"):
+            self.battery = self.assignment.battery
+        else:
+            super().set_battery()
 
     def set_assignment(self):
-        study_id = self.request.GET.get(settings.PROLIFIC_STUDY_PARAM, None)
-        session_id = self.request.GET.get(settings.PROLIFIC_SESSION_PARAM, None)
-        self.assignment = assignment_from_query_params(
-            self.subject, study_id, session_id
-        )
+        # resolved along with the subject
+        pass
 
     def complete(self, request):
+        forget_participant(request)
         studies = models.Study.objects.filter(
             battery=self.battery,
             study_collection__studycollectionsubject__subject=self.subject,
@@ -116,16 +212,10 @@ class ProlificServe(exp_views.Serve):
             return super().complete(request)
 
     def get_js_vars(self, **kwargs):
-        scs = list(
-            self.subject.studycollectionsubject_set.filter(
-                study_collection__study__studysubject__assignment=self.assignment
-            ).distinct()
-        )
-        if len(scs) != 1:
-            raise Exception(
-                f"assignment {self.assignment.id} produced {len(scs)} SCS objects in get_js_vars"
-            )
-        return super().get_js_vars(group_index=scs[0].group_index)
+        group_index = self.participant["group_index"]
+        if group_index is None:
+            group_index = group_index_for(self.subject.id, self.assignment)
+        return super().get_js_vars(group_index=group_index)
 
     def get_consent_url(self):
         base_url = reverse(
@@ -153,10 +243,7 @@ class ProlificConsent(exp_views.ServeConsent):
         return redirect(redirect_url)
 
     def get(self, request, *args, **kwargs):
-        subject = subject_from_query_params(self.request)
-        study_id = self.request.GET.get(settings.PROLIFIC_STUDY_PARAM, None)
-        session_id = self.request.GET.get(settings.PROLIFIC_SESSION_PARAM, None)
-        assignment = assignment_from_query_params(subject, study_id, session_id)
+        subject, assignment, participant = resolve_participant(self.request)
 
         if assignment.consent_accepted:
             return self.consent_accepted_redirect(assignment, request)
@@ -180,18 +267,16 @@ class ProlificConsent(exp_views.ServeConsent):
         return render(request, "experiments/instructions.html", context)
 
     def post(self, request, *args, **kwargs):
-        subject = subject_from_query_params(self.request)
-        study_id = self.request.GET.get(settings.PROLIFIC_STUDY_PARAM, None)
-        session_id = self.request.GET.get(settings.PROLIFIC_SESSION_PARAM, None)
-
-        assignment = assignment_from_query_params(subject, study_id, session_id)
+        subject, assignment, participant = resolve_participant(self.request)
 
         consent_form = exp_forms.ConsentForm(request.POST)
         if consent_form.is_valid():
-            assignment.consent_accepted = consent_form.cleaned_data["accept"]
+            # the form's choices come back as the strings "True" and "False"
+            assignment.consent_accepted = consent_form.cleaned_data["accept"] == "True"
             if assignment.consent_accepted and assignment.status == "not-started":
                 assignment.status = "started"
             assignment.save()
+            update_participant(request, consent_accepted=assignment.consent_accepted)
             if assignment.consent_accepted:
                 return self.consent_accepted_redirect(assignment, request)
             elif assignment.consent_accepted is False:
@@ -204,13 +289,10 @@ class ProlificConsent(exp_views.ServeConsent):
 
 class ProlificInstructions(View):
     def get(self, request, *args, **kwargs):
-        subject = subject_from_query_params(self.request)
-        study_id = self.request.GET.get(settings.PROLIFIC_STUDY_PARAM, None)
-        session_id = self.request.GET.get(settings.PROLIFIC_SESSION_PARAM, None)
-        if subject is None:
+        if self.request.GET.get(settings.PROLIFIC_PARTICIPANT_PARAM, None) is None:
             raise Http404("Missing Participant ID")
 
-        assignment = assignment_from_query_params(subject, study_id, session_id)
+        subject, assignment, participant = resolve_participant(self.request)
 
         if assignment.consent_accepted is not True and assignment.battery.consent:
             base_url = reverse(
@@ -403,14 +485,18 @@ def remote_studies_list(request, collection_id=None):
         study_collection=study_collection
     ).prefetch_related("subject")
 
-    for study_id in tracked_remote_ids:
+    def fetch_study(study_id):
         try:
-            api_study = fetch_remote_study_details(id=study_id)
-            api_study = api_study["study"]
-            studies_by_status[api_study["status"]].append(api_study)
+            return fetch_remote_study_details(id=study_id)["study"], None
         except Exception as e:
-            print(e)
-            messages.error(request, e)
+            return None, e
+
+    for api_study, error in outgoing_api.call_many(fetch_study, tracked_remote_ids):
+        if error is not None:
+            print(error)
+            messages.error(request, error)
+            continue
+        studies_by_status[api_study["status"]].append(api_study)
 
     publish = False
     draft = False
@@ -574,42 +660,48 @@ def collection_progress(request, collection_id):
     subjects = exp_models.Subject.objects.filter(
         studycollectionsubject__study_collection=collection
     )
-    studies = collection.study_set.all().order_by("rank")
+    studies = list(collection.study_set.all().order_by("rank").select_related("battery"))
+    subject_list = list(subjects)
+
+    # completed assignments per (subject, battery) in one grouped query
+    completed = {
+        (subject_id, battery_id): count
+        for subject_id, battery_id, count in exp_models.Assignment.objects.filter(
+            status="completed",
+            subject__in=subjects,
+            battery__in=[x.battery_id for x in studies],
+        )
+        .order_by()
+        .values("subject_id", "battery_id")
+        .annotate(count=Count("id"))
+        .values_list("subject_id", "battery_id", "count")
+    }
 
     subject_groups = {}
     errors = []
+    for subject in subject_list:
+        subject_groups[subject] = {
+            study.battery_id: {"completed": completed.get((subject.id, study.battery_id), 0)}
+            for study in studies
+        }
 
-    for subject in subjects:
-        subject_groups[subject] = {}
-        for study in studies:
-            completed = exp_models.Assignment.objects.filter(
-                status="completed", subject=subject, battery=study.battery
-            ).count()
-            subject_groups[subject][study.battery.id] = {"completed": completed}
-
-    for study in studies:
-        if subjects.count() == 0 or not study.remote_id:
-            break
-        try:
-            details = fetch_remote_study_details(id=study.remote_id)
-        except Exception as e:
-            errors.append(f"Error on {study.remote_id}: {e}")
-            continue
-        for participant in details["participants"]:
-            try:
-                subject = subjects.get(prolific_id=participant["participant_id"])
-                subject_groups[subject][study.battery.id]["date_added"] = participant[
-                    "datetime_created"
-                ]
-            except ObjectDoesNotExist:
-                subject_groups[subject][study.battery.id]["date_added"] = None
+    members = models.ParticipantGroupMember.objects.filter(
+        participant_group__in=[x.participant_group for x in studies if x.participant_group],
+        participant_id__in=subjects.values("prolific_id"),
+    ).values_list("participant_group", "participant_id", "added_at")
+    studies_by_group = {x.participant_group: x for x in studies if x.participant_group}
+    subjects_by_pid = {x.prolific_id: x for x in subject_list}
+    for group, pid, added_at in members:
+        study = studies_by_group[group]
+        subject_groups[subjects_by_pid[pid]][study.battery_id]["date_added"] = added_at
 
     context = {
         "subject_groups": subject_groups,
         "studies": studies,
-        "subjects": subjects,
+        "subjects": subject_list,
         "collection": collection,
         "errors": errors,
+        "sync_states": sync.staleness(studies),
     }
     return render(request, "prolific/collection_progress.html", context)
 
@@ -638,16 +730,11 @@ def collection_progress_by_prolific_submissions(request, collection_id):
     ).prefetch_related("subject")
 
     subject_study_status = {}
-    for study in studies:
-        if not study.remote_id:
-            continue
-        api_results = outgoing_api.list_submissions(study.remote_id)
-        for result in api_results:
-            if not subject_study_status.get(result["participant_id"], None):
-                subject_study_status[result["participant_id"]] = {}
-            subject_study_status[result["participant_id"]][study.remote_id] = result[
-                "status"
-            ]
+    submissions = models.ProlificSubmission.objects.filter(study__in=studies).order_by(
+        "started_at"
+    ).values_list("participant_id", "study__remote_id", "status")
+    for participant_id, remote_id, status in submissions:
+        subject_study_status.setdefault(participant_id, {})[remote_id] = status
 
     no_api_result_subjects = [
         x.subject.prolific_id
@@ -659,6 +746,7 @@ def collection_progress_by_prolific_submissions(request, collection_id):
         "studies": studies,
         "subject_study_status": subject_study_status,
         "no_api_result_subjects": no_api_result_subjects,
+        "sync_states": sync.staleness(studies),
     }
     return render(
         request, "prolific/collection_progress_by_prolific_submissions.html", context
@@ -667,6 +755,10 @@ def collection_progress_by_prolific_submissions(request, collection_id):
 
 @login_required
 def collection_progress_by_experiment_submissions(request, collection_id):
+    """ Assignment status counts per study from the progress rollup. The
+        per subject table of submitted results is read from the results
+        themselves, so it is only built when asked for with ?subjects=1.
+    """
     collection = get_object_or_404(models.StudyCollection, id=collection_id)
     studies = (
         collection.study_set.all()
@@ -674,6 +766,17 @@ def collection_progress_by_experiment_submissions(request, collection_id):
         .prefetch_related("battery")
         .annotate(exp_count=Count("battery__experiment_instances"))
     )
+    context = {
+        "collection": collection,
+        "studies": studies,
+        "study_status_counts": rollup.study_counts(collection.id),
+        "show_subjects": request.GET.get("subjects") == "1",
+    }
+    if not context["show_subjects"]:
+        return render(
+            request, "prolific/collection_progress_by_experiment_submissions.html", context
+        )
+
     assignments = (
         exp_models.Assignment.objects.filter(
             subject__studycollectionsubject__study_collection=collection
@@ -701,13 +804,11 @@ def collection_progress_by_experiment_submissions(request, collection_id):
         }
         study_assignments[study.id] = (study, single_assignment_per_subject)
 
-    context = {
-        "collection": collection,
-        "studies": studies,
+    context.update({
         "assignments": assignments,
         "subjects": [x.prolific_id for x in subjects],
         "study_assignments": study_assignments,
-    }
+    })
     return render(
         request, "prolific/collection_progress_by_experiment_submissions.html", context
     )
@@ -810,34 +911,16 @@ class ParticipantFormView(LoginRequiredMixin, FormView):
             "prolific:collection-subject-list",
             kwargs={"collection_id": self.kwargs["collection_id"]},
         )
-        subjects = []
-        for id in ids:
-            subject, sub_created = exp_models.Subject.objects.get_or_create(
-                prolific_id=id
-            )
-            subjects.append(subject)
-
-        first_study = collection.study_set.order_by("rank").first()
-        for subject in subjects:
-            (
-                subject_collection,
-                created,
-            ) = models.StudyCollectionSubject.objects.get_or_create(
-                study_collection=collection, subject=subject
-            )
-            if first_study:
-                study_subject, created = models.StudySubject.objects.get_or_create(
-                    study=first_study, subject=subject
-                )
-            print(f"first study: {first_study}, ss.study: {study_subject.study}")
-            if created:
-                on_add_to_collection(subject_collection)
-            if first_study and created:
-                subject_collection.current_study = first_study
-
-        if first_study:
-            print(f"calling add to allow on {first_study.id} with pids: {ids}")
-            first_study.add_to_allowlist(ids)
+        cache.set(
+            onboarding_key(collection.id),
+            {"total": len(set(ids)), "done": 0, "finished": False},
+            settings.ONBOARDING_PROGRESS_TIMEOUT,
+        )
+        transaction.on_commit(
+            partial(async_task, "prolific.tasks.onboard_participants", collection.id, ids),
+            robust=True,
+        )
+        messages.info(self.request, f"Adding {len(ids)} participants in the background.")
 
         return super().form_valid(form)
 
@@ -872,6 +955,7 @@ def study_collection_subject_list(request, collection_id):
     context = {
         "study_collection_subjects": study_collection_subjects,
         "collection": collection,
+        "onboarding": cache.get(onboarding_key(collection_id)),
     }
     return render(request, "prolific/study_collection_subjects.html", context)
 
@@ -899,12 +983,17 @@ def study_collection_subject_detail(
     status = []
     study_subjects = models.StudySubject.objects.filter(
         subject=scs.subject, study__study_collection=scs.study_collection
-    ).order_by("study__rank")
+    ).order_by("study__rank").select_related("study", "assignment")
+    submission_status = dict(
+        models.ProlificSubmission.objects.filter(
+            submission_id__in=[x.prolific_session_id for x in study_subjects if x.prolific_session_id]
+        ).values_list("submission_id", "status")
+    )
     for ss in study_subjects:
         if not ss.prolific_session_id:
             prolific_status = "No Session ID"
         else:
-            prolific_status = ss.get_prolific_status()
+            prolific_status = submission_status.get(ss.prolific_session_id, "Not synced yet")
         includes = ss.assignment.result_set.all().values_list(
             "battery_experiment__experiment_instance__experiment_repo_id__name",
             "include",
@@ -1004,16 +1093,12 @@ def status_count_dict():
     return {status: 0 for status in statuses}
 
 
-def sc_status_counts(study_collection):
-    scs_status_count = list(
-        models.StudyCollectionSubject.objects.filter(study_collection=study_collection)
-        .values("status")
-        .annotate(count=Count("id"))
-    )
+def sc_status_counts(study_collection, counts=None):
+    """ counts is {status: count}, read from the progress rollup if not given. """
+    if counts is None:
+        counts = rollup.collection_counts([study_collection.id])[study_collection.id]
     status_count = status_count_dict()
-    for entry in scs_status_count:
-        status_count[entry["status"]] = entry["count"]
-    total_count = models.StudyCollectionSubject.objects.filter(study_collection=study_collection).count()
+    status_count.update(counts)
     count_by_group = {}
     for k, statuses in status_groups.items():
         count_by_group[k] = sum([status_count[status] for status in statuses])
@@ -1021,18 +1106,18 @@ def sc_status_counts(study_collection):
         "study_collection": study_collection,
         "status_count": status_count,
         "count_by_group": count_by_group,
-        "total": total_count,
+        "total": sum(counts.values()),
     }
 
 
 def get_screener_chain(study_collection):
-    sc_list = [sc_status_counts(study_collection)]
+    chain = [study_collection]
     target_sc = study_collection.screener_for
     while target_sc:
-        sc_list.append(sc_status_counts(target_sc))
+        chain.append(target_sc)
         target_sc = target_sc.screener_for
-    print(sc_list)
-    return sc_list
+    counts = rollup.collection_counts([x.id for x in chain])
+    return [sc_status_counts(x, counts[x.id]) for x in chain]
 
 
 class ScreenerProgressList(LoginRequiredMixin, View):
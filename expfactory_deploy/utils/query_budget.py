@@ -0,0 +1,131 @@
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+"""
+Per request accounting of database queries. QueryBudgetMiddleware records the
+number of queries and time spent in the database for every request and logs
+views that go over their budget in settings.QUERY_BUDGETS, keyed by url name,
+or that repeat the same statement QUERY_BUDGET_REPEAT_LIMIT times or more,
+which is usually an N+1 loop over a queryset. assert_query_budget applies the
+same checks in tests and fails instead of logging.
+"""
+
+logger = logging.getLogger(__name__)
+
+# Recorders active in the current context. Code running queries for a request
+# on another thread copies the context there and enters record_in_thread().
+_recorders = ContextVar("query_recorders", default=())
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN \((?:\s*(?:%s|\?)\s*,?)+\)", re.IGNORECASE)
+_SPACE = re.compile(r"\s+")
+_SAVEPOINT = re.compile(r"^\s*(SAVEPOINT|RELEASE SAVEPOINT|ROLLBACK TO SAVEPOINT)\b", re.IGNORECASE)
+
+
+def fingerprint(sql):
+    """ Statement with literals and IN lists collapsed, so queries that only
+        differ in their parameters compare equal.
+    """
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = sql.replace("%s", "?")
+    sql = _IN_LIST.sub("IN (...)", sql)
+    return _SPACE.sub(" ", sql).strip()
+
+
+class QueryRecorder:
+    """ Database execute wrapper that tallies queries by fingerprint. """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        if _SAVEPOINT.match(sql):
+            return execute(sql, params, many, context)
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def repeated(self, limit=None):
+        """ [(fingerprint, count)] for statements run at least limit times. """
+        limit = limit or settings.QUERY_BUDGET_REPEAT_LIMIT
+        return [(sql, n) for sql, n in self.fingerprints.most_common() if n >= limit]
+
+    def problems(self, view_name, max_queries=None):
+        """ Descriptions of how this recording breaks the budget for view_name. """
+        if max_queries is None:
+            max_queries = settings.QUERY_BUDGETS.get(view_name)
+        problems = []
+        if max_queries is not None and self.count > max_queries:
+            problems.append(f"{view_name} made {self.count} queries, budget is {max_queries}")
+        for sql, n in self.repeated():
+            problems.append(f"{view_name} repeated a query {n} times: {sql}")
+        return problems
+
+
+@contextmanager
+def record_queries():
+    recorder = QueryRecorder()
+    token = _recorders.set(_recorders.get() + (recorder,))
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            yield recorder
+    finally:
+        _recorders.reset(token)
+
+
+@contextmanager
+def record_in_thread():
+    """ Count queries of the block in the recorders of the context it was
+        copied from, for work a request hands to another thread.
+    """
+    with ExitStack() as stack:
+        for recorder in _recorders.get():
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+        yield
+
+
+@contextmanager
+def assert_query_budget(view_name, max_queries=None):
+    """ Fail if the queries made in the block exceed the budget configured
+        for view_name (or max_queries) or contain an N+1 pattern.
+    """
+    with record_queries() as recorder:
+        yield recorder
+    problems = recorder.problems(view_name, max_queries)
+    if problems:
+        raise AssertionError("\n".join(problems))
+
+
+class QueryBudgetMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with record_queries() as recorder:
+            response = self.get_response(request)
+        match = getattr(request, "resolver_match", None)
+        view_name = match.view_name if match else request.path
+        for problem in recorder.problems(view_name):
+            logger.warning(problem)
+        logger.debug(
+            "%s: %s queries in %.1fms", view_name, recorder.count, recorder.duration * 1000
+        )
+        return response
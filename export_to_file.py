@@ -12,7 +12,6 @@ sub-xxx/
 """
 
 
-import ast
 import csv
 import json
 import math
@@ -73,7 +72,7 @@ def dump_assignment(assignment, battery_id):
         except:
             pass
         modified = result.modified.isotime()
-        data = ast.literal_eval(result.data)
+        data = result.get_data()
         order = str(i).zfill(padding)
         fname = result_fname.format(
             sub=sub, batt=battery_id, exp_name=exp_name, order=order
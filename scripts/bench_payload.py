@@ -0,0 +1,77 @@
+'''
+    Compare experiments.utils.payload.decode against ast.literal_eval on
+    synthetic repr-encoded results shaped like jsPsych trial data.
+    Example:
+    python scripts/bench_payload.py 1 5 20
+'''
+import ast
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'expfactory_deploy'))
+
+from experiments.utils.payload import decode
+
+
+def make_payload(target_mb):
+    rng = random.Random(0)
+    trials = []
+    data = {
+        'uniqueid': '0',
+        'status': 'finished',
+        'browser': {'userAgent': 'Mozilla/5.0 (X11; Linux x86_64)'},
+        'trialdata': trials,
+    }
+    size = 0
+    i = 0
+    while size < target_mb * 1024 * 1024:
+        trial = {
+            'rt': rng.choice([None, rng.randint(150, 2000)]),
+            'stimulus': "<div class='centerbox'><p class=\"block-text\">Press the key</p></div>",
+            'response': rng.choice(['f', 'j', None]),
+            'trial_type': 'poldrack-single-stim',
+            'trial_id': rng.choice(['test_trial', 'practice_trial', 'test_attention_check']),
+            'trial_index': i,
+            'time_elapsed': i * 1500 + rng.randint(0, 500),
+            'correct_trial': rng.choice([0, 1]),
+            'correct_response': rng.choice(['f', 'j']),
+            'exp_stage': 'test',
+            'include_subject': True,
+            'feedback': "don't forget to respond quickly",
+            'condition': {'cue': 'AX', 'probe': rng.random()},
+        }
+        trials.append(trial)
+        size += len(repr(trial))
+        i += 1
+    return repr(data)
+
+
+def measure(func, raw):
+    start = time.perf_counter()
+    func(raw)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    func(raw)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak / (1024 * 1024)
+
+
+def main(sizes):
+    print(f"{'size':>8} {'literal_eval':>14} {'decode':>10} {'speedup':>8} {'peak le':>10} {'peak dec':>10}")
+    for size in sizes:
+        raw = make_payload(size)
+        assert decode(raw) == ast.literal_eval(raw)
+        le_time, le_peak = measure(ast.literal_eval, raw)
+        dec_time, dec_peak = measure(decode, raw)
+        print(
+            f"{len(raw) / (1024 * 1024):>6.1f}MB {le_time:>13.2f}s {dec_time:>9.2f}s "
+            f"{le_time / dec_time:>7.1f}x {le_peak:>8.0f}MB {dec_peak:>8.0f}MB"
+        )
+
+
+if __name__ == '__main__':
+    main([float(x) for x in sys.argv[1:]] or [1, 5, 20])
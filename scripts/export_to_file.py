@@ -5,25 +5,26 @@
     docker-compose -f production.yml run --rm django manage.py shell -c "import from scripts.export_to_file import dump_all; dump_all()"
 '''
 from datetime import datetime
-import ast
 import csv
 import json
 import math
 import os
 
+from django.conf import settings
+from django.core.management import call_command
 from django.db.models import Count
 
 import experiments.models as em
 import prolific.models as pm
 
 from .export_assgn_meta import collect_all_assgn_metadata
-output_dir = '/results_export'
+output_dir = settings.RESULTS_EXPORT_DIR
 failed_validation = []
 
 def dump_all():
-    batteries = em.Battery.objects.all()
-    for batt in batteries:
-        dump_battery(batt)
+    # Result files are written by the incremental export_results command,
+    # dump_battery is kept for one off validation runs.
+    call_command('export_results', output_dir=output_dir)
     dump_sc_metadata()
     dump_scs_metadata()
     collect_all_assgn_metadata(output_dir)
@@ -90,7 +91,7 @@ def dump_assignment(assignment, target_dir=None, force=False, validate=False):
             pass
         order = str(i).zfill(padding)
         fname = result_fname.format(sub=sub, batt=target_dir, exp_name=exp_name, order=order, aid=assignment.id)
-        data = ast.literal_eval(result.data)
+        data = result.get_data()
         if validate:
             validate_result(os.path.join(output_dir, target_dir, fname), data)
         if not os.path.isfile(os.path.join(output_dir, target_dir, fname)):